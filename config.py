@@ -524,6 +524,25 @@ async def get_preload_max_cached_accounts() -> int:
     return int(await get_config_value("preload_max_cached_accounts", 20))
 
 
+async def get_rate_limit_max_entries() -> int:
+    """
+    Get rate limit max entries setting.
+    
+    内存中保留速率限制状态的最大密钥数，超出时淘汰最久未使用的记录。
+    
+    Environment variable: RATE_LIMIT_MAX_ENTRIES
+    TOML config key: rate_limit_max_entries
+    Default: 1024
+    """
+    env_value = os.getenv("RATE_LIMIT_MAX_ENTRIES")
+    if env_value:
+        try:
+            return max(1, int(env_value))
+        except ValueError:
+            pass
+    return max(1, int(await get_config_value("rate_limit_max_entries", 1024)))
+
+
 async def get_preload_config() -> dict:
     """
     Get all preload queue configuration as a dictionary.
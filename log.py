@@ -119,6 +119,10 @@ class Logger:
         """记录严重错误信息"""
         _log('critical', message)
     
+    def is_enabled_for(self, level: str) -> bool:
+        """判断指定级别的日志是否会输出（用于跳过昂贵的日志内容构造）"""
+        return LOG_LEVELS.get(level.lower(), LOG_LEVELS['critical']) >= _get_current_log_level()
+    
     def get_current_level(self) -> str:
         """获取当前日志级别名称"""
         current_level = _get_current_log_level()
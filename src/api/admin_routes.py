@@ -212,6 +212,16 @@ async def save_config(payload: Dict[str, Any], token: str = Depends(authenticate
         except Exception as e:
             log.warning(f"Failed to reload KeyManager after config update: {e}")
     
+    # 密钥变更后丢弃操练场缓存的请求生成器
+    if "assembly_api_keys" in updates or "assembly_api_key" in updates:
+        from .playground_api import invalidate_generator_cache
+        invalidate_generator_cache()
+    
+    # 假流式配置变更后立即生效
+    if "fake_stream_enabled" in updates or "fake_stream_speed" in updates:
+        from ..services.assembly_stream_handler import invalidate_fake_stream_settings
+        invalidate_fake_stream_settings()
+    
     return JSONResponse(content={"saved": list(updates.keys())})
 
 
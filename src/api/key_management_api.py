@@ -2,6 +2,7 @@
 密钥管理 API 端点模块
 提供密钥的增删改查、状态管理和导入导出功能
 """
+import time
 from typing import List, Optional, Dict, Any
 from fastapi import APIRouter, HTTPException, Query
 from pydantic import BaseModel, Field
@@ -10,7 +11,7 @@ from log import log
 from ..services.key_manager import get_key_manager
 from ..services.rate_limiter import get_rate_limiter
 from ..stats.stats_tracker import get_stats_tracker
-from ..models.models_key import AggregationMode
+from ..models.models_key import AggregationMode, RateLimitInfo
 
 
 router = APIRouter(prefix="/api/keys", tags=["Key Management"])
@@ -72,6 +73,17 @@ class KeyListResponse(BaseModel):
     keys: List[KeyResponse]
 
 
+def _rate_limit_data(rate_info: RateLimitInfo, now_i: int) -> Dict[str, Any]:
+    """构建密钥的速率限制响应数据"""
+    return {
+        "limit": rate_info.limit,
+        "remaining": rate_info.remaining,
+        "used": rate_info.used,
+        "reset_in_seconds": rate_info.reset_in_seconds_at(now_i),
+        "status": rate_info.status.value
+    }
+
+
 # API Endpoints
 @router.get("", response_model=KeyListResponse)
 async def get_all_keys(
@@ -90,6 +102,7 @@ async def get_all_keys(
         
         all_keys = await key_manager.get_all_keys()
         rate_limits = await rate_limiter.get_all_rate_limits()
+        now_i = int(time.time())  # 整张表共用同一时间快照计算 reset_in_seconds
         
         # 确保所有密钥都在统计中存在
         await unified_stats.ensure_keys_exist([k.key for k in all_keys])
@@ -106,15 +119,7 @@ async def get_all_keys(
             
             # 获取速率限制信息
             rate_info = rate_limits.get(key_info.index)
-            rate_limit_data = None
-            if rate_info:
-                rate_limit_data = {
-                    "limit": rate_info.limit,
-                    "remaining": rate_info.remaining,
-                    "used": rate_info.used,
-                    "reset_in_seconds": rate_info.reset_in_seconds,
-                    "status": rate_info.status.value
-                }
+            rate_limit_data = _rate_limit_data(rate_info, now_i) if rate_info else None
             
             keys_response.append(KeyResponse(
                 index=key_info.index,
@@ -419,6 +424,7 @@ async def get_key_stats():
         
         all_keys = await key_manager.get_all_keys()
         rate_limits = await rate_limiter.get_all_rate_limits()
+        now_i = int(time.time())  # 整张表共用同一时间快照计算 reset_in_seconds
         
         # 确保所有密钥都在统计中存在
         await unified_stats.ensure_keys_exist([k.key for k in all_keys])
@@ -438,15 +444,7 @@ async def get_key_stats():
             
             # 获取速率限制信息
             rate_info = rate_limits.get(key_info.index)
-            rate_limit_data = None
-            if rate_info:
-                rate_limit_data = {
-                    "limit": rate_info.limit,
-                    "remaining": rate_info.remaining,
-                    "used": rate_info.used,
-                    "reset_in_seconds": rate_info.reset_in_seconds,
-                    "status": rate_info.status.value
-                }
+            rate_limit_data = _rate_limit_data(rate_info, now_i) if rate_info else None
             
             stat_entry = {
                 "key_index": key_info.index,
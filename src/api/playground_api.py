@@ -2,18 +2,36 @@
 操练场增强 API 端点模块
 提供请求报文预览和自定义报文发送功能
 """
+import asyncio
+import traceback
 from typing import Dict, Any, Optional
-from fastapi import APIRouter, HTTPException
-from pydantic import BaseModel, Field
+import httpx
+import orjson
+from fastapi import APIRouter, Depends, HTTPException, Request
+from fastapi.responses import JSONResponse, Response
+from pydantic import BaseModel, Field, ValidationError
 
 from log import log
-from ..transform.request_generator import get_request_generator, create_request_generator
+from ..transform.request_generator import PreviewParams, get_request_generator_for
 from ..services.assembly_client import send_assembly_request
+from ..stats.performance_tracker import PerformanceTracker, get_performance_tracker
 from ..models.models import ChatCompletionRequest
 from config import get_assembly_endpoint, get_assembly_api_keys
 
 
-router = APIRouter(prefix="/api/playground", tags=["Playground"])
+class _ORJSONResponse(JSONResponse):
+    """使用 orjson 序列化的 JSON 响应"""
+    
+    def render(self, content: Any) -> bytes:
+        return orjson.dumps(content, option=orjson.OPT_NON_STR_KEYS)
+
+
+router = APIRouter(prefix="/api/playground", tags=["Playground"], default_response_class=_ORJSONResponse)
+
+
+def invalidate_generator_cache():
+    """清空请求生成器缓存（配置变更时调用）"""
+    get_request_generator_for.cache_clear()
 
 
 # Request/Response Models
@@ -55,45 +73,30 @@ class ValidationResponse(BaseModel):
 async def generate_request_preview(request: PreviewRequest):
     """生成请求报文预览"""
     try:
-        # 获取配置
-        try:
-            endpoint = await get_assembly_endpoint()
-        except Exception:
+        # 并发获取配置，任一失败时回退到默认值
+        endpoint, keys = await asyncio.gather(
+            get_assembly_endpoint(), get_assembly_api_keys(), return_exceptions=True
+        )
+        if isinstance(endpoint, Exception):
             endpoint = "https://llm-gateway.assemblyai.com/v1/chat/completions"
-        
-        try:
-            keys = await get_assembly_api_keys()
-            api_key = keys[0] if keys else "sk-your-api-key"
-        except Exception:
+        if isinstance(keys, Exception) or not keys:
             api_key = "sk-your-api-key"
+        else:
+            api_key = keys[0]
         
-        generator = create_request_generator(endpoint, api_key)
-        
-        # 转换 messages 格式
-        messages = []
-        for msg in request.messages:
-            if isinstance(msg, dict):
-                messages.append(msg)
-            else:
-                messages.append({"role": msg.get("role", "user"), "content": msg.get("content", "")})
+        generator = get_request_generator_for(endpoint, api_key)
         
-        params = {
-            "model": request.model,
-            "messages": messages,
-        }
+        # 未设置的可选参数不进入请求体；PreviewRequest 已完成校验，下游不再重复校验
+        params: PreviewParams = request.model_dump(exclude_none=True)
         
-        if request.temperature is not None:
-            params["temperature"] = request.temperature
-        if request.max_tokens is not None:
-            params["max_tokens"] = request.max_tokens
-        if request.top_p is not None:
-            params["top_p"] = request.top_p
-        if request.stream is not None:
-            params["stream"] = request.stream
-        if request.tools is not None:
-            params["tools"] = request.tools
-        if request.tool_choice is not None:
-            params["tool_choice"] = request.tool_choice
+        # 转换 messages 格式（JSON 请求体中的消息通常已是 dict，此时无需转换）
+        messages = params["messages"]
+        if any(type(m) is not dict for m in messages):
+            params["messages"] = [
+                m if type(m) is dict
+                else {"role": getattr(m, "role", "user"), "content": getattr(m, "content", "")}
+                for m in messages
+            ]
         
         preview = generator.generate_request_preview(params)
         
@@ -106,8 +109,9 @@ async def generate_request_preview(request: PreviewRequest):
         )
     except Exception as e:
         log.error(f"Failed to generate request preview: {e}")
-        import traceback
-        log.error(traceback.format_exc())
+        # 完整堆栈仅在 DEBUG 级别输出，避免每次 500 都遍历堆栈
+        if log.is_enabled_for("debug"):
+            log.debug(traceback.format_exc())
         raise HTTPException(status_code=500, detail=str(e))
 
 
@@ -115,7 +119,7 @@ async def generate_request_preview(request: PreviewRequest):
 async def validate_custom_request(request: CustomRequest):
     """验证自定义请求格式"""
     try:
-        generator = get_request_generator()
+        generator = get_request_generator_for()
         
         is_valid, error = generator.validate_custom_request(request.request_json)
         
@@ -132,37 +136,30 @@ async def validate_custom_request(request: CustomRequest):
 async def send_custom_request(request: CustomRequest):
     """发送自定义请求"""
     try:
-        generator = get_request_generator()
+        generator = get_request_generator_for()
         
-        # 验证请求
-        is_valid, error = generator.validate_custom_request(request.request_json)
-        
-        if not is_valid:
+        # 解析并验证请求（JSON 只解析一次，与 /validate 使用同一套结构检查）
+        parsed, error = generator.parse_and_validate(request.request_json)
+        if error:
             raise HTTPException(status_code=400, detail=f"Invalid request: {error}")
         
         if request.validate_only:
             return {"success": True, "message": "Request is valid"}
         
-        # 解析请求
-        parsed = generator.parse_custom_request(request.request_json)
-        if not parsed:
-            raise HTTPException(status_code=400, detail="Failed to parse request")
-        
-        # 构建 ChatCompletionRequest
+        # 由已解析的字典构建 ChatCompletionRequest
         try:
-            chat_request = ChatCompletionRequest(**parsed)
-        except Exception as e:
+            chat_request = ChatCompletionRequest.model_validate(parsed)
+        except ValidationError as e:
             raise HTTPException(status_code=400, detail=f"Invalid request format: {str(e)}")
         
         # 发送请求
         response = await send_assembly_request(chat_request, is_streaming=False)
         
-        # 处理响应
-        if hasattr(response, 'json'):
-            return response.json()
+        # 处理响应：上游已是 JSON 字节，直接透传，不再解析后重新序列化
+        if isinstance(response, httpx.Response):
+            return Response(content=response.content, media_type="application/json")
         elif hasattr(response, 'body'):
-            import json
-            return json.loads(response.body)
+            return Response(content=response.body, media_type="application/json")
         else:
             return {"error": "Unexpected response format"}
             
@@ -177,25 +174,9 @@ async def send_custom_request(request: CustomRequest):
 async def generate_initial_request(request: PreviewRequest):
     """根据操练场参数生成初始自定义请求"""
     try:
-        generator = get_request_generator()
+        generator = get_request_generator_for()
         
-        params = {
-            "model": request.model,
-            "messages": request.messages,
-        }
-        
-        if request.temperature is not None:
-            params["temperature"] = request.temperature
-        if request.max_tokens is not None:
-            params["max_tokens"] = request.max_tokens
-        if request.top_p is not None:
-            params["top_p"] = request.top_p
-        if request.stream is not None:
-            params["stream"] = request.stream
-        if request.tools is not None:
-            params["tools"] = request.tools
-        if request.tool_choice is not None:
-            params["tool_choice"] = request.tool_choice
+        params: PreviewParams = request.model_dump(exclude_none=True)
         
         initial_json = generator.generate_initial_custom_request(params)
         
@@ -211,8 +192,17 @@ async def generate_initial_request(request: PreviewRequest):
 # 性能监控 API 端点
 # ============================================================
 
+def _perf_cache_headers(etag: str) -> Dict[str, str]:
+    """性能面板读接口的缓存头（允许浏览器缓存 2 秒，之后凭 ETag 协商）"""
+    return {"ETag": etag, "Cache-Control": "private, max-age=2"}
+
+
 @router.get("/performance/stats")
-async def get_performance_stats(model: Optional[str] = None):
+async def get_performance_stats(
+    request: Request,
+    model: Optional[str] = None,
+    tracker: PerformanceTracker = Depends(get_performance_tracker)
+):
     """
     获取性能统计数据
     
@@ -223,10 +213,11 @@ async def get_performance_stats(model: Optional[str] = None):
         统计数据，包含 TTFB/TTFT/TPS/延迟的平均值和百分位数
     """
     try:
-        from ..stats.performance_tracker import get_performance_tracker
-        tracker = await get_performance_tracker()
+        headers = _perf_cache_headers(tracker.etag("stats", model))
+        if request.headers.get("if-none-match") == headers["ETag"]:
+            return Response(status_code=304, headers=headers)
         stats = await tracker.get_stats(model=model)
-        return stats
+        return _ORJSONResponse(stats, headers=headers)
     except Exception as e:
         log.error(f"Failed to get performance stats: {e}")
         raise HTTPException(status_code=500, detail=str(e))
@@ -239,7 +230,8 @@ async def get_performance_traces(
     model: Optional[str] = None,
     search: Optional[str] = None,
     start_time: Optional[float] = None,
-    end_time: Optional[float] = None
+    end_time: Optional[float] = None,
+    tracker: PerformanceTracker = Depends(get_performance_tracker)
 ):
     """
     分页查询追踪记录
@@ -256,8 +248,6 @@ async def get_performance_traces(
         分页结果，包含 traces、page、page_size、total、total_pages
     """
     try:
-        from ..stats.performance_tracker import get_performance_tracker
-        tracker = await get_performance_tracker()
         result = await tracker.get_traces_paginated(
             page=page,
             page_size=page_size,
@@ -272,8 +262,48 @@ async def get_performance_traces(
         raise HTTPException(status_code=500, detail=str(e))
 
 
+@router.get("/performance/dashboard")
+async def get_performance_dashboard(
+    page: int = 1,
+    page_size: int = 20,
+    model: Optional[str] = None,
+    search: Optional[str] = None,
+    tracker: PerformanceTracker = Depends(get_performance_tracker)
+):
+    """
+    一次性获取性能面板所需数据（统计、模型列表、分页记录）
+    
+    Args:
+        page: 页码（从 1 开始）
+        page_size: 每页记录数（默认 20）
+        model: 模型筛选
+        search: 搜索 trace_id
+    
+    Returns:
+        {"stats": ..., "models": [...], "traces": 分页结果}
+    """
+    try:
+        stats, models, traces = await asyncio.gather(
+            tracker.get_stats(model=model),
+            tracker.get_models(),
+            tracker.get_traces_paginated(
+                page=page,
+                page_size=page_size,
+                model=model,
+                search=search
+            ),
+        )
+        return {"stats": stats, "models": models, "traces": traces}
+    except Exception as e:
+        log.error(f"Failed to get performance dashboard: {e}")
+        raise HTTPException(status_code=500, detail=str(e))
+
+
 @router.get("/performance/trace/{trace_id}")
-async def get_performance_trace_detail(trace_id: str):
+async def get_performance_trace_detail(
+    trace_id: str,
+    tracker: PerformanceTracker = Depends(get_performance_tracker)
+):
     """
     获取单条追踪详情
     
@@ -284,8 +314,6 @@ async def get_performance_trace_detail(trace_id: str):
         追踪详情，包含 timestamps、metrics、durations
     """
     try:
-        from ..stats.performance_tracker import get_performance_tracker
-        tracker = await get_performance_tracker()
         trace = await tracker.get_trace_by_id(trace_id)
         if not trace:
             raise HTTPException(status_code=404, detail="Trace not found")
@@ -298,7 +326,10 @@ async def get_performance_trace_detail(trace_id: str):
 
 
 @router.get("/performance/models")
-async def get_performance_models():
+async def get_performance_models(
+    request: Request,
+    tracker: PerformanceTracker = Depends(get_performance_tracker)
+):
     """
     获取所有有追踪记录的模型列表
     
@@ -306,29 +337,27 @@ async def get_performance_models():
         模型名称列表
     """
     try:
-        from ..stats.performance_tracker import get_performance_tracker
-        tracker = await get_performance_tracker()
+        headers = _perf_cache_headers(tracker.etag("models"))
+        if request.headers.get("if-none-match") == headers["ETag"]:
+            return Response(status_code=304, headers=headers)
         models = await tracker.get_models()
-        return {"models": models}
+        return _ORJSONResponse({"models": models}, headers=headers)
     except Exception as e:
         log.error(f"Failed to get performance models: {e}")
         raise HTTPException(status_code=500, detail=str(e))
 
 
 @router.delete("/performance/clear")
-async def clear_performance_data():
+async def clear_performance_data(tracker: PerformanceTracker = Depends(get_performance_tracker)):
     """
-    清除所有性能追踪数据
+    清除所有性能追踪数据（只删除少量分片键，同步完成后再返回，前端随后刷新即可看到清空结果）
     
     Returns:
         操作结果
     """
     try:
-        from ..stats.performance_tracker import get_performance_tracker
-        tracker = await get_performance_tracker()
         await tracker.clear_all()
         return {"success": True, "message": "All performance data cleared"}
     except Exception as e:
         log.error(f"Failed to clear performance data: {e}")
         raise HTTPException(status_code=500, detail=str(e))
-
@@ -2,6 +2,7 @@
 数据模型定义 - API 密钥管理增强功能
 定义 KeyInfo、KeyConfig、RateLimitInfo、KeyStats 等数据模型
 """
+import time
 from dataclasses import dataclass, field
 from typing import Dict, List, Optional, Any
 from enum import Enum
@@ -140,7 +141,7 @@ class KeyConfig:
         )
 
 
-@dataclass
+@dataclass(slots=True)
 class RateLimitInfo:
     """速率限制信息"""
     key_index: int                          # 密钥索引
@@ -148,9 +149,17 @@ class RateLimitInfo:
     remaining: int = 0                      # 剩余配额
     used: int = 0                           # 已使用
     reset_time: int = 0                     # 重置时间（Unix时间戳）
-    reset_in_seconds: int = 0               # 距离重置的秒数
     status: KeyStatus = KeyStatus.ACTIVE    # 状态
     
+    @property
+    def reset_in_seconds(self) -> int:
+        """距离重置的秒数（按当前时间计算，不存储）"""
+        return self.reset_in_seconds_at(int(time.time()))
+    
+    def reset_in_seconds_at(self, now: int) -> int:
+        """以给定的 Unix 时间戳计算距离重置的秒数"""
+        return max(0, self.reset_time - now) if self.reset_time > 0 else 0
+    
     def to_dict(self) -> Dict[str, Any]:
         """转换为字典"""
         return {
@@ -163,9 +172,24 @@ class RateLimitInfo:
             "status": self.status.value if isinstance(self.status, KeyStatus) else self.status,
         }
     
+    def to_stored(self) -> Dict[str, Any]:
+        """转换为存储记录（不含派生字段与存储键中已有的 key_index）"""
+        return {
+            "limit": self.limit,
+            "remaining": self.remaining,
+            "used": self.used,
+            "reset_time": self.reset_time,
+            "status": self.status.value if isinstance(self.status, KeyStatus) else self.status,
+        }
+    
     @classmethod
     def from_dict(cls, data: Dict[str, Any]) -> "RateLimitInfo":
         """从字典创建"""
+        return cls.from_stored(data.get("key_index", 0), data)
+    
+    @classmethod
+    def from_stored(cls, key_index: int, data: Dict[str, Any]) -> "RateLimitInfo":
+        """从存储记录创建（密钥索引以存储键为准）"""
         status = data.get("status", "active")
         if isinstance(status, str):
             try:
@@ -174,12 +198,11 @@ class RateLimitInfo:
                 status = KeyStatus.ACTIVE
         
         return cls(
-            key_index=data.get("key_index", 0),
+            key_index=key_index,
             limit=data.get("limit", 0),
             remaining=data.get("remaining", 0),
             used=data.get("used", 0),
             reset_time=data.get("reset_time", 0),
-            reset_in_seconds=data.get("reset_in_seconds", 0),
             status=status,
         )
 
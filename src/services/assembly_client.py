@@ -338,12 +338,14 @@ async def _next_key_index_async(n: int) -> int:
         log.warning(f"Failed to get key enabled status from KeyManager: {e}")
         enabled_map = {}
     
+    # 一次性获取所有已用尽的密钥，避免逐个 await
+    exhausted = await rate_limiter.get_exhausted_keys(range(n))
+    
     # 构建 KeyInfo 列表
     keys = []
     for i in range(n):
         # 检查速率限制状态
-        is_exhausted = await rate_limiter.is_key_exhausted(i)
-        status = KeyStatus.EXHAUSTED if is_exhausted else KeyStatus.ACTIVE
+        status = KeyStatus.EXHAUSTED if i in exhausted else KeyStatus.ACTIVE
         
         # 从 KeyManager 获取实际的禁用状态，默认为启用
         is_enabled = enabled_map.get(i, True)
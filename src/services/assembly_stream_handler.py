@@ -2,513 +2,677 @@
 AssemblyAI Fake Stream Handler
 Handles fake streaming simulation for AssemblyAI responses.
 """
-import json
+import os
 import time
 import uuid
 import asyncio
-from typing import Optional
+from types import MappingProxyType
+from typing import Any, Optional, Tuple
 
-from fastapi.responses import StreamingResponse, JSONResponse
+import orjson
+from fastapi.responses import StreamingResponse
 
 from log import log
 from src.models.models import ChatCompletionRequest
 from src.core.task_manager import create_managed_task
 from src.services.assembly_client import send_assembly_request
-from src.transform.xml_parser import parse_xml_tool_calls
+from src.transform.xml_parser import has_xml_tool_calls, parse_xml_tool_calls
 from src.transform.openai_transfer import gemini_stream_chunk_to_openai
+from src.stats.performance_tracker import get_performance_tracker
 from config import get_config_value
 
-async def convert_streaming_response(gemini_response, model: str) -> StreamingResponse:
-    """转换流式响应为OpenAI格式"""
-    response_id = str(uuid.uuid4())
+# SSE 写合并参数：累积到 4KB 或距上次发送 5ms 即刷新
+SSE_COALESCE_MAX_BYTES = 4096
+SSE_COALESCE_MAX_DELAY = 0.005
+
+# 假流式等待上游响应期间的心跳间隔（秒）
+FAKE_STREAM_HEARTBEAT_INTERVAL = 3.0
+
+# 渐进输出的最小输出间隔（毫秒）与每块最少字符数：低速时拉长间隔而不是发送极小的帧
+FAKE_STREAM_MIN_INTERVAL_MS = 50
+FAKE_STREAM_MIN_CHARS_PER_CHUNK = 32
+
+# 假流式渐进输出配置的缓存有效期（秒），管理端保存配置时会主动失效
+_FAKE_STREAM_SETTINGS_TTL = 5.0
+_fake_stream_settings: Optional[Tuple[float, bool, int]] = None
+
+_SSE_PREFIX_B = b'data: '
+_SSE_PREFIX_LEN = len(_SSE_PREFIX_B)
+_SSE_NL = b"\n\n"
+_SSE_DONE = b"data: [DONE]\n\n"
+
+# 缺省字段的只读空映射，避免 .get(key, {}) 每次调用都新建字典
+_EMPTY: Any = MappingProxyType({})
+
+
+def _sse_frame(obj: Any) -> bytes:
+    """
+    将对象序列化为一个 SSE data 帧（orjson 直接输出紧凑的 UTF-8 bytes）
+
+    帧交给 ASGI 服务器后可能被继续持有，不能复用可变缓冲区；
+    这里用 join 一次性按最终长度分配，省去中间拼接产生的临时对象。
+    """
+    return b"".join((_SSE_PREFIX_B, orjson.dumps(obj), _SSE_NL))
+
+
+def _new_response_id() -> str:
+    """生成 OpenAI 风格的流式响应 ID（hex 形式，比带连字符的 UUID 更短）"""
+    return "chatcmpl-" + uuid.uuid4().hex
+
+
+def _content_frame_parts(response_id: str, created: int, model: str) -> Tuple[bytes, bytes]:
+    """
+    预先序列化渐进输出内容块的固定部分
+
+    返回 (head, tail)，帧为 head + orjson.dumps(content) + tail，
+    循环内只需序列化变化的 content 字符串。
+    """
+    meta = orjson.dumps({
+        "id": response_id,
+        "object": "chat.completion.chunk",
+        "created": created,
+        "model": model,
+    })
+    head = _SSE_PREFIX_B + meta[:-1] + b',"choices":[{"index":0,"delta":{"role":"assistant","content":'
+    tail = b'},"finish_reason":null}]}' + _SSE_NL
+    return head, tail
+
+
+def _fix_tool_call(tc: dict) -> dict:
+    """规范化上游返回的单个工具调用（补全 id/type，arguments 统一为 JSON 字符串）"""
+    func = tc.get("function", _EMPTY)
+    name = func.get("name", "")
+    # 缺省时为 None，最终按空参数 "{}" 输出
+    args = func.get("arguments")
     
-    async def openai_stream_generator():
-        try:
-            # 处理不同类型的响应对象
-            if hasattr(gemini_response, 'body_iterator'):
-                # FastAPI StreamingResponse
-                async for chunk in gemini_response.body_iterator:
-                    if not chunk:
+    # [修复] 参数名映射: 模型生成的 XML 可能使用错误的参数名
+    # 例如 read_file: file_path -> path
+    if name == "read_file":
+        if isinstance(args, dict) and "file_path" in args:
+            args["path"] = args.pop("file_path")
+        elif isinstance(args, str) and "file_path" in args:
+            # 仅在字符串中可能含有该参数时才解析，否则原样透传，避免解析后再序列化
+            try:
+                args_dict = orjson.loads(args)
+                if isinstance(args_dict, dict) and "file_path" in args_dict:
+                    args_dict["path"] = args_dict.pop("file_path")
+                    args = args_dict
+            except orjson.JSONDecodeError:
+                pass
+    
+    # arguments 按 OpenAI 协议须为 JSON 字符串；dict 由 orjson 一次编码，字符串原样透传
+    if isinstance(args, dict):
+        arguments = orjson.dumps(args).decode()
+    elif isinstance(args, str):
+        arguments = args
+    else:
+        arguments = "{}"
+    return {
+        "id": tc.get("id") or "call_" + os.urandom(12).hex(),
+        "type": tc.get("type", "function"),
+        "function": {"name": name, "arguments": arguments},
+    }
+
+
+def _response_body(response) -> bytes:
+    """取出上游响应体的原始 bytes（orjson 可直接解析，无需先解码为 str）"""
+    for attr in ("body", "content"):
+        body = getattr(response, attr, None)
+        if body is not None:
+            return body if isinstance(body, (bytes, bytearray)) else str(body).encode("utf-8")
+    text = getattr(response, "text", None)
+    return (text if text is not None else str(response)).encode("utf-8")
+
+
+async def _get_fake_stream_settings() -> Tuple[bool, int]:
+    """获取假流式渐进输出配置 (enabled, speed)，缓存期内不再访问存储"""
+    global _fake_stream_settings
+    now = time.monotonic()
+    cached = _fake_stream_settings
+    if cached is not None and now - cached[0] < _FAKE_STREAM_SETTINGS_TTL:
+        return cached[1], cached[2]
+    
+    try:
+        enabled, speed = await asyncio.gather(
+            get_config_value("fake_stream_enabled", False),
+            get_config_value("fake_stream_speed", 100),
+        )
+        speed = 100 if speed is None else int(speed)
+    except Exception:
+        enabled, speed = False, 100
+    _fake_stream_settings = (now, enabled, speed)
+    return enabled, speed
+
+
+def invalidate_fake_stream_settings():
+    """清空假流式配置缓存（配置变更时调用）"""
+    global _fake_stream_settings
+    _fake_stream_settings = None
+
+
+def _sse_payload_from_bytes(chunk) -> Optional[bytes]:
+    """提取 bytes 类型 SSE 帧的数据部分，非 data 帧返回 None"""
+    if not chunk.startswith(_SSE_PREFIX_B):
+        return None
+    return chunk[_SSE_PREFIX_LEN:]
+
+
+def _sse_payload_from_str(chunk) -> Optional[str]:
+    """提取 str 类型 SSE 帧的数据部分，非 data 帧返回 None"""
+    chunk_str = str(chunk)
+    if not chunk_str.startswith('data: '):
+        return None
+    return chunk_str[_SSE_PREFIX_LEN:]
+
+
+async def _coalesce_sse(source):
+    """
+    合并连续的 SSE 帧，减少传输层 send 次数
+
+    在迭代方任务内直接驱动上游生成器，不为每帧创建任务。首块立即发送以保证 TTFT；
+    之后紧接着到达的帧先写入缓冲区，缓冲区达到 SSE_COALESCE_MAX_BYTES
+    或距上次发送超过 SSE_COALESCE_MAX_DELAY 时一起发送。等待超过
+    SSE_COALESCE_MAX_DELAY 才到达的帧与缓冲区内容一起立即发送，
+    因此间隔到达的帧（如首个内容块）不会被缓冲，之后的 trace 标记对应实际发送。
+    """
+    loop = asyncio.get_running_loop()
+    it = source.__aiter__()
+    buf = bytearray()
+    first = True
+    last_flush = waiting_since = loop.time()
+    try:
+        async for chunk in it:
+            now = loop.time()
+            if first:
+                first = False
+                yield chunk
+            else:
+                buf += chunk
+                if (len(buf) >= SSE_COALESCE_MAX_BYTES
+                        or now - waiting_since >= SSE_COALESCE_MAX_DELAY
+                        or now - last_flush >= SSE_COALESCE_MAX_DELAY):
+                    yield bytes(buf)
+                    buf.clear()
+                else:
+                    waiting_since = loop.time()
+                    continue
+            last_flush = waiting_since = loop.time()
+        
+        if buf:
+            yield bytes(buf)
+    finally:
+        await it.aclose()
+
+
+async def _openai_stream_generator(gemini_response, model: str):
+    """将上游流式响应逐块转换为 OpenAI 格式的 SSE 帧"""
+    response_id = _new_response_id()
+    created = int(time.time())
+    
+    try:
+        # 处理不同类型的响应对象
+        if hasattr(gemini_response, 'body_iterator'):
+            # FastAPI StreamingResponse
+            # 同一响应的块类型不会变化，按首块类型选定一次提取函数
+            extract_payload = None
+            async for chunk in gemini_response.body_iterator:
+                if not chunk:
+                    continue
+                
+                if isinstance(chunk, dict):
+                    # 进程内交接的块已是 dict，无需序列化后再解析
+                    gemini_chunk = chunk
+                else:
+                    if extract_payload is None:
+                        extract_payload = _sse_payload_from_bytes if isinstance(chunk, (bytes, bytearray)) else _sse_payload_from_str
+                    payload = extract_payload(chunk)
+                    if payload is None:
                         continue
-                    
-                    # 处理不同数据类型的startswith问题
-                    if isinstance(chunk, bytes):
-                        if not chunk.startswith(b'data: '):
-                            continue
-                        payload = chunk[len(b'data: '):]
-                    else:
-                        chunk_str = str(chunk)
-                        if not chunk_str.startswith('data: '):
-                            continue
-                        payload = chunk_str[len('data: '):].encode()
                     try:
-                        gemini_chunk = json.loads(payload.decode())
-                        openai_chunk = gemini_stream_chunk_to_openai(gemini_chunk, model, response_id)
-                        yield f"data: {json.dumps(openai_chunk, separators=(',',':'))}\n\n".encode()
-                    except json.JSONDecodeError:
+                        # orjson 直接解析 bytes 负载，无需先解码
+                        gemini_chunk = orjson.loads(payload)
+                    except orjson.JSONDecodeError:
                         continue
-            else:
-                # 其他类型的响应，尝试直接处理
-                log.warning(f"Unexpected response type: {type(gemini_response)}")
-                error_chunk = {
-                    "id": response_id,
-                    "object": "chat.completion.chunk",
-                    "created": int(time.time()),
-                    "model": model,
-                    "choices": [{
-                        "index": 0,
-                        "delta": {"role": "assistant", "content": "Response type error"},
-                        "finish_reason": "stop"
-                    }]
-                }
-                yield f"data: {json.dumps(error_chunk)}\n\n".encode()
-            
-            # 发送结束标记
-            yield "data: [DONE]\n\n".encode()
-            
-        except Exception as e:
-            log.error(f"Stream conversion error: {e}")
+                
+                openai_chunk = gemini_stream_chunk_to_openai(gemini_chunk, model, response_id, created)
+                yield _sse_frame(openai_chunk)
+        else:
+            # 其他类型的响应，尝试直接处理
+            log.warning(f"Unexpected response type: {type(gemini_response)}")
             error_chunk = {
                 "id": response_id,
                 "object": "chat.completion.chunk",
-                "created": int(time.time()),
+                "created": created,
                 "model": model,
                 "choices": [{
                     "index": 0,
-                    "delta": {"role": "assistant", "content": f"Stream error: {str(e)}"},
+                    "delta": {"role": "assistant", "content": "Response type error"},
                     "finish_reason": "stop"
                 }]
             }
-            yield f"data: {json.dumps(error_chunk)}\n\n".encode()
-            yield "data: [DONE]\n\n".encode()
+            yield _sse_frame(error_chunk)
+        
+        # 发送结束标记
+        yield _SSE_DONE
+        
+    except Exception as e:
+        log.error(f"Stream conversion error: {e}")
+        error_chunk = {
+            "id": response_id,
+            "object": "chat.completion.chunk",
+            "created": created,
+            "model": model,
+            "choices": [{
+                "index": 0,
+                "delta": {"role": "assistant", "content": f"Stream error: {str(e)}"},
+                "finish_reason": "stop"
+            }]
+        }
+        yield _sse_frame(error_chunk)
+        yield _SSE_DONE
 
-    return StreamingResponse(openai_stream_generator(), media_type="text/event-stream")
 
-async def fake_stream_response_for_assembly(openai_request: ChatCompletionRequest, trace=None) -> StreamingResponse:
-    """AssemblyAI 的假流式：周期心跳 + 最终内容块"""
-    async def stream_generator():
-        nonlocal trace
-        completion_tokens = 0
-        prompt_tokens = 0
+async def convert_streaming_response(gemini_response, model: str) -> StreamingResponse:
+    """转换流式响应为OpenAI格式"""
+    return StreamingResponse(_coalesce_sse(_openai_stream_generator(gemini_response, model)), media_type="text/event-stream")
+
+
+async def _fake_stream_generator(openai_request: ChatCompletionRequest, trace=None):
+    """假流式生成器：等待上游完整响应期间发送心跳，收到后按配置输出内容块"""
+    completion_tokens = 0
+    prompt_tokens = 0
+    
+    # 首个心跳暂不发送：上游在一个心跳间隔内返回时，与第一个输出块合并为一次写入
+    heartbeat = {
+        "choices": [{
+            "index": 0,
+            "delta": {"role": "assistant", "content": ""},
+            "finish_reason": None
+        }]
+    }
+    heartbeat_frame = _sse_frame(heartbeat)
+    lead = heartbeat_frame
+    
+    def with_lead(frame: bytes) -> bytes:
+        """把尚未发出的首个心跳拼接到帧前"""
+        nonlocal lead
+        if lead:
+            frame, lead = lead + frame, b""
+        return frame
+    
+    try:
+        log.debug(f"Starting fake stream for model: {openai_request.model}")
+        
+        # 异步发送实际请求
+        async def get_response():
+            return await send_assembly_request(openai_request, False, trace=trace)
+        
+        # 创建请求任务
+        response_task = create_managed_task(get_response(), name="openai_fake_stream_request")
         
         try:
-            log.debug(f"Starting fake stream for model: {openai_request.model}")
+            # 每个心跳间隔发送一次心跳，直到收到响应（响应到达后立即继续，不等满间隔）
+            heartbeat_count = 0
+            while True:
+                done, _ = await asyncio.wait({response_task}, timeout=FAKE_STREAM_HEARTBEAT_INTERVAL)
+                if done:
+                    break
+                heartbeat_count += 1
+                lead = b""
+                yield heartbeat_frame
+                log.debug(f"Sent heartbeat #{heartbeat_count}")
             
-            # 发送心跳
-            heartbeat = {
-                "choices": [{
-                    "index": 0,
-                    "delta": {"role": "assistant", "content": ""},
-                    "finish_reason": None
-                }]
-            }
-            yield f"data: {json.dumps(heartbeat)}\n\n".encode()
-            log.debug("Sent initial heartbeat")
+            # 获取响应结果
+            response = await response_task
             
-            # 异步发送实际请求
-            async def get_response():
-                return await send_assembly_request(openai_request, False, trace=trace)
+            # 性能追踪：上游响应完成
+            if trace:
+                trace.mark("upstream_first_byte")
+                trace.mark("upstream_response_complete")
             
-            # 创建请求任务
-            response_task = create_managed_task(get_response(), name="openai_fake_stream_request")
+            log.debug(f"Received response after {heartbeat_count} heartbeats")
             
+        except asyncio.CancelledError:
+            # 取消任务并传播取消
+            response_task.cancel()
             try:
-                # 每3秒发送一次心跳，直到收到响应
-                heartbeat_count = 0
-                while not response_task.done():
-                    await asyncio.sleep(3.0)
-                    if not response_task.done():
-                        heartbeat_count += 1
-                        yield f"data: {json.dumps(heartbeat)}\n\n".encode()
-                        log.debug(f"Sent heartbeat #{heartbeat_count}")
-                
-                # 获取响应结果
-                response = await response_task
-                
-                # 性能追踪：上游响应完成
-                if trace:
-                    trace.mark("upstream_first_byte")
-                    trace.mark("upstream_response_complete")
+                await response_task
+            except asyncio.CancelledError:
+                pass
+            raise
+        except Exception as e:
+            # 取消任务并处理其他异常
+            response_task.cancel()
+            try:
+                await response_task
+            except asyncio.CancelledError:
+                pass
+            log.error(f"Fake streaming request failed: {e}")
+            raise
+        
+        # 发送实际请求
+        # response 已在上面获取
+        
+        # 处理结果：保持 bytes 直接交给 orjson 解析，仅在输出日志时解码前缀
+        body_bytes = _response_body(response)
+        # 本次响应的所有块共用同一个 created 时间戳
+        created = int(time.time())
+        
+        try:
+            response_data = orjson.loads(body_bytes)
+            if log.is_enabled_for("debug"):
+                log.debug(f"Parsed response data: {body_bytes[:500].decode('utf-8', 'replace')}...")
+
+            # 检查是否是错误响应（支持多种错误格式）
+            error_message = None
+            error_type = "error"
+            error_code = ""
+            
+            # 格式1: {"error": {"message": "...", "type": "...", "code": "..."}}
+            if "error" in response_data:
+                error_info = response_data["error"]
+                error_message = error_info.get("message", "Unknown error")
+                error_type = error_info.get("type", "error")
+                error_code = error_info.get("code", "")
+            # 格式2: {"code": 400, "message": "..."} (AssemblyAI 格式)
+            elif "code" in response_data and response_data.get("code") != 200:
+                error_message = response_data.get("message", "Unknown error")
+                error_code = response_data.get("code", "")
+                error_type = "api_error"
+            
+            if error_message:
+                log.warning(f"Error response in fake stream: {error_message} (type: {error_type}, code: {error_code})")
                 
-                log.debug(f"Received response after {heartbeat_count} heartbeats")
+                # 构建用户友好的错误消息
+                user_message = error_message
+                if error_code == "no_available_keys":
+                    user_message = "所有 API 密钥已被禁用，无法处理请求。请在管理面板中启用至少一个密钥。"
+                elif "processing error" in str(error_message).lower():
+                    user_message = f"模型处理错误: {error_message}。请检查请求格式或尝试其他模型。"
+                elif error_type == "invalid_request_error":
+                    user_message = f"请求错误: {error_message}"
+                elif error_type == "api_error":
+                    user_message = f"API 错误: {error_message}"
                 
-            except asyncio.CancelledError:
-                # 取消任务并传播取消
-                response_task.cancel()
-                try:
-                    await response_task
-                except asyncio.CancelledError:
-                    pass
-                raise
-            except Exception as e:
-                # 取消任务并处理其他异常
-                response_task.cancel()
-                try:
-                    await response_task
-                except asyncio.CancelledError:
-                    pass
-                log.error(f"Fake streaming request failed: {e}")
-                raise
+                # 以流式格式返回错误信息（符合 OpenAI 格式）
+                error_chunk = {
+                    "id": _new_response_id(),
+                    "object": "chat.completion.chunk",
+                    "created": created,
+                    "model": openai_request.model,
+                    "choices": [{
+                        "index": 0,
+                        "delta": {
+                            "role": "assistant",
+                            "content": user_message
+                        },
+                        "finish_reason": "stop"
+                    }]
+                }
+                yield with_lead(_sse_frame(error_chunk))
+                yield _SSE_DONE
+                return
+
+            # 从响应中提取内容和工具调用（适配 AssemblyAI 的多 choices 格式）
+            choices = response_data.get("choices") or []
+            messages = [choice.get("message", _EMPTY) for choice in choices]
+            content = " ".join([
+                c for c in (msg.get("content") for msg in messages)
+                if c and isinstance(c, str) and c.strip()
+            ])
+            # 收集并修复工具调用
+            all_tool_calls = [_fix_tool_call(tc) for msg in messages for tc in (msg.get("tool_calls") or [])]
+            has_tool_use = any(choice.get("finish_reason", "") in ("tool_use", "tool_calls") for choice in choices)
             
-            # 发送实际请求
-            # response 已在上面获取
+            # [XML Parser] 检查并解析 XML 工具调用（含带命名空间前缀的标签）
+            if has_xml_tool_calls(content):
+                log.info(f"[XML Parser] Detected XML tool calls in content, parsing...")
+                content, xml_tool_calls = parse_xml_tool_calls(content)
+                if xml_tool_calls:
+                    log.info(f"[XML Parser] Extracted {len(xml_tool_calls)} XML tool calls")
+                    all_tool_calls.extend(xml_tool_calls)
+                    has_tool_use = True
             
-            # 处理结果
-            # JSONResponse 的内容存储在 body 属性中（bytes）
-            if isinstance(response, JSONResponse):
-                # JSONResponse 的 body 是 bytes，需要解码
-                body_str = response.body.decode('utf-8') if isinstance(response.body, bytes) else str(response.body)
-            elif hasattr(response, 'body'):
-                body_str = response.body.decode('utf-8') if isinstance(response.body, bytes) else str(response.body)
-            elif hasattr(response, 'content'):
-                body_str = response.content.decode('utf-8') if isinstance(response.content, bytes) else str(response.content)
-            elif hasattr(response, 'text'):
-                body_str = response.text
-            else:
-                body_str = str(response)
+            tool_calls = all_tool_calls if all_tool_calls else None
+            reasoning_content = ""
+  
+            # 如果没有正常内容但有思维内容，给出警告
+            if not content and reasoning_content:
+                log.warning("Fake stream response contains only thinking content")
+                content = "[模型正在思考中，请稍后再试或重新提问]"
             
-            try:
-                response_data = json.loads(body_str)
-                log.debug(f"Parsed response data: {json.dumps(response_data, ensure_ascii=False)[:500]}...")
-
-                # 检查是否是错误响应（支持多种错误格式）
-                error_message = None
-                error_type = "error"
-                error_code = ""
+            log.debug(f"[TOOL_DEBUG] Extracted content length: {len(content)}, tool_calls count: {len(all_tool_calls)}")
+            
+            # 性能追踪：格式转换完成
+            if trace:
+                trace.mark("conversion_complete")
+            
+            # 如果有内容或工具调用，都需要返回
+            if content or tool_calls:
+                # 构建响应块，包括思维内容（如果有）和工具调用
                 
-                # 格式1: {"error": {"message": "...", "type": "...", "code": "..."}}
-                if "error" in response_data:
-                    error_info = response_data["error"]
-                    error_message = error_info.get("message", "Unknown error")
-                    error_type = error_info.get("type", "error")
-                    error_code = error_info.get("code", "")
-                # 格式2: {"code": 400, "message": "..."} (AssemblyAI 格式)
-                elif "code" in response_data and response_data.get("code") != 200:
-                    error_message = response_data.get("message", "Unknown error")
-                    error_code = response_data.get("code", "")
-                    error_type = "api_error"
+                # 转换usageMetadata为OpenAI格式（兼容多种格式）
+                usage_raw = response_data.get("usage") or {}
+                prompt_tokens = usage_raw.get("prompt_tokens") or usage_raw.get("input_tokens", 0)
+                completion_tokens = usage_raw.get("completion_tokens") or usage_raw.get("output_tokens", 0)
+                cached_tokens = usage_raw.get("cached_tokens") or usage_raw.get("input_cached_tokens", 0)
                 
-                if error_message:
-                    log.warning(f"Error response in fake stream: {error_message} (type: {error_type}, code: {error_code})")
-                    
-                    # 构建用户友好的错误消息
-                    user_message = error_message
-                    if error_code == "no_available_keys":
-                        user_message = "所有 API 密钥已被禁用，无法处理请求。请在管理面板中启用至少一个密钥。"
-                    elif "processing error" in str(error_message).lower():
-                        user_message = f"模型处理错误: {error_message}。请检查请求格式或尝试其他模型。"
-                    elif error_type == "invalid_request_error":
-                        user_message = f"请求错误: {error_message}"
-                    elif error_type == "api_error":
-                        user_message = f"API 错误: {error_message}"
-                    
-                    # 以流式格式返回错误信息（符合 OpenAI 格式）
-                    error_chunk = {
-                        "id": str(uuid.uuid4()),
-                        "object": "chat.completion.chunk",
-                        "created": int(time.time()),
-                        "model": openai_request.model,
-                        "choices": [{
-                            "index": 0,
-                            "delta": {
-                                "role": "assistant",
-                                "content": user_message
-                            },
-                            "finish_reason": "stop"
-                        }]
+                usage = {
+                    "prompt_tokens": prompt_tokens,
+                    "completion_tokens": completion_tokens,
+                    "total_tokens": usage_raw.get("total_tokens", prompt_tokens + completion_tokens),
+                    # 添加详细的 token 信息以支持 LobeChat 等客户端显示
+                    "prompt_tokens_details": {
+                        "cached_tokens": cached_tokens,
+                        "audio_tokens": 0
+                    },
+                    "completion_tokens_details": {
+                        "reasoning_tokens": 0,
+                        "audio_tokens": 0,
+                        "accepted_prediction_tokens": 0,
+                        "rejected_prediction_tokens": 0
                     }
-                    yield f"data: {json.dumps(error_chunk, ensure_ascii=False)}\n\n".encode()
-                    yield b"data: [DONE]\n\n"
-                    return
-
-                # 从响应中提取内容和工具调用（适配 AssemblyAI 的多 choices 格式）
-                all_content_parts = []
-                all_tool_calls = []
-                has_tool_use = False
-                
-                if "choices" in response_data and response_data["choices"]:
-                    for choice in response_data["choices"]:
-                        msg = choice.get("message", {})
-                        content = msg.get("content")
-                        if content and isinstance(content, str) and content.strip():
-                            all_content_parts.append(content)
-                        
-                        # 收集并修复工具调用
-                        raw_tool_calls = msg.get("tool_calls") or []
-                        for tc in raw_tool_calls:
-                            fixed_tc = {
-                                "id": tc.get("id") or f"call_{uuid.uuid4().hex[:24]}",
-                                "type": tc.get("type", "function"),
-                                "function": {}
-                            }
-                            func = tc.get("function", {})
-                            fixed_tc["function"]["name"] = func.get("name", "")
-                            args = func.get("arguments", {})
-                            
-                            # [修复] 参数名映射: 模型生成的 XML 可能使用错误的参数名
-                            # 例如 read_file: file_path -> path
-                            if fixed_tc["function"]["name"] == "read_file":
-                                if isinstance(args, dict) and "file_path" in args:
-                                    args["path"] = args.pop("file_path")
-                                elif isinstance(args, str):
-                                    try:
-                                        args_dict = json.loads(args)
-                                        if "file_path" in args_dict:
-                                            args_dict["path"] = args_dict.pop("file_path")
-                                            args = args_dict
-                                    except json.JSONDecodeError:
-                                        pass
-                            
-                            if isinstance(args, dict):
-                                fixed_tc["function"]["arguments"] = json.dumps(args, ensure_ascii=False)
-                            elif isinstance(args, str):
-                                fixed_tc["function"]["arguments"] = args
-                            else:
-                                fixed_tc["function"]["arguments"] = "{}"
-                            all_tool_calls.append(fixed_tc)
-                        
-                        # 检查 finish_reason
-                        fr = choice.get("finish_reason", "")
-                        if fr in ("tool_use", "tool_calls"):
-                            has_tool_use = True
-                
-                content = " ".join(all_content_parts) if all_content_parts else ""
-                
-                # [XML Parser] 检查并解析 XML 工具调用
-                if "<function_calls>" in content:
-                    log.info(f"[XML Parser] Detected XML tool calls in content, parsing...")
-                    content, xml_tool_calls = parse_xml_tool_calls(content)
-                    if xml_tool_calls:
-                        log.info(f"[XML Parser] Extracted {len(xml_tool_calls)} XML tool calls")
-                        if not all_tool_calls:
-                            all_tool_calls = []
-                        all_tool_calls.extend(xml_tool_calls)
-                        has_tool_use = True
-                
-                tool_calls = all_tool_calls if all_tool_calls else None
-                reasoning_content = ""
-  
-                # 如果没有正常内容但有思维内容，给出警告
-                if not content and reasoning_content:
-                    log.warning("Fake stream response contains only thinking content")
-                    content = "[模型正在思考中，请稍后再试或重新提问]"
+                } if usage_raw else None
                 
-                log.info(f"[TOOL_DEBUG] Extracted content length: {len(content)}, tool_calls count: {len(all_tool_calls)}")
+                # 记录 token 数用于追踪
+                completion_tokens = usage_raw.get("completion_tokens") or usage_raw.get("output_tokens", 0)
+                prompt_tokens = usage_raw.get("prompt_tokens") or usage_raw.get("input_tokens", 0)
+
+                # 确定 finish_reason
+                finish_reason = "tool_calls" if has_tool_use else "stop"
                 
-                # 性能追踪：格式转换完成
-                if trace:
-                    trace.mark("conversion_complete")
+                # 检查是否启用全局假流式渐进输出
+                fake_stream_enabled, fake_stream_speed = await _get_fake_stream_settings()
                 
-                # 如果有内容或工具调用，都需要返回
-                if content or tool_calls:
-                    # 构建响应块，包括思维内容（如果有）和工具调用
+                if fake_stream_enabled and content and not tool_calls:
+                    # 渐进式流式输出：按速度逐块返回内容
+                    log.info(f"Fake stream progressive output: speed={fake_stream_speed} chars/s, content_len={len(content)}")
                     
-                    # 转换usageMetadata为OpenAI格式（兼容多种格式）
-                    usage_raw = response_data.get("usage") or {}
-                    prompt_tokens = usage_raw.get("prompt_tokens") or usage_raw.get("input_tokens", 0)
-                    completion_tokens = usage_raw.get("completion_tokens") or usage_raw.get("output_tokens", 0)
-                    cached_tokens = usage_raw.get("cached_tokens") or usage_raw.get("input_cached_tokens", 0)
+                    # 计算每块大小和间隔：保持配置的字符速率，同时保证每块至少
+                    # FAKE_STREAM_MIN_CHARS_PER_CHUNK 个字符以摊薄每帧的固定开销
+                    # 例如: 100 chars/s → 每 320ms 输出 32 个字符；2000 chars/s → 每 50ms 输出 100 个字符
+                    interval_ms = max(
+                        FAKE_STREAM_MIN_INTERVAL_MS,
+                        int(FAKE_STREAM_MIN_CHARS_PER_CHUNK * 1000 / max(1, fake_stream_speed)),
+                    )
+                    chars_per_chunk = max(1, int(fake_stream_speed * interval_ms / 1000))
                     
-                    usage = {
-                        "prompt_tokens": prompt_tokens,
-                        "completion_tokens": completion_tokens,
-                        "total_tokens": usage_raw.get("total_tokens", prompt_tokens + completion_tokens),
-                        # 添加详细的 token 信息以支持 LobeChat 等客户端显示
-                        "prompt_tokens_details": {
-                            "cached_tokens": cached_tokens,
-                            "audio_tokens": 0
-                        },
-                        "completion_tokens_details": {
-                            "reasoning_tokens": 0,
-                            "audio_tokens": 0,
-                            "accepted_prediction_tokens": 0,
-                            "rejected_prediction_tokens": 0
-                        }
-                    } if usage_raw else None
+                    response_id = _new_response_id()
+                    # 内容块除 content 外完全相同，固定部分只序列化一次
+                    frame_head, frame_tail = _content_frame_parts(response_id, created, openai_request.model)
+                    # 整段内容只编码一次；编码后长度恰为字符数 + 2 说明每个字符都是
+                    # 单字节且无需转义，此时可直接按字符下标切片编码结果（零拷贝视图）
+                    encoded_content = orjson.dumps(content)
+                    encoded_view = memoryview(encoded_content)[1:-1] if len(encoded_content) == len(content) + 2 else None
                     
-                    # 记录 token 数用于追踪
-                    completion_tokens = usage_raw.get("completion_tokens") or usage_raw.get("output_tokens", 0)
-                    prompt_tokens = usage_raw.get("prompt_tokens") or usage_raw.get("input_tokens", 0)
-
-                    # 确定 finish_reason
-                    finish_reason = "tool_calls" if has_tool_use else "stop"
-                    
-                    # 检查是否启用全局假流式渐进输出
-                    try:
-                        fake_stream_enabled = await get_config_value("fake_stream_enabled", False)
-                        fake_stream_speed = await get_config_value("fake_stream_speed", 100)
-                        if fake_stream_speed is None:
-                            fake_stream_speed = 100
-                        else:
-                            fake_stream_speed = int(fake_stream_speed)
-                    except Exception:
-                        fake_stream_enabled = False
-                        fake_stream_speed = 100
-                    
-                    if fake_stream_enabled and content and not tool_calls:
-                        # 渐进式流式输出：按速度逐块返回内容
-                        log.info(f"Fake stream progressive output: speed={fake_stream_speed} chars/s, content_len={len(content)}")
-                        
-                        # 计算每块大小和间隔
-                        # 例如: 100 chars/s, 每 50ms 输出 5 个字符
-                        interval_ms = 50  # 每 50ms 输出一次
-                        chars_per_chunk = max(1, int(fake_stream_speed * interval_ms / 1000))
+                    # 按固定节拍输出：下一块的目标时间从上一节拍累加，序列化与写出
+                    # 的耗时计入间隔内，而不是额外叠加在每次 sleep 之后
+                    loop = asyncio.get_running_loop()
+                    interval = interval_ms / 1000
+                    next_at = loop.time()
+                    # 逐块输出内容（所有 chunk 的 finish_reason 都为 null）
+                    for i in range(0, len(content), chars_per_chunk):
+                        is_last_content_chunk = (i + chars_per_chunk >= len(content))
                         
-                        response_id = str(uuid.uuid4())
-                        
-                        # 逐块输出内容（所有 chunk 的 finish_reason 都为 null）
-                        for i in range(0, len(content), chars_per_chunk):
-                            chunk_content = content[i:i + chars_per_chunk]
-                            is_last_content_chunk = (i + chars_per_chunk >= len(content))
-                            
-                            chunk_delta = {"role": "assistant", "content": chunk_content}
-                            
-                            # 最后一块内容添加 reasoning_content（如果有）
-                            if is_last_content_chunk and reasoning_content:
-                                chunk_delta["reasoning_content"] = reasoning_content
-                            
-                            content_chunk = {
+                        # 最后一块内容添加 reasoning_content（如果有），需走完整结构
+                        if is_last_content_chunk and reasoning_content:
+                            frame = _sse_frame({
                                 "id": response_id,
                                 "object": "chat.completion.chunk",
-                                "created": int(time.time()),
+                                "created": created,
                                 "model": openai_request.model,
                                 "choices": [{
                                     "index": 0,
-                                    "delta": chunk_delta,
-                                    "finish_reason": None  # 内容 chunk 不设置 finish_reason
+                                    "delta": {
+                                        "role": "assistant",
+                                        "content": content[i:i + chars_per_chunk],
+                                        "reasoning_content": reasoning_content,
+                                    },
+                                    "finish_reason": None
                                 }]
-                            }
-                            
-                            yield f"data: {json.dumps(content_chunk)}\n\n".encode()
-                            
-                            # 性能追踪：首块发送
-                            if i == 0 and trace:
-                                trace.mark("first_chunk_sent")
-                            
-                            # 等待间隔（非最后一块）
-                            if not is_last_content_chunk:
-                                await asyncio.sleep(interval_ms / 1000)
-                        
-                        # 发送单独的结束 chunk（包含 finish_reason 和 usage）
-                        finish_chunk = {
-                            "id": response_id,
-                            "object": "chat.completion.chunk",
-                            "created": int(time.time()),
-                            "model": openai_request.model,
-                            "choices": [{
-                                "index": 0,
-                                "delta": {},  # 空 delta
-                                "finish_reason": finish_reason
-                            }]
-                        }
-                        if usage:
-                            finish_chunk["usage"] = usage
-                        yield f"data: {json.dumps(finish_chunk)}\n\n".encode()
-                        yield b"data: [DONE]\n\n"
-                    else:
-                        # 一次性输出（原逻辑，但分离结束 chunk）
-                        response_id = str(uuid.uuid4())
-                        delta = {"role": "assistant"}
-                        
-                        # 添加 content（如果有）
-                        if content:
-                            delta["content"] = content
-                        
-                        # 添加 reasoning_content（如果有）
-                        if reasoning_content:
-                            delta["reasoning_content"] = reasoning_content
-                        
-                        # 添加 tool_calls（如果有）
-                        if tool_calls:
-                            delta["tool_calls"] = tool_calls
-
-                        # 发送内容 chunk（finish_reason 为 null）
-                        content_chunk = {
-                            "id": response_id,
-                            "object": "chat.completion.chunk",
-                            "created": int(time.time()),
-                            "model": openai_request.model,
-                            "choices": [{
-                                "index": 0,
-                                "delta": delta,
-                                "finish_reason": None
-                            }]
-                        }
-                        yield f"data: {json.dumps(content_chunk)}\n\n".encode()
+                            })
+                        elif encoded_view is not None:
+                            frame = b"".join((
+                                frame_head, b'"', encoded_view[i:i + chars_per_chunk], b'"', frame_tail,
+                            ))
+                        else:
+                            frame = b"".join((frame_head, orjson.dumps(content[i:i + chars_per_chunk]), frame_tail))
+                        yield with_lead(frame)
                         
                         # 性能追踪：首块发送
-                        if trace:
+                        if i == 0 and trace:
                             trace.mark("first_chunk_sent")
-
-                        # 发送单独的结束 chunk（包含 finish_reason 和 usage）
-                        finish_chunk = {
-                            "id": response_id,
-                            "object": "chat.completion.chunk",
-                            "created": int(time.time()),
-                            "model": openai_request.model,
-                            "choices": [{
-                                "index": 0,
-                                "delta": {},
-                                "finish_reason": finish_reason
-                            }]
-                        }
-                        if usage:
-                            finish_chunk["usage"] = usage
-                        yield f"data: {json.dumps(finish_chunk)}\n\n".encode()
-                        yield b"data: [DONE]\n\n"
+                        
+                        # 等待到下一节拍（非最后一块）
+                        if not is_last_content_chunk:
+                            next_at += interval
+                            delay = next_at - loop.time()
+                            if delay > 0:
+                                await asyncio.sleep(delay)
+                    
+                    # 发送单独的结束 chunk（包含 finish_reason 和 usage）
+                    finish_chunk = {
+                        "id": response_id,
+                        "object": "chat.completion.chunk",
+                        "created": created,
+                        "model": openai_request.model,
+                        "choices": [{
+                            "index": 0,
+                            "delta": {},  # 空 delta
+                            "finish_reason": finish_reason
+                        }]
+                    }
+                    if usage:
+                        finish_chunk["usage"] = usage
+                    # 结束 chunk 与 [DONE] 合并为一次写入
+                    yield b"".join((_SSE_PREFIX_B, orjson.dumps(finish_chunk), _SSE_NL, _SSE_DONE))
                 else:
-                    log.warning(f"No content found in response: {response_data}")
-                    # 如果完全没有内容，提供默认回复
-                    error_chunk = {
-                        "id": str(uuid.uuid4()),
+                    # 一次性输出（原逻辑，但分离结束 chunk）
+                    response_id = _new_response_id()
+                    delta = {"role": "assistant"}
+                    
+                    # 添加 content（如果有）
+                    if content:
+                        delta["content"] = content
+                    
+                    # 添加 reasoning_content（如果有）
+                    if reasoning_content:
+                        delta["reasoning_content"] = reasoning_content
+                    
+                    # 添加 tool_calls（如果有）
+                    if tool_calls:
+                        delta["tool_calls"] = tool_calls
+
+                    # 发送内容 chunk（finish_reason 为 null）
+                    content_chunk = {
+                        "id": response_id,
+                        "object": "chat.completion.chunk",
+                        "created": created,
+                        "model": openai_request.model,
+                        "choices": [{
+                            "index": 0,
+                            "delta": delta,
+                            "finish_reason": None
+                        }]
+                    }
+                    # 单独的结束 chunk（包含 finish_reason 和 usage）
+                    finish_chunk = {
+                        "id": response_id,
                         "object": "chat.completion.chunk",
-                        "created": int(time.time()),
-                        "model": "amb2api-streaming",
+                        "created": created,
+                        "model": openai_request.model,
                         "choices": [{
                             "index": 0,
-                            "delta": {"role": "assistant", "content": "[响应为空，请重新尝试]"},
-                            "finish_reason": "stop"
+                            "delta": {},
+                            "finish_reason": finish_reason
                         }]
                     }
-                    yield f"data: {json.dumps(error_chunk)}\n\n".encode()
-            except json.JSONDecodeError:
-                log.error(f"Failed to decode response as JSON: {body_str[:100]}...")
-                # 尝试直接返回文本
+                    if usage:
+                        finish_chunk["usage"] = usage
+                    
+                    # 内容 chunk、结束 chunk 与 [DONE] 一次性写出
+                    yield b"".join((with_lead(b""), _sse_frame(content_chunk), _sse_frame(finish_chunk), _SSE_DONE))
+                    
+                    # 性能追踪：首块发送
+                    if trace:
+                        trace.mark("first_chunk_sent")
+            else:
+                # 直接截取原始响应体，不对整个响应字典做 repr
+                log.warning(f"No content found in response: {body_bytes[:500].decode('utf-8', 'replace')}")
+                # 如果完全没有内容，提供默认回复
                 error_chunk = {
-                    "id": str(uuid.uuid4()),
+                    "id": _new_response_id(),
                     "object": "chat.completion.chunk",
-                    "created": int(time.time()),
-                    "model": openai_request.model,
+                    "created": created,
+                    "model": "amb2api-streaming",
                     "choices": [{
                         "index": 0,
-                        "delta": {"role": "assistant", "content": body_str},
+                        "delta": {"role": "assistant", "content": "[响应为空，请重新尝试]"},
                         "finish_reason": "stop"
                     }]
                 }
-                yield f"data: {json.dumps(error_chunk)}\n\n".encode()
-                
-        except Exception as e:
-            log.error(f"Fake stream generator error: {e}")
+                yield with_lead(_sse_frame(error_chunk))
+        except orjson.JSONDecodeError:
+            body_str = body_bytes.decode("utf-8", "replace")
+            log.error(f"Failed to decode response as JSON: {body_str[:100]}...")
+            # 尝试直接返回文本
             error_chunk = {
-                "id": str(uuid.uuid4()),
+                "id": _new_response_id(),
                 "object": "chat.completion.chunk",
-                "created": int(time.time()),
+                "created": created,
                 "model": openai_request.model,
                 "choices": [{
                     "index": 0,
-                    "delta": {"role": "assistant", "content": f"[System Error] Stream processing failed: {str(e)}"},
+                    "delta": {"role": "assistant", "content": body_str},
                     "finish_reason": "stop"
                 }]
             }
-            yield f"data: {json.dumps(error_chunk)}\n\n".encode()
-            yield b"data: [DONE]\n\n"
-        finally:
-            if trace:
-                from src.stats.performance_tracker import get_performance_tracker
-                tracker = await get_performance_tracker()
-                await tracker.end_trace(trace.trace_id, completion_tokens=completion_tokens, prompt_tokens=prompt_tokens)
+            yield with_lead(_sse_frame(error_chunk))
+            
+    except Exception as e:
+        log.error(f"Fake stream generator error: {e}")
+        error_chunk = {
+            "id": _new_response_id(),
+            "object": "chat.completion.chunk",
+            "created": int(time.time()),
+            "model": openai_request.model,
+            "choices": [{
+                "index": 0,
+                "delta": {"role": "assistant", "content": f"[System Error] Stream processing failed: {str(e)}"},
+                "finish_reason": "stop"
+            }]
+        }
+        yield with_lead(_sse_frame(error_chunk))
+        yield _SSE_DONE
+    finally:
+        if trace:
+            tracker = await get_performance_tracker()
+            await tracker.end_trace(trace.trace_id, completion_tokens=completion_tokens, prompt_tokens=prompt_tokens)
+
 
+async def fake_stream_response_for_assembly(openai_request: ChatCompletionRequest, trace=None) -> StreamingResponse:
+    """AssemblyAI 的假流式：周期心跳 + 最终内容块"""
     return StreamingResponse(
-        stream_generator(),
+        _coalesce_sse(_fake_stream_generator(openai_request, trace)),
         media_type="text/event-stream"
     )
@@ -3,7 +3,7 @@
 管理 API 密钥的增删改查、启用禁用状态
 """
 import time
-from typing import Dict, List, Optional, Any
+from typing import Dict, List, Optional, Any, Set
 
 from log import log
 from ..models.models_key import KeyInfo, KeyConfig, KeyStatus, AggregationMode
@@ -145,6 +145,16 @@ class KeyManager:
         
         return keys
     
+    async def get_all_key_indices(self) -> Set[int]:
+        """获取所有密钥的索引（不构造 KeyInfo）"""
+        if not self._initialized:
+            await self.initialize()
+        
+        if not self._cache:
+            return set()
+        
+        return set(range(len(self._cache.keys)))
+    
     async def get_enabled_keys(self) -> List[KeyInfo]:
         """获取所有启用的密钥"""
         all_keys = await self.get_all_keys()
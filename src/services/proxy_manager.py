@@ -2,13 +2,52 @@
 代理管理器模块
 管理 HTTP/HTTPS 代理配置和热更新
 """
-import re
-from typing import Optional
+import asyncio
+import ipaddress
+import string
+import time
+from typing import Dict, Optional
 from urllib.parse import urlparse
 
 from log import log
+from ..core.task_manager import register_resource
 from ..storage.storage_adapter import get_storage_adapter
 
+# 代理测试客户端缓存（按代理 URL 复用连接池，关闭时由任务管理器统一释放）
+_TEST_CLIENTS_MAX = 8
+_test_clients: Dict[str, "httpx.AsyncClient"] = {}
+_test_clients_lock = asyncio.Lock()
+
+# 主机名允许的字符（非 IP 地址时）
+_HOST_CHARS = frozenset(string.ascii_letters + string.digits + ".-")
+
+
+def _is_valid_host(host: str) -> bool:
+    """主机名只含字母、数字、点与连字符，或为合法的 IP 地址（含 IPv6）"""
+    if set(host) <= _HOST_CHARS:
+        return True
+    try:
+        ipaddress.ip_address(host)
+        return True
+    except ValueError:
+        return False
+
+
+async def _get_test_client(proxy_url: str) -> "httpx.AsyncClient":
+    """获取（或创建）指定代理的测试客户端"""
+    import httpx
+    
+    async with _test_clients_lock:
+        client = _test_clients.get(proxy_url)
+        if client is None or client.is_closed:
+            # 超出上限时关闭最早创建的客户端
+            if len(_test_clients) >= _TEST_CLIENTS_MAX:
+                oldest = next(iter(_test_clients))
+                await _test_clients.pop(oldest).aclose()
+            client = httpx.AsyncClient(proxy=proxy_url, timeout=10.0)
+            _test_clients[proxy_url] = register_resource(client)
+        return client
+
 
 class ProxyManager:
     """代理管理器"""
@@ -16,18 +55,15 @@ class ProxyManager:
     # 支持的代理协议
     SUPPORTED_SCHEMES = ["http", "https", "socks5", "socks5h"]
     
-    # 代理 URL 正则表达式
-    PROXY_URL_PATTERN = re.compile(
-        r'^(https?|socks5h?)://'  # 协议
-        r'(?:([^:@]+)(?::([^@]+))?@)?'  # 可选的用户名:密码@
-        r'([a-zA-Z0-9.-]+|\[[a-fA-F0-9:]+\])'  # 主机名或 IPv6
-        r'(?::(\d+))?'  # 可选的端口
-        r'/?$'  # 可选的尾部斜杠
-    )
+    # 配置缓存有效期（秒）
+    _TTL = 5.0
     
     def __init__(self):
         self._current_proxy: Optional[str] = None
+        self._masked_proxy: str = ""
         self._initialized = False
+        self._loaded_at: float = 0
+        self._adapter = None  # 存储适配器句柄，首次使用后复用
     
     async def initialize(self):
         """初始化代理管理器"""
@@ -36,25 +72,43 @@ class ProxyManager:
         await self._load_proxy_config()
         self._initialized = True
     
+    async def _get_adapter(self):
+        """获取存储适配器（首次获取后复用同一句柄）"""
+        if self._adapter is None:
+            self._adapter = await get_storage_adapter()
+        return self._adapter
+    
     async def _load_proxy_config(self):
         """从存储加载代理配置"""
         try:
-            adapter = await get_storage_adapter()
+            adapter = await self._get_adapter()
             proxy = await adapter.get_config("proxy", "")
             
             if proxy and isinstance(proxy, str) and proxy.strip():
-                if self.validate_proxy_url(proxy.strip()):
-                    self._current_proxy = proxy.strip()
-                    log.info(f"Loaded proxy config: {self._mask_proxy_url(self._current_proxy)}")
+                proxy = proxy.strip()
+                if self.validate_proxy_url(proxy):
+                    self._set_current(proxy)
+                    log.info(f"Loaded proxy config: {self._masked_proxy}")
                 else:
-                    log.warning(f"Invalid proxy URL in config, ignoring: {proxy}")
-                    self._current_proxy = None
+                    log.warning(f"Invalid proxy URL in config, ignoring: {self._mask_proxy_url(proxy)}")
+                    self._set_current(None)
             else:
-                self._current_proxy = None
+                self._set_current(None)
                 log.debug("No proxy configured")
         except Exception as e:
             log.error(f"Failed to load proxy config: {e}")
-            self._current_proxy = None
+            self._set_current(None)
+        self._loaded_at = time.monotonic()
+    
+    async def invalidate(self):
+        """使缓存的代理配置失效，下次获取时从存储重新加载"""
+        self._loaded_at = 0
+    
+    def _set_current(self, proxy: Optional[str]):
+        """更新当前代理，并同步缓存脱敏后的 URL"""
+        if proxy != self._current_proxy:
+            self._masked_proxy = self._mask_proxy_url(proxy) if proxy else ""
+        self._current_proxy = proxy
     
     def _mask_proxy_url(self, url: str) -> str:
         """脱敏代理 URL（隐藏密码）"""
@@ -81,8 +135,9 @@ class ProxyManager:
         if not self._initialized:
             await self.initialize()
         
-        # 每次获取时重新加载，支持热更新
-        await self._load_proxy_config()
+        # 缓存未过期时直接返回，过期后重新加载以支持热更新
+        if time.monotonic() - self._loaded_at >= self._TTL:
+            await self._load_proxy_config()
         
         return self._current_proxy
     
@@ -101,10 +156,11 @@ class ProxyManager:
         
         # 空字符串表示清除代理
         if not proxy_url or not proxy_url.strip():
-            self._current_proxy = None
+            self._set_current(None)
             try:
-                adapter = await get_storage_adapter()
+                adapter = await self._get_adapter()
                 await adapter.set_config("proxy", "")
+                await self.invalidate()
                 log.info("Proxy config cleared")
                 return True
             except Exception as e:
@@ -119,10 +175,11 @@ class ProxyManager:
         
         # 保存配置
         try:
-            adapter = await get_storage_adapter()
+            adapter = await self._get_adapter()
             await adapter.set_config("proxy", proxy_url)
-            self._current_proxy = proxy_url
-            log.info(f"Proxy config set to: {self._mask_proxy_url(proxy_url)}")
+            await self.invalidate()
+            self._set_current(proxy_url)
+            log.info(f"Proxy config set to: {self._masked_proxy}")
             return True
         except Exception as e:
             log.error(f"Failed to save proxy config: {e}")
@@ -141,11 +198,7 @@ class ProxyManager:
         if not proxy_url:
             return False
         
-        # 使用正则表达式验证
-        if not self.PROXY_URL_PATTERN.match(proxy_url):
-            return False
-        
-        # 使用 urlparse 进一步验证
+        # 单次 urlparse 完成协议、主机名、端口校验（IPv6 方括号由 urlparse 处理）
         try:
             parsed = urlparse(proxy_url)
             
@@ -154,7 +207,15 @@ class ProxyManager:
                 return False
             
             # 检查主机名
-            if not parsed.hostname:
+            if not parsed.hostname or not _is_valid_host(parsed.hostname):
+                return False
+            
+            # 携带认证信息时只允许一个 @，且用户名不能为空
+            if "@" in parsed.netloc and (parsed.netloc.count("@") > 1 or not parsed.username):
+                return False
+            
+            # 代理 URL 不允许携带路径、参数或片段（仅允许尾部斜杠）
+            if parsed.path not in ("", "/") or parsed.params or parsed.query or parsed.fragment:
                 return False
             
             # 检查端口（如果指定）
@@ -177,7 +238,6 @@ class ProxyManager:
             测试结果字典，包含 success、latency、error 等字段
         """
         import httpx
-        import time
         
         if proxy_url is None:
             if not self._initialized:
@@ -203,24 +263,24 @@ class ProxyManager:
         start_time = time.time()
         
         try:
-            async with httpx.AsyncClient(proxy=proxy_url, timeout=10.0) as client:
-                response = await client.get(test_url)
-                latency = (time.time() - start_time) * 1000  # 毫秒
-                
-                if response.status_code == 200:
-                    return {
-                        "success": True,
-                        "latency": round(latency, 2),
-                        "status_code": response.status_code,
-                        "proxy_ip": response.json().get("origin", "unknown"),
-                    }
-                else:
-                    return {
-                        "success": False,
-                        "error": f"HTTP {response.status_code}",
-                        "latency": round(latency, 2),
-                        "status_code": response.status_code,
-                    }
+            client = await _get_test_client(proxy_url)
+            response = await client.get(test_url, timeout=10.0)
+            latency = (time.time() - start_time) * 1000  # 毫秒
+            
+            if response.status_code == 200:
+                return {
+                    "success": True,
+                    "latency": round(latency, 2),
+                    "status_code": response.status_code,
+                    "proxy_ip": response.json().get("origin", "unknown"),
+                }
+            else:
+                return {
+                    "success": False,
+                    "error": f"HTTP {response.status_code}",
+                    "latency": round(latency, 2),
+                    "status_code": response.status_code,
+                }
         except httpx.ProxyError as e:
             return {
                 "success": False,
@@ -4,60 +4,293 @@
 """
 import time
 import asyncio
-from typing import Dict, List, Optional, Any
+import heapq
+from collections import OrderedDict
+from typing import Dict, Iterable, List, Optional, Any, Set, Tuple
 
 from log import log
+from ..core.task_manager import create_managed_task
 from ..models.models_key import RateLimitInfo, KeyStatus
 from ..storage.storage_adapter import get_storage_adapter
 
+# 存储键：每个密钥一条记录 rate_limit_info:{idx}；旧版将所有密钥存于 rate_limit_info
+RATE_LIMIT_KEY_PREFIX = "rate_limit_info:"
+LEGACY_RATE_LIMIT_KEY = "rate_limit_info"
+
+# 小于该值的 reset_time 视为距离重置的秒数（约 115 天），否则视为 Unix 时间戳
+RELATIVE_RESET_THRESHOLD = 10_000_000
+
 
 class RateLimiter:
     """速率限制管理器"""
     
+    FLUSH_DEBOUNCE = 0.2  # 合并写入的等待时间（秒）
+    SWEEP_INTERVAL = 1.0  # 后台重置到期密钥的间隔（秒）
+    DEFAULT_MAX_ENTRIES = 1024  # 内存中保留的最大密钥数（可由 rate_limit_max_entries 配置）
+    
     def __init__(self):
-        self._rate_limits: Dict[int, RateLimitInfo] = {}  # 速率限制信息缓存
+        # 速率限制信息缓存（LRU 顺序，最近使用的在末尾）
+        self._rate_limits: "OrderedDict[int, RateLimitInfo]" = OrderedDict()
+        self._max_entries = self.DEFAULT_MAX_ENTRIES
         self._initialized = False
+        self._init_lock = asyncio.Lock()  # 防止并发首次调用重复加载
         self._save_lock = asyncio.Lock()
+        self._dirty: Set[int] = set()  # 待持久化的密钥索引
+        self._saved: Dict[int, Tuple] = {}  # 各密钥最近一次持久化的状态，用于跳过未变化的写入
+        self._evicted_pending: Dict[int, Dict[str, Any]] = {}  # 被淘汰但尚未保存的密钥记录，下次写入时提交
+        self._flush_event = asyncio.Event()
+        self._flusher_task: Optional[asyncio.Task] = None
+        self._sweeper_task: Optional[asyncio.Task] = None
+        self._exhausted: Set[int] = set()  # 当前已用尽的密钥索引
+        self._reset_heap: List[Tuple[int, int]] = []  # (reset_time, key_index) 最小堆，过期条目惰性删除
     
     async def initialize(self):
         """初始化速率限制管理器"""
         if self._initialized:
             return
-        await self._load_rate_limits()
-        self._initialized = True
+        async with self._init_lock:
+            if self._initialized:
+                return
+            try:
+                from config import get_rate_limit_max_entries
+                self._max_entries = await get_rate_limit_max_entries()
+            except Exception as e:
+                log.warning(f"Failed to read rate_limit_max_entries, using default: {e}")
+            await self._load_rate_limits()
+            self._flusher_task = create_managed_task(self._flusher_loop(), name="rate_limit_flusher")
+            self._sweeper_task = create_managed_task(self._sweep_loop(), name="rate_limit_sweeper")
+            self._initialized = True
+    
+    def _mark_dirty(self, key_index: int):
+        """标记密钥状态已变更，由后台任务合并写入"""
+        self._dirty.add(key_index)
+        self._flush_event.set()
+    
+    async def _flusher_loop(self):
+        """后台写入循环：等待变更，防抖后一次性保存"""
+        while True:
+            await self._flush_event.wait()
+            await asyncio.sleep(self.FLUSH_DEBOUNCE)
+            self._flush_event.clear()
+            # 已有保存在进行时跳过：该次保存结束前会重新检查变更集合
+            if self._save_lock.locked():
+                continue
+            await self._save_rate_limits()
+    
+    async def _sweep_loop(self):
+        """后台重置循环：定期从重置时间堆中弹出已到期的已用尽密钥并恢复"""
+        while True:
+            await asyncio.sleep(self.SWEEP_INTERVAL)
+            try:
+                self._expire_resets(time.time())
+            except Exception as e:
+                log.error(f"Rate limit sweep failed: {e}")
+    
+    async def flush(self):
+        """立即保存所有未持久化的变更（用于关闭前）"""
+        if self._dirty or self._evicted_pending:
+            self._flush_event.clear()
+            await self._save_rate_limits()
+    
+    async def close(self):
+        """保存剩余变更并停止后台任务"""
+        await self.flush()
+        tasks = [t for t in (self._flusher_task, self._sweeper_task) if t is not None and not t.done()]
+        self._flusher_task = self._sweeper_task = None
+        for task in tasks:
+            task.cancel()
+        for task in tasks:
+            try:
+                await task
+            except asyncio.CancelledError:
+                pass
+    
+    def _lookup(self, key_index: int) -> Optional[RateLimitInfo]:
+        """读取密钥状态并刷新其 LRU 位置"""
+        info = self._rate_limits.get(key_index)
+        if info is not None:
+            self._rate_limits.move_to_end(key_index)
+        return info
+    
+    def _insert(self, info: RateLimitInfo):
+        """插入密钥状态，超出容量时淘汰记录
+        
+        优先淘汰最久未使用的未用尽密钥（避免已用尽的密钥因淘汰而重新可用），
+        全部已用尽时才淘汰最久未使用的记录。被淘汰的密钥视为“无速率限制信息”，
+        尚未保存的最新状态会在下次写入时提交，待下次 update_rate_limit 时重新建立。
+        """
+        self._rate_limits[info.key_index] = info
+        self._rate_limits.move_to_end(info.key_index)
+        # 重新进入内存的密钥以当前状态为准，不再写入淘汰时的旧记录
+        self._evicted_pending.pop(info.key_index, None)
+        while len(self._rate_limits) > self._max_entries:
+            evicted = next(
+                (idx for idx in self._rate_limits if idx not in self._exhausted and idx != info.key_index),
+                None,
+            )
+            if evicted is None:
+                evicted = next(iter(self._rate_limits))
+            evicted_info = self._rate_limits.pop(evicted)
+            if evicted in self._dirty:
+                self._dirty.discard(evicted)
+                if self._saved.get(evicted) != self._state_of(evicted_info):
+                    self._evicted_pending[evicted] = evicted_info.to_stored()
+                    self._flush_event.set()
+            self._exhausted.discard(evicted)
+            self._saved.pop(evicted, None)
+            log.debug(f"Evicted rate limit info for key {evicted}")
+    
+    @staticmethod
+    def _state_of(info: RateLimitInfo) -> Tuple:
+        """需要持久化的字段快照（reset_in_seconds 为派生值，不参与比较）"""
+        return (info.limit, info.remaining, info.used, info.reset_time, info.status)
+    
+    def _track(self, info: RateLimitInfo, prev_reset_time: Optional[int] = None):
+        """根据密钥状态维护已用尽集合与重置时间堆"""
+        if info.status == KeyStatus.EXHAUSTED or info.remaining <= 0:
+            # 已用尽且重置时间未变时堆中已有有效条目，无需重复入堆
+            already_queued = info.key_index in self._exhausted and prev_reset_time == info.reset_time
+            self._exhausted.add(info.key_index)
+            if info.reset_time > 0 and not already_queued:
+                heapq.heappush(self._reset_heap, (info.reset_time, info.key_index))
+        else:
+            self._exhausted.discard(info.key_index)
+    
+    def _heap_top(self) -> Optional[Tuple[int, int]]:
+        """返回最早重置的已用尽密钥，顺带弹出失效的堆条目"""
+        heap = self._reset_heap
+        while heap:
+            reset_time, idx = heap[0]
+            info = self._rate_limits.get(idx)
+            if idx in self._exhausted and info is not None and info.reset_time == reset_time:
+                return heap[0]
+            heapq.heappop(heap)
+        return None
+    
+    def _expire_resets(self, now: float):
+        """恢复所有重置时间已到的已用尽密钥"""
+        while True:
+            top = self._heap_top()
+            if top is None or top[0] > now:
+                return
+            heapq.heappop(self._reset_heap)
+            self._reset_if_due(self._rate_limits[top[1]], now)
+    
+    def _reset_if_due(self, info: RateLimitInfo, now: float) -> bool:
+        """重置时间已到且配额未恢复时原地重置密钥，并标记待保存"""
+        if info.reset_time > 0 and now >= info.reset_time and (
+            info.remaining != info.limit or info.status != KeyStatus.ACTIVE
+        ):
+            info.remaining = info.limit
+            info.used = 0
+            info.status = KeyStatus.ACTIVE
+            # 配额为 0 的密钥重置后仍视为用尽（remaining <= 0）
+            if info.remaining > 0:
+                self._exhausted.discard(info.key_index)
+            log.info(f"Key {info.key_index} rate limit reset (limit={info.limit})")
+            self._mark_dirty(info.key_index)
+            return True
+        return False
+    
+    def _is_exhausted_sync(self, key_index: int) -> bool:
+        """检查密钥是否已用尽，不涉及任何 await
+        
+        到期重置主要由后台任务完成；已用尽密钥的重置时间已到而后台任务尚未处理时，在此当场重置。
+        """
+        info = self._lookup(key_index)
+        if info is None or key_index not in self._exhausted:
+            return False
+        now = time.time()
+        if 0 < info.reset_time <= now:
+            self._reset_if_due(info, now)
+            return key_index in self._exhausted
+        return True
+    
+    def _earliest_exhausted(self, key_indices: List[int]) -> Optional[Tuple[int, int]]:
+        """返回候选密钥中最早重置的 (reset_time, key_index)"""
+        top = self._heap_top()
+        candidates = set(key_indices)
+        if top is not None and top[1] in candidates:
+            return top
+        # 堆顶不在候选范围内（或堆中只剩已重置但配额为 0 的密钥）时回退到线性查找
+        found = [
+            (info.reset_time, idx)
+            for idx in candidates & self._exhausted
+            if (info := self._rate_limits.get(idx)) is not None and info.reset_time > 0
+        ]
+        return min(found) if found else None
+    
+    def _load_entry(self, key: Any, value: Any):
+        """解析单条存储的速率限制记录（格式不正确时跳过）"""
+        try:
+            idx = int(key)
+            if isinstance(value, dict):
+                info = RateLimitInfo.from_stored(idx, value)
+                self._saved[idx] = self._state_of(info)
+                self._insert(info)
+                self._track(info)
+        except (ValueError, TypeError):
+            pass
     
     async def _load_rate_limits(self):
-        """从存储加载速率限制信息"""
+        """从存储加载速率限制信息（兼容旧版整体存储格式）"""
         try:
             adapter = await get_storage_adapter()
-            data = await adapter.get_config("rate_limit_info", {})
+            all_config = await adapter.get_all_config()
             
-            if isinstance(data, dict):
-                for k, v in data.items():
-                    try:
-                        idx = int(k)
-                        if isinstance(v, dict):
-                            self._rate_limits[idx] = RateLimitInfo.from_dict({
-                                "key_index": idx,
-                                **v
-                            })
-                    except (ValueError, TypeError):
-                        continue
+            # 旧版：所有密钥保存在同一个 rate_limit_info 配置项中
+            legacy = all_config.get(LEGACY_RATE_LIMIT_KEY)
+            if isinstance(legacy, dict):
+                for k, v in legacy.items():
+                    self._load_entry(k, v)
+            
+            # 新版：每个密钥单独保存为 rate_limit_info:{idx}，优先于旧版数据
+            for key, value in all_config.items():
+                if key.startswith(RATE_LIMIT_KEY_PREFIX):
+                    self._load_entry(key[len(RATE_LIMIT_KEY_PREFIX):], value)
             
             log.debug(f"Loaded rate limit info for {len(self._rate_limits)} keys")
         except Exception as e:
             log.error(f"Failed to load rate limit info: {e}")
     
     async def _save_rate_limits(self):
-        """保存速率限制信息到存储"""
+        """保存已变更密钥的速率限制信息到存储（每个密钥单独一条记录）"""
         async with self._save_lock:
-            try:
-                adapter = await get_storage_adapter()
-                data = {str(k): v.to_dict() for k, v in self._rate_limits.items()}
-                await adapter.set_config("rate_limit_info", data)
-                log.debug(f"Saved rate limit info for {len(self._rate_limits)} keys")
-            except Exception as e:
-                log.error(f"Failed to save rate limit info: {e}")
+            # 写入期间产生的新变更在释放锁前一并保存
+            while self._dirty or self._evicted_pending:
+                dirty, self._dirty = self._dirty, set()
+                evicted, self._evicted_pending = self._evicted_pending, {}
+                # 在第一次 await 之前生成写入内容：写入期间被淘汰的密钥不会丢失其状态
+                updates: Dict[int, Dict[str, Any]] = dict(evicted)
+                states: Dict[int, Tuple] = {}
+                for idx in dirty:
+                    info = self._rate_limits.get(idx)
+                    if info is None:
+                        continue
+                    state = self._state_of(info)
+                    if self._saved.get(idx) == state:
+                        continue
+                    updates[idx] = info.to_stored()
+                    states[idx] = state
+                try:
+                    adapter = await get_storage_adapter()
+                    # 所有变更的密钥通过一次批量写入提交
+                    if updates:
+                        payload = {f"{RATE_LIMIT_KEY_PREFIX}{idx}": record for idx, record in updates.items()}
+                        if not await adapter.set_config_many(payload):
+                            raise RuntimeError("storage rejected rate limit update")
+                        self._saved.update({idx: st for idx, st in states.items() if idx in self._rate_limits})
+                    log.debug(f"Saved rate limit info for {len(updates)}/{len(dirty) + len(evicted)} keys")
+                except Exception as e:
+                    # 保存失败时保留变更：仍在内存中的密钥重新标记，已被淘汰的密钥保留其待写入记录
+                    self._dirty |= {idx for idx in dirty if idx in self._rate_limits}
+                    for idx, record in updates.items():
+                        if idx not in self._rate_limits:
+                            self._evicted_pending.setdefault(idx, record)
+                    # 重新通知后台写入任务，防抖后自动重试
+                    self._flush_event.set()
+                    log.error(f"Failed to save rate limit info: {e}")
+                    break
     
     async def update_rate_limit(
         self, 
@@ -78,37 +311,34 @@ class RateLimiter:
         if not self._initialized:
             await self.initialize()
         
-        current_time = time.time()
+        now_i = int(time.time())
         
-        # 如果 reset_time 是秒数（小于当前时间戳的一半），转换为时间戳
-        if reset_time > 0 and reset_time < current_time / 2:
-            reset_time = int(current_time + reset_time)
+        # 小于阈值的 reset_time 视为相对秒数，转换为时间戳
+        if 0 < reset_time < RELATIVE_RESET_THRESHOLD:
+            reset_time = now_i + reset_time
         
-        # 计算距离重置的秒数
-        reset_in_seconds = max(0, reset_time - int(current_time)) if reset_time > 0 else 0
+        status = KeyStatus.EXHAUSTED if remaining <= 0 else KeyStatus.ACTIVE
         
-        # 确定状态
-        if remaining <= 0:
-            status = KeyStatus.EXHAUSTED
+        info = self._lookup(key_index)
+        if info is None:
+            info = RateLimitInfo(key_index=key_index)
+            self._insert(info)
+            prev_reset_time = None
         else:
-            status = KeyStatus.ACTIVE
+            prev_reset_time = info.reset_time
         
-        info = RateLimitInfo(
-            key_index=key_index,
-            limit=limit,
-            remaining=remaining,
-            used=limit - remaining,
-            reset_time=reset_time,
-            reset_in_seconds=reset_in_seconds,
-            status=status,
-        )
+        # 原地更新，避免每次响应都创建新对象
+        info.limit = limit
+        info.remaining = remaining
+        info.used = limit - remaining
+        info.reset_time = reset_time
+        info.status = status
+        self._track(info, prev_reset_time)
         
-        self._rate_limits[key_index] = info
+        log.debug(f"Updated rate limit for key {key_index}: limit={limit}, remaining={remaining}, reset_in={info.reset_in_seconds_at(now_i)}s")
         
-        log.debug(f"Updated rate limit for key {key_index}: limit={limit}, remaining={remaining}, reset_in={reset_in_seconds}s")
-        
-        # 异步保存
-        asyncio.create_task(self._save_rate_limits())
+        # 交由后台任务合并保存
+        self._mark_dirty(key_index)
     
     async def is_key_exhausted(self, key_index: int) -> bool:
         """
@@ -123,14 +353,7 @@ class RateLimiter:
         if not self._initialized:
             await self.initialize()
         
-        # 先检查是否需要重置
-        await self.reset_key_if_time_reached(key_index)
-        
-        info = self._rate_limits.get(key_index)
-        if not info:
-            return False
-        
-        return info.status == KeyStatus.EXHAUSTED or info.remaining <= 0
+        return self._is_exhausted_sync(key_index)
     
     async def get_rate_limit_info(self, key_index: int) -> Optional[RateLimitInfo]:
         """
@@ -145,38 +368,18 @@ class RateLimiter:
         if not self._initialized:
             await self.initialize()
         
-        # 先检查是否需要重置
-        await self.reset_key_if_time_reached(key_index)
-        
-        info = self._rate_limits.get(key_index)
-        if info:
-            # 更新 reset_in_seconds
-            current_time = time.time()
-            info.reset_in_seconds = max(0, info.reset_time - int(current_time)) if info.reset_time > 0 else 0
-        
-        return info
+        return self._lookup(key_index)
     
     async def get_all_rate_limits(self) -> Dict[int, RateLimitInfo]:
-        """获取所有速率限制信息"""
+        """获取所有速率限制信息（reset_in_seconds 由模型按当前时间计算）"""
         if not self._initialized:
             await self.initialize()
         
-        current_time = time.time()
-        result = {}
-        
-        for key_index, info in self._rate_limits.items():
-            # 检查是否需要重置
-            if info.reset_time > 0 and current_time >= info.reset_time:
-                info.remaining = info.limit
-                info.used = 0
-                info.status = KeyStatus.ACTIVE
-                info.reset_in_seconds = 0
-            else:
-                info.reset_in_seconds = max(0, info.reset_time - int(current_time)) if info.reset_time > 0 else 0
-            
-            result[key_index] = info
-        
-        return result
+        # 全表返回前补做一次重置（包括未用尽的密钥），避免展示过期的配额
+        now = time.time()
+        for info in self._rate_limits.values():
+            self._reset_if_due(info, now)
+        return dict(self._rate_limits)
     
     async def reset_key_if_time_reached(self, key_index: int) -> bool:
         """
@@ -186,31 +389,35 @@ class RateLimiter:
             key_index: 密钥索引
         
         Returns:
-            是否进行了重置
+            是否进行了重置（配额已是满额时不重复重置）
         """
         if not self._initialized:
             await self.initialize()
         
+        return self._reset_key_if_time_reached(key_index)
+    
+    def _reset_key_if_time_reached(self, key_index: int) -> bool:
+        """reset_key_if_time_reached 的同步实现（调用方需确保已初始化）"""
         info = self._rate_limits.get(key_index)
         if not info:
             return False
+        return self._reset_if_due(info, time.time())
+    
+    async def get_exhausted_keys(self, key_indices: Iterable[int]) -> Set[int]:
+        """
+        批量检查密钥是否已用尽（一次 await 完成所有候选的检查）
         
-        current_time = time.time()
+        Args:
+            key_indices: 密钥索引列表
         
-        if info.reset_time > 0 and current_time >= info.reset_time:
-            # 重置
-            info.remaining = info.limit
-            info.used = 0
-            info.status = KeyStatus.ACTIVE
-            info.reset_in_seconds = 0
-            
-            log.info(f"Key {key_index} rate limit reset (limit={info.limit})")
-            
-            # 异步保存
-            asyncio.create_task(self._save_rate_limits())
-            return True
+        Returns:
+            其中已用尽的密钥索引集合
+        """
+        if not self._initialized:
+            await self.initialize()
         
-        return False
+        self._expire_resets(time.time())
+        return {idx for idx in key_indices if self._is_exhausted_sync(idx)}
     
     async def get_next_available_key(self, key_indices: List[int]) -> Optional[int]:
         """
@@ -225,29 +432,25 @@ class RateLimiter:
         if not self._initialized:
             await self.initialize()
         
+        # 已用尽密钥的到期重置只需查看堆顶；候选扫描中不再有任何 await
+        now = time.time()
+        self._expire_resets(now)
         for idx in key_indices:
-            if not await self.is_key_exhausted(idx):
+            if not self._is_exhausted_sync(idx):
                 return idx
         
         # 所有密钥都用尽，找最早重置的
-        earliest_reset = None
-        earliest_idx = None
-        
-        for idx in key_indices:
-            info = self._rate_limits.get(idx)
-            if info and info.reset_time > 0:
-                if earliest_reset is None or info.reset_time < earliest_reset:
-                    earliest_reset = info.reset_time
-                    earliest_idx = idx
-        
-        if earliest_idx is not None:
-            log.warning(f"All keys exhausted, earliest reset: key {earliest_idx} in {earliest_reset - time.time():.0f}s")
+        earliest = self._earliest_exhausted(key_indices)
+        if earliest is None:
+            return None
         
+        earliest_reset, earliest_idx = earliest
+        log.warning(f"All keys exhausted, earliest reset: key {earliest_idx} in {earliest_reset - time.time():.0f}s")
         return earliest_idx
     
     async def get_earliest_reset_time(self, key_indices: List[int]) -> Optional[int]:
         """
-        获取最早的重置时间
+        获取已用尽密钥中最早的重置时间
         
         Args:
             key_indices: 密钥索引列表
@@ -258,24 +461,31 @@ class RateLimiter:
         if not self._initialized:
             await self.initialize()
         
-        earliest = None
-        for idx in key_indices:
-            info = self._rate_limits.get(idx)
-            if info and info.reset_time > 0:
-                if earliest is None or info.reset_time < earliest:
-                    earliest = info.reset_time
-        
-        return earliest
+        self._expire_resets(time.time())
+        earliest = self._earliest_exhausted(key_indices)
+        return earliest[0] if earliest else None
 
 
 # 全局实例
 _rate_limiter: Optional[RateLimiter] = None
+_rate_limiter_lock = asyncio.Lock()
 
 
 async def get_rate_limiter() -> RateLimiter:
-    """获取全局速率限制管理器实例"""
+    """获取全局速率限制管理器实例（已创建时直接返回，不加锁）"""
     global _rate_limiter
-    if _rate_limiter is None:
-        _rate_limiter = RateLimiter()
-        await _rate_limiter.initialize()
+    if _rate_limiter is not None:
+        return _rate_limiter
+    async with _rate_limiter_lock:
+        if _rate_limiter is None:
+            limiter = RateLimiter()
+            await limiter.initialize()
+            # 初始化完成后再发布，避免并发调用拿到未就绪的实例
+            _rate_limiter = limiter
     return _rate_limiter
+
+
+async def close_rate_limiter():
+    """保存全局速率限制管理器中未持久化的变更并停止后台写入（未创建时跳过）"""
+    if _rate_limiter is not None:
+        await _rate_limiter.close()
@@ -8,14 +8,84 @@
 - 支持分页查询和模型筛选
 - 链路追踪支持各阶段耗时统计
 """
+import os
 import time
+import zlib
 import asyncio
-from typing import Dict, List, Optional, Any
+import heapq
+from array import array
+from typing import Dict, List, Optional, Any, Tuple
 from dataclasses import dataclass, field, asdict
 from datetime import datetime
 import json
 
 from log import log
+from ..core.task_manager import create_managed_task
+
+
+# 链路追踪阶段（按时间先后顺序）
+_STAGES = (
+    "request_received",
+    "auth_complete",
+    "preprocessing_complete",
+    "key_selection_complete",
+    "upstream_request_sent",
+    "upstream_first_byte",
+    "upstream_response_complete",
+    "conversion_complete",
+    "first_chunk_sent",
+    "response_complete",
+)
+
+# 长循环中每处理 1024 条记录让出一次事件循环
+YIELD_EVERY_MASK = 0x3FF
+
+
+def _durations_from_ts(ts: Dict[str, float]) -> Dict[str, float]:
+    """根据时间戳字典计算各阶段耗时（毫秒）"""
+    durations = {}
+    prev_time = None
+    for stage in _STAGES:
+        t = ts.get(stage)
+        if t is None:
+            continue
+        durations[stage] = t - prev_time if prev_time is not None else 0.0
+        prev_time = t
+    return durations
+
+
+def _metrics_from_ts(ts: Dict[str, float], tokens: int) -> Dict[str, float]:
+    """根据时间戳字典计算关键指标（毫秒）"""
+    metrics = {}
+    
+    # TTFB: 从请求到上游首字节
+    if "request_received" in ts and "upstream_first_byte" in ts:
+        metrics["ttfb"] = ts["upstream_first_byte"] - ts["request_received"]
+    
+    # TTFT: 从请求到首块发送
+    if "request_received" in ts and "first_chunk_sent" in ts:
+        metrics["ttft"] = ts["first_chunk_sent"] - ts["request_received"]
+    
+    # 总延迟
+    if "request_received" in ts and "response_complete" in ts:
+        metrics["total_latency"] = ts["response_complete"] - ts["request_received"]
+        
+        # TPS: tokens per second
+        if tokens > 0 and metrics["total_latency"] > 0:
+            metrics["tps"] = tokens / (metrics["total_latency"] / 1000)
+    
+    return metrics
+
+
+def _record_metrics(record: Dict[str, Any]) -> Tuple[Dict[str, float], Dict[str, float]]:
+    """读取记录中保存的指标与阶段耗时；旧记录没有保存时回退到按时间戳计算"""
+    metrics = record.get("metrics")
+    durations = record.get("durations")
+    if metrics is None or durations is None:
+        ts = record.get("timestamps", {})
+        metrics = _metrics_from_ts(ts, record.get("completion_tokens", 0))
+        durations = _durations_from_ts(ts)
+    return metrics, durations
 
 
 @dataclass
@@ -34,6 +104,10 @@ class RequestTrace:
     key_masked: str = ""  # 脱敏后的密钥（如 "sk-ab...xy"）
     account_email: str = ""  # 归属账户邮箱
     
+    # 结束追踪时计算的指标与阶段耗时（作为记录的顶层字段保存，读取时无需重新计算）
+    metrics: Optional[Dict[str, float]] = None
+    durations: Optional[Dict[str, float]] = None
+    
     # 内部计时基准（用于高精度计时）
     _base_time: float = field(default=0.0, repr=False)
     
@@ -47,51 +121,11 @@ class RequestTrace:
     
     def get_stage_durations(self) -> Dict[str, float]:
         """计算各阶段耗时（毫秒）"""
-        stages = [
-            "request_received",
-            "auth_complete", 
-            "preprocessing_complete",
-            "key_selection_complete",
-            "upstream_request_sent",
-            "upstream_first_byte",
-            "upstream_response_complete",
-            "conversion_complete",
-            "first_chunk_sent",
-            "response_complete"
-        ]
-        durations = {}
-        prev_time = None
-        for stage in stages:
-            if stage in self.timestamps:
-                if prev_time is not None:
-                    durations[stage] = self.timestamps[stage] - prev_time
-                else:
-                    durations[stage] = 0.0
-                prev_time = self.timestamps[stage]
-        return durations
+        return _durations_from_ts(self.timestamps)
     
     def get_metrics(self) -> Dict[str, float]:
         """获取关键指标（毫秒）"""
-        ts = self.timestamps
-        metrics = {}
-        
-        # TTFB: 从请求到上游首字节
-        if "request_received" in ts and "upstream_first_byte" in ts:
-            metrics["ttfb"] = ts["upstream_first_byte"] - ts["request_received"]
-        
-        # TTFT: 从请求到首块发送
-        if "request_received" in ts and "first_chunk_sent" in ts:
-            metrics["ttft"] = ts["first_chunk_sent"] - ts["request_received"]
-        
-        # 总延迟
-        if "request_received" in ts and "response_complete" in ts:
-            metrics["total_latency"] = ts["response_complete"] - ts["request_received"]
-            
-            # TPS: tokens per second
-            if self.completion_tokens > 0 and metrics["total_latency"] > 0:
-                metrics["tps"] = self.completion_tokens / (metrics["total_latency"] / 1000)
-        
-        return metrics
+        return _metrics_from_ts(self.timestamps, self.completion_tokens)
     
     def to_dict(self) -> Dict[str, Any]:
         """转换为字典（用于存储）"""
@@ -105,7 +139,9 @@ class RequestTrace:
             "prompt_tokens": self.prompt_tokens,
             "key_index": self.key_index,
             "key_masked": self.key_masked,
-            "account_email": self.account_email
+            "account_email": self.account_email,
+            "metrics": self.metrics,
+            "durations": self.durations,
         }
     
     @classmethod
@@ -123,6 +159,8 @@ class RequestTrace:
         trace.key_index = data.get("key_index", -1)
         trace.key_masked = data.get("key_masked", "")
         trace.account_email = data.get("account_email", "")
+        trace.metrics = data.get("metrics")
+        trace.durations = data.get("durations")
         return trace
 
 
@@ -173,16 +211,74 @@ class ShardManager:
         self.shard_counts = {int(k): v for k, v in shard_counts.items()}
 
 
+_NAN = float("nan")
+
+
+class TraceColumns:
+    """
+    追踪指标的列式存储（SoA）
+    
+    每条记录在各列中占同一下标，缺失的指标记为 NaN。
+    统计时直接处理连续的 float 数组，不再逐条访问嵌套字典。
+    """
+    __slots__ = ("start_time", "ttfb", "ttft", "latency", "tps", "models")
+    
+    def __init__(self):
+        self.start_time = array("d")
+        self.ttfb = array("d")
+        self.ttft = array("d")
+        self.latency = array("d")
+        self.tps = array("d")
+        self.models: List[str] = []
+    
+    def __len__(self) -> int:
+        return len(self.start_time)
+    
+    def append(self, record: Dict[str, Any]):
+        """追加一条已持久化的追踪记录"""
+        metrics = record.get("metrics")
+        if metrics is None:
+            metrics = _metrics_from_ts(record.get("timestamps", {}), record.get("completion_tokens", 0))
+        self.start_time.append(record.get("start_time", 0))
+        self.ttfb.append(metrics.get("ttfb", _NAN))
+        self.ttft.append(metrics.get("ttft", _NAN))
+        self.latency.append(metrics.get("total_latency", _NAN))
+        self.tps.append(metrics.get("tps", _NAN))
+        self.models.append(record.get("model", "unknown"))
+    
+    def trim(self, max_len: int):
+        """丢弃最旧的记录，使总数不超过 max_len"""
+        excess = len(self) - max_len
+        if excess <= 0:
+            return
+        for col in (self.start_time, self.ttfb, self.ttft, self.latency, self.tps, self.models):
+            del col[:excess]
+
+
+def _summarize(values: array, percentiles: tuple) -> Dict[str, float]:
+    """计算非负有效值的平均值与分位数（NaN 与负值被排除）"""
+    # NaN 参与比较恒为 False，这里一并过滤
+    data = sorted(v for v in values if v >= 0)
+    n = len(data)
+    result = {"avg": round(sum(data) / n, 1) if n else 0.0}
+    for p in percentiles:
+        result[f"p{p}"] = round(data[min(int(n * p / 100), n - 1)], 1) if n else 0.0
+    return result
+
+
 class PerformanceTracker:
     """
     性能追踪管理器
     
     提供:
     - 请求追踪的开始/结束
-    - 分片持久化存储
+    - 分片持久化存储（后台队列批量写入）
     - 分页查询
     - 统计聚合
     """
+    SAVE_QUEUE_MAXSIZE = 10000  # 待写入队列容量
+    SAVE_BATCH_SIZE = 64        # 单批最多写入记录数
+    SAVE_BATCH_TIMEOUT = 0.05   # 凑批等待时间（秒）
     
     def __init__(self):
         self.active_traces: Dict[str, RequestTrace] = {}
@@ -193,6 +289,14 @@ class PerformanceTracker:
         self._stats_cache: Optional[Dict[str, Any]] = None
         self._stats_cache_time: float = 0
         self._stats_cache_ttl: float = 10.0  # 统计缓存 10 秒
+        self._stats_cache_version: int = -1  # 缓存对应的数据版本号
+        self._save_queue: asyncio.Queue = asyncio.Queue(maxsize=self.SAVE_QUEUE_MAXSIZE)
+        self._writer_task: Optional[asyncio.Task] = None
+        self._columns: Optional[TraceColumns] = None  # 首次统计时从存储加载
+        self._by_model: Dict[str, TraceColumns] = {}  # 按模型分桶的列式存储
+        self._storage_adapter = None  # 存储适配器句柄，首次使用后复用
+        self._version = 0  # 数据版本号，每次写入或清空后递增，用于生成 ETag
+        self._etag_salt = os.urandom(4).hex()  # 区分不同进程生命周期的 ETag
     
     async def initialize(self):
         """初始化，从存储加载元数据"""
@@ -202,8 +306,7 @@ class PerformanceTracker:
             if self._initialized:
                 return
             try:
-                from ..storage.storage_adapter import get_storage_adapter
-                adapter = await get_storage_adapter()
+                adapter = await self._get_adapter()
                 meta = await adapter.get_perf("perf_meta", None)
                 if meta and isinstance(meta, dict):
                     self.shard_manager.from_dict(meta)
@@ -212,8 +315,22 @@ class PerformanceTracker:
                     log.info("Performance tracker initialized: no existing data")
             except Exception as e:
                 log.warning(f"Failed to load performance tracker meta: {e}")
+            self._writer_task = create_managed_task(self._writer(), name="perf_trace_writer")
             self._initialized = True
     
+    def etag(self, *parts: Any) -> str:
+        """生成当前数据版本的弱 ETag（parts 用于区分不同查询）"""
+        # 查询参数可能包含引号或非 ASCII 字符，取校验和后再放入响应头
+        key = "|".join(str(p) for p in parts if p is not None)
+        return f'W/"{self._etag_salt}-{self._version}-{zlib.crc32(key.encode()):08x}"'
+    
+    async def _get_adapter(self):
+        """获取存储适配器（首次获取后复用同一句柄）"""
+        if self._storage_adapter is None:
+            from ..storage.storage_adapter import get_storage_adapter
+            self._storage_adapter = await get_storage_adapter()
+        return self._storage_adapter
+    
     def start_trace(self, trace_id: str, model: str) -> RequestTrace:
         """开始追踪"""
         trace = RequestTrace(
@@ -244,52 +361,87 @@ class PerformanceTracker:
         if "response_complete" not in trace.timestamps:
             trace.mark("response_complete")
         
-        # 记录指标
-        metrics = trace.get_metrics()
+        # 记录指标，随记录一起保存供读取路径直接使用
+        metrics = trace.metrics = trace.get_metrics()
+        trace.durations = trace.get_stage_durations()
         log.info(f"Trace {trace_id[:8]}... completed: model={trace.model}, "
                  f"ttfb={metrics.get('ttfb', 0):.0f}ms, "
                  f"ttft={metrics.get('ttft', 0):.0f}ms, "
                  f"total={metrics.get('total_latency', 0):.0f}ms, "
                  f"tps={metrics.get('tps', 0):.1f}")
         
-        # 异步持久化
-        asyncio.create_task(self._save_trace(trace))
+        # 交给后台写入协程批量持久化（队列满时丢弃，不阻塞响应路径）
+        try:
+            self._save_queue.put_nowait(trace)
+        except asyncio.QueueFull:
+            log.warning(f"Performance trace queue full, dropping trace {trace_id[:8]}...")
         
         # 清除统计缓存
         self._stats_cache = None
     
-    async def _save_trace(self, trace: RequestTrace):
-        """保存追踪记录到分片"""
+    async def _writer(self):
+        """后台写入协程：从队列凑批后按分片合并写入"""
+        loop = asyncio.get_running_loop()
+        while True:
+            batch = [await self._save_queue.get()]
+            deadline = loop.time() + self.SAVE_BATCH_TIMEOUT
+            while len(batch) < self.SAVE_BATCH_SIZE:
+                remaining = deadline - loop.time()
+                if remaining <= 0:
+                    break
+                try:
+                    batch.append(await asyncio.wait_for(self._save_queue.get(), remaining))
+                except asyncio.TimeoutError:
+                    break
+            await self._save_traces(batch)
+    
+    async def _save_traces(self, traces: List[RequestTrace]):
+        """批量保存追踪记录到分片（每个分片每批只读写一次）"""
         async with self._save_lock:
             try:
-                from ..storage.storage_adapter import get_storage_adapter
-                adapter = await get_storage_adapter()
-                
-                shard_idx = self.shard_manager.get_next_write_shard()
-                shard_key = f"perf_traces_{shard_idx}"
-                
-                # 加载当前分片
-                shard_data = await adapter.get_perf(shard_key, None)
-                if not isinstance(shard_data, list):
-                    shard_data = []
+                adapter = await self._get_adapter()
                 
-                # 添加新记录
-                shard_data.append(trace.to_dict())
+                # 按分片分组
+                groups: Dict[int, List[Dict[str, Any]]] = {}
+                for trace in traces:
+                    shard_idx = self.shard_manager.get_next_write_shard()
+                    groups.setdefault(shard_idx, []).append(trace.to_dict())
+                    self.shard_manager.increment_shard_count(shard_idx)
                 
-                # 如果超过限制，移除最旧的
-                if len(shard_data) > ShardManager.RECORDS_PER_SHARD:
-                    shard_data = shard_data[-ShardManager.RECORDS_PER_SHARD:]
+                for shard_idx, records in groups.items():
+                    shard_key = f"perf_traces_{shard_idx}"
+                    
+                    # 加载当前分片
+                    shard_data = await adapter.get_perf(shard_key, None)
+                    if not isinstance(shard_data, list):
+                        shard_data = []
+                    
+                    # 添加新记录
+                    shard_data.extend(records)
+                    
+                    # 如果超过限制，移除最旧的
+                    if len(shard_data) > ShardManager.RECORDS_PER_SHARD:
+                        shard_data = shard_data[-ShardManager.RECORDS_PER_SHARD:]
+                    
+                    # 保存分片
+                    await adapter.set_perf(shard_key, shard_data)
+                    self.shard_manager.shard_counts[shard_idx] = len(shard_data)
+                    log.debug(f"Saved {len(records)} traces to shard {shard_idx}, shard size: {len(shard_data)}")
+                    
+                    # 同步追加到列式统计存储
+                    if self._columns is not None:
+                        for record in records:
+                            self._index_record(record)
                 
-                # 保存分片
-                await adapter.set_perf(shard_key, shard_data)
-                self.shard_manager.shard_counts[shard_idx] = len(shard_data)
+                if self._columns is not None and len(self._columns) > ShardManager.MAX_TOTAL_RECORDS + ShardManager.RECORDS_PER_SHARD:
+                    self._trim_columns(ShardManager.MAX_TOTAL_RECORDS)
                 
                 # 更新元数据
                 await adapter.set_perf("perf_meta", self.shard_manager.to_dict())
-                
-                log.debug(f"Saved trace to shard {shard_idx}, shard size: {len(shard_data)}")
             except Exception as e:
-                log.error(f"Failed to save trace: {e}")
+                log.error(f"Failed to save {len(traces)} traces: {e}")
+            finally:
+                self._bump_version()
     
     async def get_traces_paginated(
         self,
@@ -314,51 +466,57 @@ class PerformanceTracker:
         Returns:
             分页结果字典
         """
-        from ..storage.storage_adapter import get_storage_adapter
-        adapter = await get_storage_adapter()
-        
-        all_traces = []
+        adapter = await self._get_adapter()
         
-        # 从所有分片加载数据
+        # 过滤条件（所有条件合并为单次遍历，加载分片时直接应用）
+        keep = None
+        if model or search or start_time or end_time:
+            search_lower = search.lower() if search else None
+            
+            def keep(t: Dict[str, Any]) -> bool:
+                if model and t.get("model") != model:
+                    return False
+                if search_lower and search_lower not in t.get("trace_id", "").lower():
+                    return False
+                if start_time and t.get("start_time", 0) < start_time:
+                    return False
+                if end_time and t.get("start_time", 0) > end_time:
+                    return False
+                return True
+        
+        matched = []
         for i in range(ShardManager.MAX_SHARDS):
             shard_key = f"perf_traces_{i}"
             try:
                 shard_data = await adapter.get_perf(shard_key, None)
-                if shard_data and isinstance(shard_data, list):
-                    all_traces.extend(shard_data)
             except Exception as e:
                 log.warning(f"Failed to load shard {i}: {e}")
-        
-        # 过滤
-        if model:
-            all_traces = [t for t in all_traces if t.get("model") == model]
-        
-        if search:
-            search_lower = search.lower()
-            all_traces = [t for t in all_traces if search_lower in t.get("trace_id", "").lower()]
-        
-        if start_time:
-            all_traces = [t for t in all_traces if t.get("start_time", 0) >= start_time]
-        
-        if end_time:
-            all_traces = [t for t in all_traces if t.get("start_time", 0) <= end_time]
-        
-        # 按时间倒序
-        all_traces.sort(key=lambda x: x.get("start_time", 0), reverse=True)
+                continue
+            if not shard_data or not isinstance(shard_data, list):
+                continue
+            if keep is None:
+                matched.extend(shard_data)
+                continue
+            for j, t in enumerate(shard_data):
+                if (j & YIELD_EVERY_MASK) == 0:
+                    await asyncio.sleep(0)
+                if keep(t):
+                    matched.append(t)
         
         # 分页
-        total = len(all_traces)
+        total = len(matched)
         total_pages = max(1, (total + page_size - 1) // page_size)
         page = max(1, min(page, total_pages))
         start_idx = (page - 1) * page_size
         end_idx = start_idx + page_size
         
+        # 只选出按时间倒序的前 end_idx 条，无需对全部记录排序
+        newest = heapq.nlargest(end_idx, matched, key=lambda x: x.get("start_time", 0))
+        
         # 为每条记录添加计算的指标
         page_traces = []
-        for t in all_traces[start_idx:end_idx]:
-            trace_obj = RequestTrace.from_dict(t)
-            metrics = trace_obj.get_metrics()
-            durations = trace_obj.get_stage_durations()
+        for t in newest[start_idx:]:
+            metrics, durations = _record_metrics(t)
             page_traces.append({
                 **t,
                 "metrics": metrics,
@@ -375,21 +533,22 @@ class PerformanceTracker:
     
     async def get_trace_by_id(self, trace_id: str) -> Optional[Dict[str, Any]]:
         """获取单条追踪详情"""
-        from ..storage.storage_adapter import get_storage_adapter
-        adapter = await get_storage_adapter()
+        adapter = await self._get_adapter()
         
         for i in range(ShardManager.MAX_SHARDS):
             shard_key = f"perf_traces_{i}"
             try:
                 shard_data = await adapter.get_perf(shard_key, None)
                 if shard_data and isinstance(shard_data, list):
-                    for t in shard_data:
+                    for j, t in enumerate(shard_data):
+                        if (j & YIELD_EVERY_MASK) == 0:
+                            await asyncio.sleep(0)
                         if t.get("trace_id") == trace_id:
-                            trace_obj = RequestTrace.from_dict(t)
+                            metrics, durations = _record_metrics(t)
                             return {
                                 **t,
-                                "metrics": trace_obj.get_metrics(),
-                                "durations": trace_obj.get_stage_durations()
+                                "metrics": metrics,
+                                "durations": durations
                             }
             except Exception:
                 pass
@@ -409,30 +568,23 @@ class PerformanceTracker:
         """
         # 检查缓存
         cache_key = f"stats_{model or 'all'}"
-        if use_cache and self._stats_cache and time.time() - self._stats_cache_time < self._stats_cache_ttl:
+        version = self._version
+        if (
+            use_cache
+            and self._stats_cache
+            and self._stats_cache_version == version
+            and time.time() - self._stats_cache_time < self._stats_cache_ttl
+        ):
             if cache_key in self._stats_cache:
                 return self._stats_cache[cache_key]
         
-        from ..storage.storage_adapter import get_storage_adapter
-        adapter = await get_storage_adapter()
-        
-        all_traces = []
-        
-        # 从所有分片加载数据
-        for i in range(ShardManager.MAX_SHARDS):
-            shard_key = f"perf_traces_{i}"
-            try:
-                shard_data = await adapter.get_perf(shard_key, None)
-                if shard_data and isinstance(shard_data, list):
-                    all_traces.extend(shard_data)
-            except Exception:
-                pass
+        columns = await self._get_columns()
         
-        # 模型筛选
+        # 模型筛选：直接取该模型的分桶
         if model:
-            all_traces = [t for t in all_traces if t.get("model") == model]
+            columns = self._by_model.get(model) or TraceColumns()
         
-        if not all_traces:
+        if not len(columns):
             return {
                 "count": 0,
                 "ttfb": {"avg": 0, "p50": 0, "p95": 0, "p99": 0},
@@ -443,113 +595,123 @@ class PerformanceTracker:
                 "time_range": {"start": 0, "end": 0}
             }
         
-        # 计算各指标
-        ttfbs = []
-        ttfts = []
-        latencies = []
-        tps_list = []
-        models_set = set()
-        
-        for t in all_traces:
-            ts = t.get("timestamps", {})
-            tokens = t.get("completion_tokens", 0)
-            models_set.add(t.get("model", "unknown"))
-            
-            # TTFB
-            if "request_received" in ts and "upstream_first_byte" in ts:
-                ttfb = ts["upstream_first_byte"] - ts["request_received"]
-                if ttfb >= 0:
-                    ttfbs.append(ttfb)
-            
-            # TTFT
-            if "request_received" in ts and "first_chunk_sent" in ts:
-                ttft = ts["first_chunk_sent"] - ts["request_received"]
-                if ttft >= 0:
-                    ttfts.append(ttft)
-            
-            # Total latency
-            if "request_received" in ts and "response_complete" in ts:
-                lat = ts["response_complete"] - ts["request_received"]
-                if lat >= 0:
-                    latencies.append(lat)
-                    # TPS
-                    if tokens > 0 and lat > 0:
-                        tps_list.append(tokens / (lat / 1000))
-        
-        def percentile(data: List[float], p: float) -> float:
-            if not data:
-                return 0.0
-            sorted_data = sorted(data)
-            idx = int(len(sorted_data) * p / 100)
-            return sorted_data[min(idx, len(sorted_data) - 1)]
-        
-        def avg(data: List[float]) -> float:
-            return sum(data) / len(data) if data else 0.0
-        
-        # 时间范围
-        start_times = [t.get("start_time", 0) for t in all_traces]
-        
         stats = {
-            "count": len(all_traces),
-            "ttfb": {
-                "avg": round(avg(ttfbs), 1),
-                "p50": round(percentile(ttfbs, 50), 1),
-                "p95": round(percentile(ttfbs, 95), 1),
-                "p99": round(percentile(ttfbs, 99), 1)
-            },
-            "ttft": {
-                "avg": round(avg(ttfts), 1),
-                "p50": round(percentile(ttfts, 50), 1),
-                "p95": round(percentile(ttfts, 95), 1),
-                "p99": round(percentile(ttfts, 99), 1)
-            },
-            "latency": {
-                "avg": round(avg(latencies), 1),
-                "p50": round(percentile(latencies, 50), 1),
-                "p95": round(percentile(latencies, 95), 1),
-                "p99": round(percentile(latencies, 99), 1)
-            },
-            "tps": {
-                "avg": round(avg(tps_list), 1),
-                "p50": round(percentile(tps_list, 50), 1),
-                "p95": round(percentile(tps_list, 95), 1)
-            },
-            "models": list(models_set),
+            "count": len(columns),
+            "ttfb": _summarize(columns.ttfb, (50, 95, 99)),
+            "ttft": _summarize(columns.ttft, (50, 95, 99)),
+            "latency": _summarize(columns.latency, (50, 95, 99)),
+            "tps": _summarize(columns.tps, (50, 95)),
+            "models": [model] if model else list(self._by_model),
             "time_range": {
-                "start": min(start_times) if start_times else 0,
-                "end": max(start_times) if start_times else 0
+                "start": min(columns.start_time),
+                "end": max(columns.start_time)
             }
         }
         
-        # 更新缓存
-        if self._stats_cache is None:
+        # 更新缓存（按计算开始时的版本号记录，计算期间有新写入时缓存不会被命中）
+        if self._stats_cache is None or self._stats_cache_version != version:
             self._stats_cache = {}
+            self._stats_cache_version = version
         self._stats_cache[cache_key] = stats
         self._stats_cache_time = time.time()
         
         return stats
     
+    async def _get_columns(self) -> TraceColumns:
+        """获取列式统计存储，首次调用时从所有分片加载"""
+        if self._columns is not None:
+            return self._columns
+        # 持有写锁加载，保证加载期间不会有批次写入被遗漏
+        async with self._save_lock:
+            if self._columns is not None:
+                return self._columns
+            
+            adapter = await self._get_adapter()
+            
+            # 先加载到局部变量，完成后再发布，避免并发读取看到半加载的数据
+            columns = TraceColumns()
+            by_model: Dict[str, TraceColumns] = {}
+            for i in range(ShardManager.MAX_SHARDS):
+                shard_key = f"perf_traces_{i}"
+                try:
+                    shard_data = await adapter.get_perf(shard_key, None)
+                except Exception:
+                    continue
+                if shard_data and isinstance(shard_data, list):
+                    for j, t in enumerate(shard_data):
+                        if (j & YIELD_EVERY_MASK) == 0:
+                            await asyncio.sleep(0)
+                        self._index_into(columns, by_model, t)
+            
+            self._columns, self._by_model = columns, by_model
+            log.debug(f"Loaded {len(columns)} traces of {len(by_model)} models into columnar stats store")
+            return columns
+    
+    @staticmethod
+    def _index_into(columns: TraceColumns, by_model: Dict[str, TraceColumns], record: Dict[str, Any]):
+        """将记录追加到全局列与所属模型的分桶"""
+        columns.append(record)
+        model = record.get("model", "unknown")
+        bucket = by_model.get(model)
+        if bucket is None:
+            bucket = by_model[model] = TraceColumns()
+        bucket.append(record)
+    
+    def _index_record(self, record: Dict[str, Any]):
+        """将记录追加到当前的列式统计存储（已缓存的统计随之失效）"""
+        self._index_into(self._columns, self._by_model, record)
+        self._stats_cache = None
+    
+    def _bump_version(self):
+        """数据变化后递增版本号并清除统计缓存，保证 ETag 与统计内容一致"""
+        self._version += 1
+        self._stats_cache = None
+    
+    def _trim_columns(self, max_len: int):
+        """丢弃最旧的记录，并同步裁剪各模型分桶"""
+        excess = len(self._columns) - max_len
+        if excess <= 0:
+            return
+        # 各分桶内同样按时间顺序排列，最旧的 n 条即该模型在被裁剪部分中的记录
+        dropped: Dict[str, int] = {}
+        for m in self._columns.models[:excess]:
+            dropped[m] = dropped.get(m, 0) + 1
+        self._columns.trim(max_len)
+        for m, n in dropped.items():
+            bucket = self._by_model[m]
+            bucket.trim(len(bucket) - n)
+            if not len(bucket):
+                del self._by_model[m]
+    
     async def get_models(self) -> List[str]:
         """获取所有模型列表"""
-        stats = await self.get_stats()
-        return stats.get("models", [])
+        await self._get_columns()
+        return list(self._by_model)
     
     async def clear_all(self):
         """清除所有追踪数据（只删除已存在的分片）"""
-        from ..storage.storage_adapter import get_storage_adapter
-        adapter = await get_storage_adapter()
+        adapter = await self._get_adapter()
         
-        # 只删除有数据的分片，不创建空的分片
-        for shard_idx in list(self.shard_manager.shard_counts.keys()):
-            shard_key = f"perf_traces_{shard_idx}"
-            try:
-                await adapter.delete_perf(shard_key)
-            except Exception:
-                pass
-        
-        self.shard_manager = ShardManager()
-        await adapter.set_perf("perf_meta", self.shard_manager.to_dict())
-        self._stats_cache = None
+        # 持有写锁，避免与批量写入交错
+        async with self._save_lock:
+            shard_indices = list(self.shard_manager.shard_counts.keys())
+            
+            # 先重置内存状态，统计查询立即反映清空结果
+            self.shard_manager = ShardManager()
+            self._stats_cache = None
+            self._columns = TraceColumns()
+            self._by_model = {}
+            
+            # 只删除有数据的分片，不创建空的分片
+            for shard_idx in shard_indices:
+                shard_key = f"perf_traces_{shard_idx}"
+                try:
+                    await adapter.delete_perf(shard_key)
+                except Exception:
+                    pass
+            
+            await adapter.set_perf("perf_meta", self.shard_manager.to_dict())
+            self._bump_version()
         
         log.info("All performance traces cleared")
 
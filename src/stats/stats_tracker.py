@@ -4,23 +4,79 @@
 """
 import time
 import asyncio
-from typing import Dict, List, Optional, Any
+import itertools
+from dataclasses import dataclass, field
+from typing import Dict, List, Optional, Any, Set, Tuple
 
 from log import log
+from ..core.task_manager import create_managed_task
 from ..models.models_key import KeyStats, KeyInfo, RateLimitInfo, KeyStatus
 from ..storage.storage_adapter import get_storage_adapter
 
+# 每个密钥的统计单独保存为 key_stats:{idx}，写入时只提交变更的密钥
+KEY_STATS_KEY_PREFIX = "key_stats:"
+# 旧版：所有密钥的统计保存在同一个配置项中，加载后迁移为逐密钥记录
+LEGACY_KEY_STATS_KEY = "key_stats"
+# 统计字典缓存的条目上限（超出时整体清空，避免已删除密钥的条目长期占用内存）
+_DICT_CACHE_MAX = 3000
+
+
+# 存储记录格式版本（无该字段的旧记录按版本 1 读取，字段相同）
+STAT_RECORD_SCHEMA = 1
+
+
+@dataclass(slots=True)
+class _StatRecord:
+    """单个密钥的调用统计（内存表示）"""
+    success_count: int = 0
+    failure_count: int = 0
+    model_counts: Dict[str, int] = field(default_factory=dict)
+    masked_key: str = ""
+    last_call_time: float = 0.0
+    
+    @classmethod
+    def from_stored(cls, data: Dict[str, Any]) -> "_StatRecord":
+        """从存储记录恢复（缺失或类型不符的字段使用默认值）"""
+        model_counts = data.get("model_counts")
+        return cls(
+            success_count=data.get("success_count", 0),
+            failure_count=data.get("failure_count", 0),
+            model_counts=dict(model_counts) if isinstance(model_counts, dict) else {},
+            masked_key=data.get("masked_key", ""),
+            last_call_time=data.get("last_call_time", 0),
+        )
+    
+    def to_stored(self) -> Dict[str, Any]:
+        """转换为存储记录（model_counts 复制一份，写入期间的修改不影响快照）"""
+        return {
+            "schema": STAT_RECORD_SCHEMA,
+            "success_count": self.success_count,
+            "failure_count": self.failure_count,
+            "model_counts": dict(self.model_counts),
+            "masked_key": self.masked_key,
+            "last_call_time": self.last_call_time,
+        }
+
 
 class StatsTracker:
     """统计跟踪器"""
     
     def __init__(self):
-        self._stats: Dict[int, Dict[str, Any]] = {}  # 统计数据缓存
+        self._stats: Dict[int, _StatRecord] = {}  # 统计数据缓存
         self._initialized = False
         self._save_lock = asyncio.Lock()
-        self._dirty = False
+        self._dirty: Set[int] = set()  # 待写入的密钥索引
+        self._removed: Set[int] = set()  # 待从存储删除的密钥索引
+        self._legacy_pending = False  # 旧版整体记录是否仍待删除
         self._last_save_time = 0
         self._save_interval = 30  # 保存间隔（秒）
+        self._flush_event = asyncio.Event()
+        self._flusher_task: Optional[asyncio.Task] = None
+        # 统计版本号：每次变更分配全局递增的新值，用于判断字典缓存是否过期
+        self._version_seq = itertools.count(1)
+        self._versions: Dict[int, int] = {}
+        # 密钥索引 -> ((版本号, 启用状态, 脱敏密钥), 不含速率限制信息的统计字典)
+        self._dict_cache: Dict[int, Tuple[Tuple[int, bool, str], Dict[str, Any]]] = {}
     
     async def initialize(self):
         """初始化统计跟踪器"""
@@ -28,6 +84,7 @@ class StatsTracker:
             return
         await self._load_stats()
         self._initialized = True
+        self._flusher_task = create_managed_task(self._flusher_loop(), name="stats_flusher")
         
         # 自动清理无效密钥的统计数据
         await self._auto_cleanup_invalid_keys()
@@ -39,15 +96,14 @@ class StatsTracker:
             key_manager = await get_key_manager()
             
             # 获取当前所有有效密钥的索引
-            all_keys = await key_manager.get_all_keys()
-            valid_indices = {key.index for key in all_keys}
+            valid_indices = await key_manager.get_all_key_indices()
             
             # 找出需要清理的统计数据
-            stats_to_remove = [idx for idx in self._stats.keys() if idx not in valid_indices]
+            stats_to_remove = [idx for idx in self._stats if idx not in valid_indices]
             
             if stats_to_remove:
                 for idx in stats_to_remove:
-                    del self._stats[idx]
+                    self._remove(idx)
                 
                 # 保存清理后的数据
                 await self._save_stats(force=True)
@@ -58,43 +114,116 @@ class StatsTracker:
         except Exception as e:
             log.warning(f"Failed to auto-cleanup invalid key stats: {e}")
     
+    def _load_entry(self, key: Any, value: Any) -> Optional[int]:
+        """加载单个密钥的统计记录，返回密钥索引（无效记录返回 None）"""
+        try:
+            idx = int(key)
+        except (ValueError, TypeError):
+            return None
+        if not isinstance(value, dict):
+            return None
+        self._stats[idx] = _StatRecord.from_stored(value)
+        self._touch(idx)
+        return idx
+    
     async def _load_stats(self):
-        """从存储加载统计数据"""
+        """从存储加载统计数据（兼容旧版整体存储格式）"""
         try:
             adapter = await get_storage_adapter()
-            data = await adapter.get_config("key_stats", {})
+            all_config = await adapter.get_all_config()
+            
+            legacy = all_config.get(LEGACY_KEY_STATS_KEY)
+            if isinstance(legacy, dict):
+                # 旧版数据全部标记为待写入，写成逐密钥记录后删除旧记录
+                for k, v in legacy.items():
+                    idx = self._load_entry(k, v)
+                    if idx is not None:
+                        self._dirty.add(idx)
+                self._legacy_pending = True
             
-            if isinstance(data, dict):
-                for k, v in data.items():
-                    try:
-                        idx = int(k)
-                        if isinstance(v, dict):
-                            self._stats[idx] = v
-                    except (ValueError, TypeError):
-                        continue
+            # 新版逐密钥记录优先于旧版数据
+            for key, value in all_config.items():
+                if key.startswith(KEY_STATS_KEY_PREFIX):
+                    idx = self._load_entry(key[len(KEY_STATS_KEY_PREFIX):], value)
+                    if idx is not None:
+                        self._dirty.discard(idx)
             
             log.debug(f"Loaded stats for {len(self._stats)} keys")
         except Exception as e:
             log.error(f"Failed to load key stats: {e}")
     
+    def _has_pending(self) -> bool:
+        """是否有尚未持久化的变更"""
+        return bool(self._dirty or self._removed or self._legacy_pending)
+    
+    def _touch(self, key_index: int):
+        """标记密钥统计已变化（使其字典缓存失效）"""
+        self._versions[key_index] = next(self._version_seq)
+    
+    def _remove(self, key_index: int):
+        """从内存移除密钥统计，并记录待删除的存储记录"""
+        del self._stats[key_index]
+        self._versions.pop(key_index, None)
+        self._dict_cache.pop(key_index, None)
+        self._dirty.discard(key_index)
+        self._removed.add(key_index)
+    
+    async def _flusher_loop(self):
+        """后台写入循环：有变更时等待一个保存间隔，合并期间的所有调用后写入一次"""
+        while True:
+            await self._flush_event.wait()
+            self._flush_event.clear()
+            await asyncio.sleep(self._save_interval)
+            if self._has_pending():
+                await self._save_stats(force=True)
+    
+    async def close(self):
+        """保存剩余变更并停止后台写入任务"""
+        task, self._flusher_task = self._flusher_task, None
+        if task is not None and not task.done():
+            task.cancel()
+            try:
+                await task
+            except asyncio.CancelledError:
+                pass
+        if self._has_pending():
+            await self._save_stats(force=True)
+    
     async def _save_stats(self, force: bool = False):
-        """保存统计数据到存储"""
+        """保存已变更密钥的统计数据到存储（每个密钥单独一条记录）"""
         current_time = time.time()
         
         # 检查是否需要保存
-        if not force and not self._dirty:
+        if not self._has_pending():
             return
         if not force and current_time - self._last_save_time < self._save_interval:
             return
         
         async with self._save_lock:
+            # 在第一次 await 之前同步拍快照并取走变更集合：写入期间 record_call 继续修改
+            # 内存数据不会影响正在序列化的内容，且新的修改会重新标记，不会丢失
+            dirty, self._dirty = self._dirty, set()
+            removed, self._removed = self._removed, set()
+            updates = {
+                f"{KEY_STATS_KEY_PREFIX}{idx}": self._stats[idx].to_stored()
+                for idx in dirty if idx in self._stats
+            }
             try:
                 adapter = await get_storage_adapter()
-                await adapter.set_config("key_stats", {str(k): v for k, v in self._stats.items()})
-                self._dirty = False
+                # 所有变更的密钥通过一次批量写入提交
+                if updates and not await adapter.set_config_many(updates):
+                    raise RuntimeError("storage rejected key stats update")
+                for idx in removed:
+                    await adapter.delete_config(f"{KEY_STATS_KEY_PREFIX}{idx}")
+                if self._legacy_pending:
+                    await adapter.delete_config(LEGACY_KEY_STATS_KEY)
+                    self._legacy_pending = False
                 self._last_save_time = current_time
-                log.debug(f"Saved stats for {len(self._stats)} keys")
+                log.debug(f"Saved stats for {len(updates)} keys, removed {len(removed)}")
             except Exception as e:
+                # 写入失败时恢复变更标记，由下一轮重试
+                self._dirty |= {idx for idx in dirty if idx in self._stats}
+                self._removed |= {idx for idx in removed if idx not in self._stats}
                 log.error(f"Failed to save key stats: {e}")
     
     async def record_call(
@@ -116,40 +245,33 @@ class StatsTracker:
         if not self._initialized:
             await self.initialize()
         
-        if key_index not in self._stats:
-            self._stats[key_index] = {
-                "success_count": 0,
-                "failure_count": 0,
-                "model_counts": {},
-                "masked_key": masked_key,
-                "last_call_time": 0,
-            }
-        
-        stats = self._stats[key_index]
+        stats = self._stats.get(key_index)
+        if stats is None:
+            self._removed.discard(key_index)
+            stats = self._stats[key_index] = _StatRecord(masked_key=masked_key)
         
         if success:
-            stats["success_count"] = stats.get("success_count", 0) + 1
+            stats.success_count += 1
         else:
-            stats["failure_count"] = stats.get("failure_count", 0) + 1
+            stats.failure_count += 1
         
         # 更新模型计数
-        model_counts = stats.get("model_counts", {})
+        model_counts = stats.model_counts
         model_counts[model] = model_counts.get(model, 0) + 1
-        stats["model_counts"] = model_counts
         
         # 更新最后调用时间
-        stats["last_call_time"] = time.time()
+        stats.last_call_time = time.time()
         
         # 更新脱敏密钥
         if masked_key:
-            stats["masked_key"] = masked_key
+            stats.masked_key = masked_key
         
-        self._dirty = True
+        self._touch(key_index)
+        self._dirty.add(key_index)
+        # 通知后台写入任务，由其合并写入
+        self._flush_event.set()
         
         log.debug(f"Recorded {'success' if success else 'failure'} call for key {key_index}, model={model}")
-        
-        # 异步保存
-        asyncio.create_task(self._save_stats())
     
     async def get_key_stats(
         self, 
@@ -171,18 +293,58 @@ class StatsTracker:
         if not self._initialized:
             await self.initialize()
         
-        stats = self._stats.get(key_index, {})
+        return self._build_key_stats(key_index, key_info, rate_limit_info)
+    
+    def _build_key_stats(
+        self,
+        key_index: int,
+        key_info: Optional[KeyInfo] = None,
+        rate_limit_info: Optional[RateLimitInfo] = None
+    ) -> KeyStats:
+        """根据内存中的统计数据构造 KeyStats"""
+        stats = self._stats.get(key_index)
+        if stats is None:
+            return KeyStats(
+                key_index=key_index,
+                masked_key=key_info.masked_key if key_info else "",
+                enabled=key_info.enabled if key_info else True,
+                rate_limit_info=rate_limit_info,
+            )
         
         return KeyStats(
             key_index=key_index,
-            masked_key=stats.get("masked_key", key_info.masked_key if key_info else ""),
+            masked_key=stats.masked_key,
             enabled=key_info.enabled if key_info else True,
-            success_count=stats.get("success_count", 0),
-            failure_count=stats.get("failure_count", 0),
-            model_counts=stats.get("model_counts", {}),
+            success_count=stats.success_count,
+            failure_count=stats.failure_count,
+            model_counts=stats.model_counts,
             rate_limit_info=rate_limit_info,
         )
     
+    def _key_stats_dict(self, key: KeyInfo, rate_info: Optional[RateLimitInfo]) -> Dict[str, Any]:
+        """
+        获取密钥统计的字典形式
+        
+        统计、启用状态与脱敏密钥均未变化时复用上次生成的字典；
+        速率限制信息包含随时间变化的 reset_in_seconds，每次重新生成。
+        返回缓存字典的浅拷贝，调用方增删字段不会影响缓存。
+        """
+        stamp = (self._versions.get(key.index, 0), key.enabled, key.masked_key)
+        cached = self._dict_cache.get(key.index)
+        if cached is None or cached[0] != stamp:
+            base = self._build_key_stats(key.index, key).to_dict()
+            # 复制 model_counts，避免缓存的字典随后续 record_call 一起变化
+            base["model_counts"] = dict(base["model_counts"])
+            cached = (stamp, base)
+            if len(self._dict_cache) >= _DICT_CACHE_MAX:
+                self._dict_cache.clear()
+            self._dict_cache[key.index] = cached
+        
+        result = dict(cached[1])
+        if rate_info is not None:
+            result["rate_limit_info"] = rate_info.to_dict()
+        return result
+    
     async def get_all_stats(
         self, 
         keys: List[KeyInfo],
@@ -209,20 +371,21 @@ class StatsTracker:
         all_stats = []
         enabled_stats = []
         disabled_stats = []
+        # 汇总在同一次遍历中累加
+        total_success = 0
+        total_failure = 0
         
         for key in keys:
-            rate_info = rate_limits.get(key.index)
-            stats = await self.get_key_stats(key.index, key, rate_info)
+            stats = self._key_stats_dict(key, rate_limits.get(key.index))
             all_stats.append(stats)
+            total_success += stats["success_count"]
+            total_failure += stats["failure_count"]
             
             if key.enabled:
                 enabled_stats.append(stats)
             else:
                 disabled_stats.append(stats)
         
-        # 计算汇总
-        total_success = sum(s.success_count for s in all_stats)
-        total_failure = sum(s.failure_count for s in all_stats)
         active_count = len(enabled_stats)
         disabled_count = len(disabled_stats)
         
@@ -236,10 +399,10 @@ class StatsTracker:
         }
         
         if group_by_status:
-            result["enabled"] = [s.to_dict() for s in enabled_stats]
-            result["disabled"] = [s.to_dict() for s in disabled_stats]
+            result["enabled"] = enabled_stats
+            result["disabled"] = disabled_stats
         else:
-            result["keys"] = [s.to_dict() for s in all_stats]
+            result["keys"] = all_stats
         
         return result
     
@@ -264,23 +427,24 @@ class StatsTracker:
         if rate_limits is None:
             rate_limits = {}
         
-        enabled_keys = [k for k in keys if k.enabled]
         stats = []
+        total_success = 0
+        total_failure = 0
         
-        for key in enabled_keys:
-            rate_info = rate_limits.get(key.index)
-            key_stats = await self.get_key_stats(key.index, key, rate_info)
+        for key in keys:
+            if not key.enabled:
+                continue
+            key_stats = self._key_stats_dict(key, rate_limits.get(key.index))
             stats.append(key_stats)
-        
-        total_success = sum(s.success_count for s in stats)
-        total_failure = sum(s.failure_count for s in stats)
+            total_success += key_stats["success_count"]
+            total_failure += key_stats["failure_count"]
         
         return {
-            "active_keys": len(enabled_keys),
+            "active_keys": len(stats),
             "total_success": total_success,
             "total_failure": total_failure,
             "total_calls": total_success + total_failure,
-            "keys": [s.to_dict() for s in stats],
+            "keys": stats,
         }
     
     async def reset_stats(self, key_index: Optional[int] = None):
@@ -295,26 +459,17 @@ class StatsTracker:
         
         if key_index is not None:
             if key_index in self._stats:
-                self._stats[key_index] = {
-                    "success_count": 0,
-                    "failure_count": 0,
-                    "model_counts": {},
-                    "masked_key": self._stats[key_index].get("masked_key", ""),
-                    "last_call_time": 0,
-                }
+                self._stats[key_index] = _StatRecord(masked_key=self._stats[key_index].masked_key)
+                self._touch(key_index)
+                self._dirty.add(key_index)
                 log.info(f"Reset stats for key {key_index}")
         else:
             for idx in self._stats:
-                self._stats[idx] = {
-                    "success_count": 0,
-                    "failure_count": 0,
-                    "model_counts": {},
-                    "masked_key": self._stats[idx].get("masked_key", ""),
-                    "last_call_time": 0,
-                }
+                self._stats[idx] = _StatRecord(masked_key=self._stats[idx].masked_key)
+                self._touch(idx)
+            self._dirty.update(self._stats)
             log.info("Reset all key stats")
         
-        self._dirty = True
         await self._save_stats(force=True)
     
     async def cleanup_inactive_keys(self, active_indices: List[int]):
@@ -327,13 +482,14 @@ class StatsTracker:
         if not self._initialized:
             await self.initialize()
         
-        inactive = [idx for idx in self._stats if idx not in active_indices]
+        # 转为集合后判断成员，避免密钥较多时的平方级开销
+        active = set(active_indices)
+        inactive = [idx for idx in self._stats if idx not in active]
         for idx in inactive:
-            del self._stats[idx]
+            self._remove(idx)
         
         if inactive:
             log.info(f"Cleaned up stats for {len(inactive)} inactive keys")
-            self._dirty = True
             await self._save_stats(force=True)
 
 
@@ -348,3 +504,9 @@ async def get_stats_tracker() -> StatsTracker:
         _stats_tracker = StatsTracker()
         await _stats_tracker.initialize()
     return _stats_tracker
+
+
+async def close_stats_tracker():
+    """保存全局统计跟踪器中未持久化的变更并停止后台写入（未创建时跳过）"""
+    if _stats_tracker is not None:
+        await _stats_tracker.close()
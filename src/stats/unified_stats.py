@@ -10,10 +10,12 @@
 import time
 import asyncio
 import hashlib
-from typing import Dict, List, Optional, Any
+from functools import lru_cache
+from typing import Dict, List, Optional, Any, Tuple
 from datetime import datetime, timezone, timedelta
 
 from log import log
+from ..core.task_manager import create_managed_task
 from ..storage.storage_adapter import get_storage_adapter
 
 
@@ -45,6 +47,16 @@ def get_key_hash(key: str) -> str:
     return hashlib.sha256(key.encode('utf-8')).hexdigest()[:16]
 
 
+@lru_cache(maxsize=4096)
+def _derive(key: str) -> Tuple[str, str]:
+    """
+    获取密钥的 (脱敏密钥, 哈希值)
+    
+    调用集中在少量密钥上，缓存后每次调用只需一次字典查找，无需重复计算哈希
+    """
+    return mask_key(key), get_key_hash(key)
+
+
 class UnifiedStats:
     """
     统一统计管理器
@@ -67,8 +79,11 @@ class UnifiedStats:
         self._initialized = False
         self._save_lock = asyncio.Lock()
         self._dirty = False
-        self._last_save_time = 0
-        self._save_interval = 30  # 保存间隔（秒）
+        self._save_interval = 30  # 调用统计的保存间隔（秒）
+        self._flush_debounce = 0.1  # 删除/重置等管理操作的合并写入窗口（秒）
+        self._flush_event = asyncio.Event()
+        self._urgent_event = asyncio.Event()
+        self._flusher_task: Optional[asyncio.Task] = None
     
     async def initialize(self):
         """初始化统计管理器"""
@@ -76,8 +91,53 @@ class UnifiedStats:
             return
         await self._load_stats()
         self._initialized = True
+        self._flusher_task = create_managed_task(self._flusher_loop(), name="unified_stats_flusher")
         log.info(f"UnifiedStats initialized with {len(self._stats)} keys")
     
+    def _mark_dirty(self, urgent: bool = False):
+        """
+        标记统计已变更并通知后台写入任务
+        
+        Args:
+            urgent: 管理操作（删除、清理、重置）为 True，在较短的去抖窗口后写入，
+                    窗口内的多个操作合并为一次写入
+        """
+        self._dirty = True
+        self._flush_event.set()
+        if urgent:
+            self._urgent_event.set()
+    
+    async def _flusher_loop(self):
+        """后台写入循环：有变更时等待一个保存间隔（管理操作只等待去抖窗口），合并期间的所有变更后写入一次"""
+        while True:
+            await self._flush_event.wait()
+            self._flush_event.clear()
+            try:
+                await asyncio.wait_for(self._urgent_event.wait(), timeout=self._save_interval)
+            except asyncio.TimeoutError:
+                pass
+            else:
+                await asyncio.sleep(self._flush_debounce)
+            self._urgent_event.clear()
+            if self._dirty:
+                await self._save_stats()
+    
+    async def close(self):
+        """保存剩余变更并停止后台写入任务"""
+        task, self._flusher_task = self._flusher_task, None
+        if task is not None and not task.done():
+            task.cancel()
+            try:
+                await task
+            except asyncio.CancelledError:
+                pass
+        await self.flush()
+    
+    async def flush(self):
+        """立即写入尚未持久化的变更（需要确保落盘的调用方使用）"""
+        if self._dirty:
+            await self._save_stats()
+    
     async def _load_stats(self):
         """从存储加载统计数据"""
         try:
@@ -91,23 +151,18 @@ class UnifiedStats:
         except Exception as e:
             log.error(f"Failed to load unified stats: {e}")
     
-    async def _save_stats(self, force: bool = False):
-        """保存统计数据到存储"""
-        current_time = time.time()
-        
-        if not force and not self._dirty:
-            return
-        if not force and current_time - self._last_save_time < self._save_interval:
-            return
-        
+    async def _save_stats(self):
+        """保存统计数据到存储（写入时机由后台写入任务或 flush 决定）"""
         async with self._save_lock:
+            # 写入前清除标记：写入期间的新调用会重新置脏，由下一轮写入
+            self._dirty = False
             try:
                 adapter = await get_storage_adapter()
-                await adapter.set_config("unified_stats", self._stats)
-                self._dirty = False
-                self._last_save_time = current_time
+                if not await adapter.set_config("unified_stats", self._stats):
+                    raise RuntimeError("storage rejected unified stats update")
                 log.debug(f"Saved unified stats for {len(self._stats)} keys")
             except Exception as e:
+                self._dirty = True
                 log.error(f"Failed to save unified stats: {e}")
     
     async def record_call(
@@ -127,8 +182,7 @@ class UnifiedStats:
         if not self._initialized:
             await self.initialize()
         
-        masked = mask_key(api_key)
-        key_hash = get_key_hash(api_key)
+        masked, key_hash = _derive(api_key)
         
         if masked not in self._stats:
             self._stats[masked] = {
@@ -165,12 +219,10 @@ class UnifiedStats:
         # 更新最后调用时间
         stats["last_call_time"] = time.time()
         
-        self._dirty = True
+        # 通知后台写入任务，由其合并写入（不再为每次调用创建任务）
+        self._mark_dirty()
         
         log.debug(f"Recorded {'success' if success else 'failure'} call for key {masked}, model={model}")
-        
-        # 异步保存
-        asyncio.create_task(self._save_stats())
     
     async def get_stats_for_key(self, masked_key: str) -> Dict[str, Any]:
         """获取单个密钥的统计信息"""
@@ -203,7 +255,7 @@ class UnifiedStats:
         # 如果提供了有效密钥列表，构建脱敏密钥集合
         valid_masked_keys = None
         if valid_keys is not None:
-            valid_masked_keys = {mask_key(k) for k in valid_keys}
+            valid_masked_keys = {_derive(k)[0] for k in valid_keys}
         
         result = {
             "keys": {},
@@ -276,12 +328,11 @@ class UnifiedStats:
         if not self._initialized:
             await self.initialize()
         
-        masked = mask_key(api_key)
+        masked = _derive(api_key)[0]
         
         if masked in self._stats:
             del self._stats[masked]
-            self._dirty = True
-            await self._save_stats(force=True)
+            self._mark_dirty(urgent=True)
             log.info(f"Deleted stats for key {masked}")
             return True
         
@@ -302,8 +353,7 @@ class UnifiedStats:
         
         if masked_key in self._stats:
             del self._stats[masked_key]
-            self._dirty = True
-            await self._save_stats(force=True)
+            self._mark_dirty(urgent=True)
             log.info(f"Deleted stats for masked key {masked_key}")
             return True
         
@@ -322,7 +372,7 @@ class UnifiedStats:
         if not self._initialized:
             await self.initialize()
         
-        valid_masked_keys = {mask_key(k) for k in valid_keys}
+        valid_masked_keys = {_derive(k)[0] for k in valid_keys}
         
         # 找出需要删除的统计
         to_delete = [k for k in self._stats.keys() if k not in valid_masked_keys]
@@ -331,8 +381,7 @@ class UnifiedStats:
             del self._stats[masked_key]
         
         if to_delete:
-            self._dirty = True
-            await self._save_stats(force=True)
+            self._mark_dirty(urgent=True)
             log.info(f"Cleaned up stats for {len(to_delete)} invalid keys: {to_delete}")
         
         return len(to_delete)
@@ -370,8 +419,7 @@ class UnifiedStats:
                 }
             log.info("Reset all stats")
         
-        self._dirty = True
-        await self._save_stats(force=True)
+        self._mark_dirty(urgent=True)
     
     async def ensure_keys_exist(self, keys: List[str]):
         """
@@ -383,21 +431,22 @@ class UnifiedStats:
         if not self._initialized:
             await self.initialize()
         
+        added = False
         for key in keys:
-            masked = mask_key(key)
+            masked, key_hash = _derive(key)
             if masked not in self._stats:
                 self._stats[masked] = {
-                    "full_key_hash": get_key_hash(key),
+                    "full_key_hash": key_hash,
                     "success_count": 0,
                     "failure_count": 0,
                     "model_counts": {},
                     "last_call_time": 0,
                     "created_time": time.time(),
                 }
-                self._dirty = True
+                added = True
         
-        if self._dirty:
-            await self._save_stats()
+        if added:
+            self._mark_dirty()
 
 
 # 全局实例
@@ -411,3 +460,9 @@ async def get_unified_stats() -> UnifiedStats:
         _unified_stats = UnifiedStats()
         await _unified_stats.initialize()
     return _unified_stats
+
+
+async def close_unified_stats():
+    """保存全局统一统计中未持久化的变更并停止后台写入（未创建时跳过）"""
+    if _unified_stats is not None:
+        await _unified_stats.close()
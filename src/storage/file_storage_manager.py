@@ -446,6 +446,11 @@ class FileStorageManager:
         self._ensure_initialized()
         return await self._config_cache_manager.set(key, value)
     
+    async def set_config_many(self, values: Dict[str, Any]) -> bool:
+        """批量设置配置到统一缓存（一次加锁、一次写回）"""
+        self._ensure_initialized()
+        return await self._config_cache_manager.update_multi(values)
+    
     async def get_config(self, key: str, default: Any = None) -> Any:
         """从统一缓存获取配置"""
         self._ensure_initialized()
@@ -6,12 +6,12 @@ Postgres数据库管理器，采用单行设计并兼容 UnifiedCacheManager。
 import asyncio
 import os
 import time
-import json
 from datetime import datetime, timezone
 from typing import Dict, Any, List, Optional
 from collections import deque
 
 import asyncpg
+import orjson
 from log import log
 from .cache_manager import UnifiedCacheManager, CacheBackend
 
@@ -37,7 +37,7 @@ class PostgresCacheBackend(CacheBackend):
                     data = row['data']
                     # JSONB字段返回JSON字符串，需要解析为字典
                     if isinstance(data, str):
-                        return json.loads(data)
+                        return orjson.loads(data)
                     elif isinstance(data, dict):
                         return data
                     else:
@@ -54,7 +54,9 @@ class PostgresCacheBackend(CacheBackend):
                 await conn.execute(
                     f"INSERT INTO {self._table_name}(key, data, updated_at) VALUES($1, $2::jsonb, $3)"
                     " ON CONFLICT (key) DO UPDATE SET data = EXCLUDED.data, updated_at = EXCLUDED.updated_at",
-                    self._row_key, json.dumps(data, default=str), datetime.now(timezone.utc)
+                    self._row_key,
+                    orjson.dumps(data, default=str, option=orjson.OPT_NON_STR_KEYS).decode(),
+                    datetime.now(timezone.utc)
                 )
                 return True
         except Exception as e:
@@ -249,6 +251,10 @@ class PostgresManager:
         self._ensure_initialized()
         return await self._config_cache_manager.set(key, value)
 
+    async def set_config_many(self, values: Dict[str, Any]) -> bool:
+        self._ensure_initialized()
+        return await self._config_cache_manager.update_multi(values)
+
     async def get_config(self, key: str, default: Any = None) -> Any:
         self._ensure_initialized()
         return await self._config_cache_manager.get(key, default)
@@ -3,12 +3,12 @@ Redis数据库管理器，使用哈希表设计和统一缓存。
 所有凭证数据存储在一个哈希表中，配置数据存储在另一个哈希表中。
 """
 import asyncio
-import json
 import os
 import time
 from typing import Dict, Any, List, Optional
 from collections import deque
 
+import orjson
 import redis.asyncio as redis
 from log import log
 from .cache_manager import UnifiedCacheManager, CacheBackend
@@ -31,8 +31,8 @@ class RedisCacheBackend(CacheBackend):
             result = {}
             for key, value_str in hash_data.items():
                 try:
-                    result[key] = json.loads(value_str)
-                except json.JSONDecodeError as e:
+                    result[key] = orjson.loads(value_str)
+                except orjson.JSONDecodeError as e:
                     log.error(f"Error deserializing Redis data for key {key}: {e}")
                     continue
             return result
@@ -50,7 +50,7 @@ class RedisCacheBackend(CacheBackend):
             hash_data = {}
             for key, value in data.items():
                 try:
-                    hash_data[key] = json.dumps(value, ensure_ascii=False)
+                    hash_data[key] = orjson.dumps(value, option=orjson.OPT_NON_STR_KEYS)
                 except (TypeError, ValueError) as e:
                     log.error(f"Error serializing data for key {key}: {e}")
                     continue
@@ -415,6 +415,11 @@ class RedisManager:
             log.error(f"Error setting config {key} in {operation_time:.3f}s: {e}")
             return False
     
+    async def set_config_many(self, values: Dict[str, Any]) -> bool:
+        """批量设置配置到统一缓存（一次加锁、一次写回）"""
+        self._ensure_initialized()
+        return await self._config_cache_manager.update_multi(values)
+    
     async def get_config(self, key: str, default: Any = None) -> Any:
         """从统一缓存获取配置"""
         self._ensure_initialized()
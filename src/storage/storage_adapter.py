@@ -56,6 +56,10 @@ class StorageBackend(Protocol):
         """设置配置项"""
         ...
     
+    async def set_config_many(self, values: Dict[str, Any]) -> bool:
+        """批量设置配置项"""
+        ...
+    
     async def get_config(self, key: str, default: Any = None) -> Any:
         """获取配置项"""
         ...
@@ -237,6 +241,11 @@ class StorageAdapter:
         self._ensure_initialized()
         return await self._backend.set_config(key, value)
     
+    async def set_config_many(self, values: Dict[str, Any]) -> bool:
+        """批量设置配置项（同一批更新在缓存中一次性生效）"""
+        self._ensure_initialized()
+        return await self._backend.set_config_many(values)
+    
     async def get_config(self, key: str, default: Any = None) -> Any:
         """获取配置项"""
         self._ensure_initialized()
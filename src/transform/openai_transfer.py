@@ -4,9 +4,10 @@ OpenAI Transfer Module - Handles conversion between OpenAI and Gemini API format
 """
 
 from logging import INFO, info
+import os
 import time
 import uuid
-from typing import Dict, Any
+from typing import Dict, Any, Optional
 
 from config import (
     DEFAULT_SAFETY_SETTINGS,
@@ -170,19 +171,27 @@ async def openai_request_to_gemini_payload(
 
 def _extract_content_and_reasoning(parts: list) -> tuple:
     """从Gemini响应部件中提取内容和推理内容"""
-    content = ""
-    reasoning_content = ""
+    # 流式块通常只有一个部件，直接返回，避免列表与拼接开销
+    if len(parts) == 1:
+        text = parts[0].get("text")
+        if not text:
+            return "", ""
+        return ("", text) if parts[0].get("thought", False) else (text, "")
+
+    content = []
+    reasoning_content = []
 
     for part in parts:
         # 处理文本内容
-        if part.get("text"):
+        text = part.get("text")
+        if text:
             # 检查这个部件是否包含thinking tokens
             if part.get("thought", False):
-                reasoning_content += part.get("text", "")
+                reasoning_content.append(text)
             else:
-                content += part.get("text", "")
+                content.append(text)
 
-    return content, reasoning_content
+    return "".join(content), "".join(reasoning_content)
 
 
 def _convert_usage_metadata(usage_metadata: Dict[str, Any]) -> Dict[str, int]:
@@ -318,7 +327,7 @@ def assembly_response_to_openai(
         for tc in tool_calls:
             # 修复 tool_call 格式
             fixed_tc = {
-                "id": tc.get("id") or f"call_{uuid.uuid4().hex[:24]}",  # 生成缺失的 id
+                "id": tc.get("id") or "call_" + os.urandom(12).hex(),  # 生成缺失的 id
                 "type": tc.get("type", "function"),
                 "function": {}
             }
@@ -410,7 +419,7 @@ def assembly_response_to_openai(
 
 
 def gemini_stream_chunk_to_openai(
-    gemini_chunk: Dict[str, Any], model: str, response_id: str
+    gemini_chunk: Dict[str, Any], model: str, response_id: str, created: Optional[int] = None
 ) -> Dict[str, Any]:
     """
     将Gemini流式响应块转换为OpenAI流式格式
@@ -419,20 +428,16 @@ def gemini_stream_chunk_to_openai(
         gemini_chunk: 来自Gemini流式响应的单个块
         model: 要在响应中包含的模型名称
         response_id: 此流式响应的一致ID
+        created: 此流式响应的创建时间戳（未提供时取当前时间）
 
     Returns:
         OpenAI流式格式的字典
     """
     choices = []
+    has_finish_reason = False
 
     for candidate in gemini_chunk.get("candidates", []):
-        role = candidate.get("content", {}).get("role", "assistant")
-
-        # 将Gemini角色映射回OpenAI角色
-        if role == "model":
-            role = "assistant"
-
-        # 提取并分离thinking tokens和常规内容
+        # 提取并分离thinking tokens和常规内容（流式 delta 不携带 role）
         parts = candidate.get("content", {}).get("parts", [])
         content, reasoning_content = _extract_content_and_reasoning(parts)
 
@@ -443,7 +448,9 @@ def gemini_stream_chunk_to_openai(
         if reasoning_content:
             delta["reasoning_content"] = reasoning_content
 
-        finish_reason = _map_finish_reason(candidate.get("finishReason"))
+        finish_reason = _FINISH_REASON_MAP.get(candidate.get("finishReason"))
+        if finish_reason:
+            has_finish_reason = True
 
         choices.append(
             {
@@ -453,28 +460,35 @@ def gemini_stream_chunk_to_openai(
             }
         )
 
-    # 转换usageMetadata为OpenAI格式（只在流结束时存在）
-    usage = _convert_usage_metadata(gemini_chunk.get("usageMetadata"))
-
     # 构建基础响应数据（确保所有必需字段都存在）
     response_data = {
         "id": response_id,
         "object": "chat.completion.chunk",
-        "created": int(time.time()),
+        "created": int(time.time()) if created is None else created,
         "model": model,
         "choices": choices,
     }
 
     # 只有在有usage数据且这是最后一个chunk时才添加usage字段
     # 这确保了codex-server能正确识别和记录用量
-    if usage:
-        has_finish_reason = any(choice.get("finish_reason") for choice in choices)
-        if has_finish_reason:
+    if has_finish_reason:
+        # 转换usageMetadata为OpenAI格式（只在流结束时存在）
+        usage = _convert_usage_metadata(gemini_chunk.get("usageMetadata"))
+        if usage:
             response_data["usage"] = usage
 
     return response_data
 
 
+# Gemini 结束原因到 OpenAI 结束原因的映射
+_FINISH_REASON_MAP = {
+    "STOP": "stop",
+    "MAX_TOKENS": "length",
+    "SAFETY": "content_filter",
+    "RECITATION": "content_filter",
+}
+
+
 def _map_finish_reason(gemini_reason: str) -> str:
     """
     将Gemini结束原因映射到OpenAI结束原因
@@ -485,14 +499,7 @@ def _map_finish_reason(gemini_reason: str) -> str:
     Returns:
         OpenAI兼容的结束原因
     """
-    if gemini_reason == "STOP":
-        return "stop"
-    elif gemini_reason == "MAX_TOKENS":
-        return "length"
-    elif gemini_reason in ["SAFETY", "RECITATION"]:
-        return "content_filter"
-    else:
-        return None
+    return _FINISH_REASON_MAP.get(gemini_reason)
 
 
 def validate_openai_request(request_data: Dict[str, Any]) -> ChatCompletionRequest:
@@ -2,17 +2,53 @@
 请求生成器模块
 生成请求报文预览和验证自定义请求
 """
-import json
-from typing import Dict, Any, Tuple, Optional, List
+from functools import lru_cache
+from typing import Dict, Any, Tuple, Optional, List, TypedDict
+
+import orjson
 
 from log import log
 
 
+class PreviewParams(TypedDict, total=False):
+    """预览参数（由 PreviewRequest.model_dump(exclude_none=True) 生成，已经过校验）"""
+    model: str
+    messages: List[Any]
+    temperature: float
+    top_p: float
+    max_tokens: int
+    stream: bool
+    tools: List[Any]
+    tool_choice: Any
+
+
+def _number_between(low: float, high: float):
+    """生成数值范围校验函数"""
+    def check(value: Any) -> bool:
+        return isinstance(value, (int, float)) and low <= value <= high
+    return check
+
+
+def _positive_int(value: Any) -> bool:
+    return isinstance(value, int) and value >= 1
+
+
+# 可选字段校验表：(字段名, 校验函数, 错误信息)，模块加载时构建一次，按顺序检查
+_OPTIONAL_FIELD_CHECKS = (
+    ("temperature", _number_between(0, 2), "Field 'temperature' must be a number between 0 and 2"),
+    ("max_tokens", _positive_int, "Field 'max_tokens' must be a positive integer"),
+    ("top_p", _number_between(0, 1), "Field 'top_p' must be a number between 0 and 1"),
+    ("n", _positive_int, "Field 'n' must be a positive integer"),
+    ("stream", lambda value: isinstance(value, bool), "Field 'stream' must be a boolean"),
+    ("tools", lambda value: isinstance(value, list), "Field 'tools' must be an array"),
+)
+
+
 class RequestGenerator:
-    """请求生成器"""
+    """请求生成器（创建后端点与密钥不再变化，可在并发请求间共享）"""
     
-    # OpenAI 兼容的请求参数
-    SUPPORTED_PARAMS = [
+    # OpenAI 兼容的请求参数（元组给出请求体中的规范字段顺序）
+    SUPPORTED_PARAMS_ORDER = (
         "model",
         "messages",
         "temperature",
@@ -27,7 +63,10 @@ class RequestGenerator:
         "tools",
         "tool_choice",
         "stream",
-    ]
+    )
+    # 集合用于按参数逐个判断成员，字典给出字段在规范顺序中的位置
+    SUPPORTED_PARAMS = frozenset(SUPPORTED_PARAMS_ORDER)
+    _PARAM_RANK = {name: i for i, name in enumerate(SUPPORTED_PARAMS_ORDER)}
     
     def __init__(self, endpoint: str = "", api_key: str = ""):
         """
@@ -40,14 +79,6 @@ class RequestGenerator:
         self._endpoint = endpoint
         self._api_key = api_key
     
-    def set_endpoint(self, endpoint: str):
-        """设置 API 端点"""
-        self._endpoint = endpoint
-    
-    def set_api_key(self, api_key: str):
-        """设置 API 密钥"""
-        self._api_key = api_key
-    
     def _mask_key(self, key: str) -> str:
         """脱敏密钥"""
         if not key:
@@ -57,7 +88,7 @@ class RequestGenerator:
             return k[:2] + "***"
         return k[:4] + "..." + k[-4:]
     
-    def generate_request_preview(self, params: Dict[str, Any]) -> Dict[str, Any]:
+    def generate_request_preview(self, params: PreviewParams) -> Dict[str, Any]:
         """
         生成请求报文预览
         
@@ -67,11 +98,11 @@ class RequestGenerator:
         Returns:
             包含请求头、请求体等信息的字典
         """
-        # 构建请求体
-        body = {}
-        for key in self.SUPPORTED_PARAMS:
-            if key in params and params[key] is not None:
-                body[key] = params[key]
+        # 构建请求体：遍历传入的参数（通常远少于支持的参数），再按规范顺序排列
+        supported = self.SUPPORTED_PARAMS
+        items = [(k, v) for k, v in params.items() if k in supported and v is not None]
+        items.sort(key=lambda item: self._PARAM_RANK[item[0]])
+        body = dict(items)
         
         # 确保必需字段存在
         if "model" not in body:
@@ -91,7 +122,7 @@ class RequestGenerator:
             "url": self._endpoint or "<ENDPOINT>",
             "headers": headers,
             "body": body,
-            "body_json": json.dumps(body, indent=2, ensure_ascii=False),
+            "body_json": orjson.dumps(body, option=orjson.OPT_INDENT_2).decode(),
         }
     
     def validate_custom_request(self, request_json: str) -> Tuple[bool, str]:
@@ -104,14 +135,44 @@ class RequestGenerator:
         Returns:
             (是否有效, 错误信息或空字符串)
         """
+        _, error = self.parse_and_validate(request_json)
+        if error:
+            return False, error
+        return True, ""
+    
+    def parse_and_validate(self, request_json: str) -> Tuple[Optional[Dict[str, Any]], Optional[str]]:
+        """
+        解析并验证自定义请求（JSON 只解析一次）
+        
+        Args:
+            request_json: JSON 格式的请求字符串
+        
+        Returns:
+            (解析后的请求字典, None)，或验证失败时 (None, 错误信息)
+        """
         if not request_json or not request_json.strip():
-            return False, "Request body cannot be empty"
+            return None, "Request body cannot be empty"
         
         try:
-            data = json.loads(request_json)
-        except json.JSONDecodeError as e:
-            return False, f"Invalid JSON format: {str(e)}"
+            data = orjson.loads(request_json)
+        except orjson.JSONDecodeError as e:
+            return None, f"Invalid JSON format: {str(e)}"
+        
+        valid, error = self._validate_data(data)
+        if not valid:
+            return None, error
+        return data, None
+    
+    def _validate_data(self, data: Any) -> Tuple[bool, str]:
+        """
+        验证已解析的请求数据结构
+        
+        Args:
+            data: 解析后的请求数据
         
+        Returns:
+            (是否有效, 错误信息或空字符串)
+        """
         if not isinstance(data, dict):
             return False, "Request body must be a JSON object"
         
@@ -131,46 +192,23 @@ class RequestGenerator:
             return False, "Field 'messages' cannot be empty"
         
         for i, msg in enumerate(messages):
+            # 常见情况（对象且含 role 与 content）只做一次组合判断
+            if isinstance(msg, dict) and "role" in msg and ("content" in msg or "tool_calls" in msg):
+                continue
             if not isinstance(msg, dict):
                 return False, f"Message at index {i} must be an object"
             if "role" not in msg:
                 return False, f"Message at index {i} missing 'role' field"
-            if "content" not in msg and "tool_calls" not in msg:
-                return False, f"Message at index {i} missing 'content' or 'tool_calls' field"
+            return False, f"Message at index {i} missing 'content' or 'tool_calls' field"
         
         # 验证可选字段类型
-        if "temperature" in data:
-            temp = data["temperature"]
-            if not isinstance(temp, (int, float)) or temp < 0 or temp > 2:
-                return False, "Field 'temperature' must be a number between 0 and 2"
-        
-        if "max_tokens" in data:
-            max_tokens = data["max_tokens"]
-            if not isinstance(max_tokens, int) or max_tokens < 1:
-                return False, "Field 'max_tokens' must be a positive integer"
-        
-        if "top_p" in data:
-            top_p = data["top_p"]
-            if not isinstance(top_p, (int, float)) or top_p < 0 or top_p > 1:
-                return False, "Field 'top_p' must be a number between 0 and 1"
-        
-        if "n" in data:
-            n = data["n"]
-            if not isinstance(n, int) or n < 1:
-                return False, "Field 'n' must be a positive integer"
-        
-        if "stream" in data:
-            if not isinstance(data["stream"], bool):
-                return False, "Field 'stream' must be a boolean"
-        
-        if "tools" in data:
-            tools = data["tools"]
-            if not isinstance(tools, list):
-                return False, "Field 'tools' must be an array"
+        for field, check, error in _OPTIONAL_FIELD_CHECKS:
+            if field in data and not check(data[field]):
+                return False, error
         
         return True, ""
     
-    def generate_initial_custom_request(self, params: Dict[str, Any]) -> str:
+    def generate_initial_custom_request(self, params: PreviewParams) -> str:
         """
         根据操练场参数生成初始自定义请求
         
@@ -193,15 +231,12 @@ class RequestGenerator:
         Returns:
             解析后的请求字典，如果解析失败则返回 None
         """
-        valid, error = self.validate_custom_request(request_json)
-        if not valid:
+        # JSON 只解析一次，解析结果直接返回
+        data, error = self.parse_and_validate(request_json)
+        if error:
             log.warning(f"Invalid custom request: {error}")
             return None
-        
-        try:
-            return json.loads(request_json)
-        except Exception:
-            return None
+        return data
     
     def merge_with_defaults(
         self, 
@@ -223,16 +258,19 @@ class RequestGenerator:
         return result
 
 
-# 全局实例
-_request_generator: Optional[RequestGenerator] = None
+@lru_cache(maxsize=256)
+def get_request_generator_for(endpoint: str = "", api_key: str = "") -> RequestGenerator:
+    """按 (endpoint, api_key) 获取共享的请求生成器实例"""
+    return RequestGenerator(endpoint, api_key)
 
 
 def get_request_generator() -> RequestGenerator:
-    """获取全局请求生成器实例"""
-    global _request_generator
-    if _request_generator is None:
-        _request_generator = RequestGenerator()
-    return _request_generator
+    """
+    获取不带端点与密钥的请求生成器实例
+    
+    已弃用：请改用 get_request_generator_for()，此函数仅为兼容保留
+    """
+    return get_request_generator_for()
 
 
 def create_request_generator(endpoint: str = "", api_key: str = "") -> RequestGenerator:
@@ -2,55 +2,83 @@
 XML Parser for Tool Calls
 解析 content 中的 XML 格式工具调用 (兼容 Anthropic 手动工具调用格式)
 """
+import os
 import re
-import json
-import uuid
 from typing import Tuple, List, Dict, Any
 
+import orjson
+
+# function_calls 开始/结束标签共有的片段（同时覆盖带命名空间前缀的写法）
+_FUNCTION_CALLS_MARKER = "function_calls>"
+
+
+def _tag_body(tag: str) -> str:
+    """
+    生成匹配 tag 标签内容及其结束标签的正则片段
+    
+    使用展开的受限贪婪写法：整段吞掉非 < 字符，遇到 < 时仅在其不是结束标签时继续。
+    与 .*? 一样停在第一个结束标签处，但无需逐字符尝试结束标签，也不会回溯
+    """
+    return rf'([^<]*+(?:<(?!/(?:\w+:)?{tag}>)[^<]*+)*+)</(?:\w+:)?{tag}>'
+
+
+# 各级标签均兼容任意命名空间前缀（如 antml:, atml: 等），模块加载时编译一次
+_FUNCTION_CALLS_RE = re.compile(r'<(?:\w+:)?function_calls>' + _tag_body("function_calls"))
+_INVOKE_RE = re.compile(r'<(?:\w+:)?invoke name="([^"]*)">' + _tag_body("invoke"))
+_PARAMETER_RE = re.compile(r'<(?:\w+:)?parameter name="([^"]*)">' + _tag_body("parameter"))
+
+
+def has_xml_tool_calls(content: str) -> bool:
+    """快速判断 content 是否可能包含 XML 工具调用（纯子串检查，不运行正则）"""
+    return _FUNCTION_CALLS_MARKER in content
+
+
 def parse_xml_tool_calls(content: str) -> Tuple[str, List[Dict[str, Any]]]:
     """
     解析 content 中的 XML 格式工具调用
     返回: (cleaned_content, tool_calls_list)
     """
-    # 检测 function_calls 块 (支持任意命名空间前缀如 antml:, atml: 等)
-    xml_pattern = r'<(?:\w+:)?function_calls>(.*?)</(?:\w+:)?function_calls>'
-    matches = re.search(xml_pattern, content, re.DOTALL)
-    
-    if not matches:
+    if not has_xml_tool_calls(content):
         return content, []
     
-    xml_content = matches.group(1)
+    # 单次扫描：逐个匹配 function_calls 块，同时解析其中的工具调用并拼接块之间的文本
     tool_calls = []
-    
-    # 兼容任意命名空间前缀的 <invoke> 标签
-    invoke_pattern = r'<(?:\w+:)?invoke name="(.*?)">(.*?)</(?:\w+:)?invoke>'
-    invokes = re.findall(invoke_pattern, xml_content, re.DOTALL)
-    
-    for name, params_str in invokes:
-        # 解析参数
-        args = {}
-        # 兼容任意命名空间前缀的 <parameter> 标签
-        param_pattern = r'<(?:\w+:)?parameter name="(.*?)">(.*?)</(?:\w+:)?parameter>'
-
-        params = re.findall(param_pattern, params_str, re.DOTALL)
-        for param_name, param_value in params:
-            # [修复] 参数名映射: 模型生成的 XML 可能使用错误的参数名
-            # 例如 read_file: file_path -> path
-            if name == "read_file" and param_name == "file_path":
-                param_name = "path"
-            
-            args[param_name] = param_value.strip()
+    text_parts = []
+    last_end = 0
+    for block in _FUNCTION_CALLS_RE.finditer(content):
+        text_parts.append(content[last_end:block.start()])
+        last_end = block.end()
+        
+        xml_content = block.group(1)
+        # 块内没有 invoke 标签时跳过正则扫描
+        if "invoke" not in xml_content:
+            continue
         
-        tool_calls.append({
-            "id": f"call_{uuid.uuid4().hex[:24]}",
-            "type": "function",
-            "function": {
-                "name": name,
-                "arguments": json.dumps(args, ensure_ascii=False)
-            }
-        })
+        for name, params_str in _INVOKE_RE.findall(xml_content):
+            # 解析参数
+            args = {}
+            for param_name, param_value in _PARAMETER_RE.findall(params_str):
+                # [修复] 参数名映射: 模型生成的 XML 可能使用错误的参数名
+                # 例如 read_file: file_path -> path
+                if name == "read_file" and param_name == "file_path":
+                    param_name = "path"
+                
+                args[param_name] = param_value.strip()
             
+            tool_calls.append({
+                "id": "call_" + os.urandom(12).hex(),
+                "type": "function",
+                "function": {
+                    "name": name,
+                    "arguments": orjson.dumps(args).decode()
+                }
+            })
+    
+    if not text_parts:
+        return content, []
+    
     # 移除 XML 部分，只保留自然语言回复
-    cleaned_content = re.sub(xml_pattern, "", content, flags=re.DOTALL).strip()
+    text_parts.append(content[last_end:])
+    cleaned_content = "".join(text_parts).strip()
     
     return cleaned_content, tool_calls
@@ -3,6 +3,7 @@ Tests for fake streaming mode
 测试假流式模式
 Feature: openai-protocol-refactor, Property 11: 假流式模式启用
 """
+import asyncio
 import pytest
 import json
 from unittest.mock import AsyncMock, patch, MagicMock
@@ -202,5 +203,307 @@ class TestFakeStreaming:
                chunk["choices"][0]["delta"].get("content") is None
 
 
+class TestSSEFrame:
+    """测试 SSE 帧序列化"""
+    
+    def test_frame_is_compact_utf8(self):
+        """测试帧为紧凑 JSON，非 ASCII 字符直接以 UTF-8 输出"""
+        from src.services.assembly_stream_handler import _sse_frame, _SSE_DONE
+        
+        frame = _sse_frame({"choices": [{"delta": {"content": "你好"}}]})
+        
+        assert frame == 'data: {"choices":[{"delta":{"content":"你好"}}]}\n\n'.encode("utf-8")
+        assert json.loads(frame[len(b"data: "):]) == {"choices": [{"delta": {"content": "你好"}}]}
+        assert _SSE_DONE == b"data: [DONE]\n\n"
+    
+    def test_content_frame_parts_match_full_chunk(self):
+        """测试预序列化的内容块模板与完整结构序列化结果一致"""
+        import orjson
+        from src.services.assembly_stream_handler import _content_frame_parts, _sse_frame
+        
+        head, tail = _content_frame_parts("chatcmpl-1", 1700000000, "gpt-5")
+        for text in ("Hello", '引号"与\n换行'):
+            expected = _sse_frame({
+                "id": "chatcmpl-1",
+                "object": "chat.completion.chunk",
+                "created": 1700000000,
+                "model": "gpt-5",
+                "choices": [{
+                    "index": 0,
+                    "delta": {"role": "assistant", "content": text},
+                    "finish_reason": None
+                }]
+            })
+            assert head + orjson.dumps(text) + tail == expected
+    
+    def test_fix_tool_call_normalizes_arguments(self):
+        """测试工具调用规范化：补全字段、参数映射、arguments 转为 JSON 字符串"""
+        from src.services.assembly_stream_handler import _fix_tool_call
+        
+        fixed = _fix_tool_call({"function": {"name": "read_file", "arguments": '{"file_path": "a.py"}'}})
+        assert fixed["id"].startswith("call_")
+        assert fixed["type"] == "function"
+        assert json.loads(fixed["function"]["arguments"]) == {"path": "a.py"}
+        
+        fixed = _fix_tool_call({"id": "call_1", "function": {"name": "search", "arguments": {"q": "你好"}}})
+        assert fixed == {
+            "id": "call_1",
+            "type": "function",
+            "function": {"name": "search", "arguments": '{"q":"你好"}'},
+        }
+        assert _fix_tool_call({"function": {"name": "noop", "arguments": None}})["function"]["arguments"] == "{}"
+        assert _fix_tool_call({"id": "call_2"})["function"] == {"name": "", "arguments": "{}"}
+        
+        # 不含需映射参数的字符串参数原样透传（保留原始格式）
+        raw = '{"path": "b.py",  "limit": 10}'
+        assert _fix_tool_call({"function": {"name": "read_file", "arguments": raw}})["function"]["arguments"] == raw
+    
+    def test_response_body_kept_as_bytes(self):
+        """测试上游响应体以 bytes 形式取出，不做 str 往返"""
+        from fastapi.responses import JSONResponse
+        from src.services.assembly_stream_handler import _response_body
+        
+        body = _response_body(JSONResponse({"content": "你好"}))
+        assert isinstance(body, bytes)
+        assert json.loads(body) == {"content": "你好"}
+        
+        # httpx.Response 没有 body 属性，直接取 content
+        import httpx
+        assert _response_body(httpx.Response(200, content=b'{"ok":true}')) == b'{"ok":true}'
+        
+        # 只有 text 属性的响应对象也能取出 UTF-8 bytes
+        assert _response_body(MagicMock(spec=["text"], text="文本")) == "文本".encode("utf-8")
+
+
+class TestFakeStreamProgressive:
+    """测试假流式渐进输出的帧内容"""
+    
+    @staticmethod
+    async def _collect(content: str, speed: int = 200, delay: float = 0.0, enabled: bool = True) -> tuple:
+        from fastapi.responses import JSONResponse
+        from src.services import assembly_stream_handler as handler
+        
+        upstream = JSONResponse({
+            "choices": [{"message": {"role": "assistant", "content": content}, "finish_reason": "stop"}],
+            "usage": {"prompt_tokens": 3, "completion_tokens": 5},
+        })
+        settings = {"fake_stream_enabled": enabled, "fake_stream_speed": speed}
+        
+        async def fake_config(key, default=None):
+            return settings.get(key, default)
+        
+        request = ChatCompletionRequest(
+            model="gpt-5",
+            messages=[OpenAIChatMessage(role="user", content="Hi")],
+            stream=True
+        )
+        handler.invalidate_fake_stream_settings()
+        async def fake_send(*args, **kwargs):
+            await asyncio.sleep(delay)
+            return upstream
+        
+        with patch.object(handler, "send_assembly_request", side_effect=fake_send), \
+             patch.object(handler, "get_config_value", side_effect=fake_config):
+            response = await handler.fake_stream_response_for_assembly(request)
+            writes = [chunk async for chunk in response.body_iterator]
+        
+        frames = [f[len(b"data: "):] for f in b"".join(writes).split(b"\n\n") if f]
+        assert frames[-1] == b"[DONE]"
+        return writes, [json.loads(f) for f in frames[:-1]]
+    
+    @pytest.mark.asyncio
+    @pytest.mark.parametrize("content", ["Hello world, progressive output! " * 8, '中文"引号"\n与换行混合内容' * 20])
+    async def test_progressive_chunks_reassemble_content(self, content):
+        """测试渐进输出的各块拼接后与原内容一致（ASCII 直切与转义回退两种路径）"""
+        _, chunks = await self._collect(content, speed=2000)
+        
+        content_chunks = chunks[1:-1]
+        assert len(content_chunks) > 1
+        assert "".join(c["choices"][0]["delta"]["content"] for c in content_chunks) == content
+        assert len({(c["id"], c["created"]) for c in content_chunks}) == 1
+        assert all(c["choices"][0]["finish_reason"] is None for c in content_chunks)
+        assert chunks[-1]["choices"][0]["finish_reason"] == "stop"
+        assert chunks[-1]["usage"]["completion_tokens"] == 5
+    
+    @pytest.mark.asyncio
+    async def test_progressive_output_keeps_configured_pace(self):
+        """测试渐进输出按节拍进行：总耗时约为 (块数 - 1) × 间隔，不因每块开销而累积"""
+        loop = asyncio.get_running_loop()
+        start = loop.time()
+        # 2000 chars/s → 每 50ms 100 个字符，400 个字符共 4 块、3 个间隔
+        _, chunks = await self._collect("x" * 400, speed=2000)
+        elapsed = loop.time() - start
+        
+        assert len(chunks) == 1 + 4 + 1
+        assert 0.14 <= elapsed < 0.5
+    
+    @pytest.mark.asyncio
+    async def test_low_speed_uses_larger_chunks(self):
+        """测试低速时每块不少于最小字符数（通过拉长间隔保持字符速率）"""
+        from src.services import assembly_stream_handler as handler
+        
+        with patch.object(handler, "FAKE_STREAM_MIN_CHARS_PER_CHUNK", 4):
+            # 100 chars/s、每块至少 4 个字符 → 每 50ms 5 个字符
+            _, chunks = await self._collect("y" * 12, speed=100)
+            assert [len(c["choices"][0]["delta"]["content"]) for c in chunks[1:-1]] == [5, 5, 2]
+            # 20 chars/s → 间隔拉长到 200ms，每块 4 个字符
+            _, chunks = await self._collect("y" * 8, speed=20)
+            assert [len(c["choices"][0]["delta"]["content"]) for c in chunks[1:-1]] == [4, 4]
+    
+    @pytest.mark.asyncio
+    async def test_one_shot_chunks_share_id_and_created(self):
+        """测试一次性输出时内容块与结束块共用 id 与 created"""
+        _, chunks = await self._collect("Hello", enabled=False)
+        
+        content_chunk, finish_chunk = chunks[1], chunks[2]
+        assert content_chunk["choices"][0]["delta"]["content"] == "Hello"
+        assert finish_chunk["choices"][0]["finish_reason"] == "stop"
+        assert (content_chunk["id"], content_chunk["created"]) == (finish_chunk["id"], finish_chunk["created"])
+        assert content_chunk["id"].startswith("chatcmpl-") and len(content_chunk["id"]) == len("chatcmpl-") + 32
+    
+    @pytest.mark.asyncio
+    async def test_heartbeat_merged_into_first_write(self):
+        """测试上游快速返回时首个心跳与第一个内容块在同一次写入中发出"""
+        writes, chunks = await self._collect("Hi there", speed=20)
+        
+        first = writes[0].split(b"\n\n")
+        assert len(first) > 2
+        assert json.loads(first[0][len(b"data: "):]) == chunks[0]
+        assert chunks[0]["choices"][0]["delta"] == {"role": "assistant", "content": ""}
+        assert json.loads(first[1][len(b"data: "):])["choices"][0]["delta"]["content"]
+        # 心跳只发送一次
+        assert sum(1 for c in chunks if c["choices"][0]["delta"].get("content") == "") == 1
+    
+    @pytest.mark.asyncio
+    async def test_response_forwarded_without_waiting_for_heartbeat_tick(self):
+        """测试上游响应到达后立即输出，不等到下一次心跳"""
+        loop = asyncio.get_running_loop()
+        start = loop.time()
+        _, chunks = await self._collect("Done", speed=2000, delay=0.1)
+        
+        assert loop.time() - start < 1.0
+        assert chunks[1]["choices"][0]["delta"]["content"] == "Done"
+    
+    @pytest.mark.asyncio
+    async def test_slow_response_sends_periodic_heartbeats(self):
+        """测试上游较慢时按间隔单独发送心跳"""
+        from src.services import assembly_stream_handler as handler
+        
+        with patch.object(handler, "FAKE_STREAM_HEARTBEAT_INTERVAL", 0.05):
+            writes, chunks = await self._collect("Done", speed=2000, delay=0.18)
+        
+        heartbeats = [c for c in chunks if "id" not in c]
+        assert len(heartbeats) >= 2
+        assert writes[0].count(b"data: ") == 1
+        assert chunks[len(heartbeats)]["choices"][0]["delta"]["content"] == "Done"
+    
+    @pytest.mark.asyncio
+    async def test_fake_stream_settings_cached(self):
+        """测试假流式配置在缓存期内只读取一次，失效后重新读取"""
+        from src.services import assembly_stream_handler as handler
+        
+        handler.invalidate_fake_stream_settings()
+        reader = AsyncMock(side_effect=lambda key, default=None: {"fake_stream_speed": "300"}.get(key, default))
+        with patch.object(handler, "get_config_value", reader):
+            assert await handler._get_fake_stream_settings() == (False, 300)
+            assert await handler._get_fake_stream_settings() == (False, 300)
+            assert reader.await_count == 2
+            
+            handler.invalidate_fake_stream_settings()
+            await handler._get_fake_stream_settings()
+            assert reader.await_count == 4
+        handler.invalidate_fake_stream_settings()
+
+
+class TestStreamConversion:
+    """测试上游流式块转换为 OpenAI 格式"""
+    
+    @pytest.mark.asyncio
+    async def test_bytes_str_and_dict_chunks(self):
+        """测试 bytes、str 与进程内 dict 块均能转换，非 data 帧与坏 JSON 被跳过"""
+        from src.services.assembly_stream_handler import convert_streaming_response
+        
+        async def body():
+            yield b'data: {"candidates":[{"content":{"parts":[{"text":"A"}]}}]}\n\n'
+            yield b": keep-alive\n\n"
+            yield b"data: {broken\n\n"
+            yield {"candidates": [{"content": {"parts": [{"text": "B"}]}, "finishReason": "STOP"}]}
+        
+        upstream = MagicMock(spec=["body_iterator"], body_iterator=body())
+        response = await convert_streaming_response(upstream, "gpt-5")
+        raw = b"".join([chunk async for chunk in response.body_iterator])
+        
+        frames = [f[len(b"data: "):] for f in raw.split(b"\n\n") if f]
+        assert frames[-1] == b"[DONE]"
+        chunks = [json.loads(f) for f in frames[:-1]]
+        assert [c["choices"][0]["delta"]["content"] for c in chunks] == ["A", "B"]
+        assert chunks[1]["choices"][0]["finish_reason"] == "stop"
+        assert chunks[0]["id"] == chunks[1]["id"] and chunks[0]["created"] == chunks[1]["created"]
+
+class TestSSECoalescing:
+    """测试 SSE 帧写合并"""
+    
+    @pytest.mark.asyncio
+    async def test_first_chunk_sent_alone_and_burst_merged(self):
+        """测试首块单独发送，后续连续帧合并为一次写入"""
+        from src.services.assembly_stream_handler import _coalesce_sse
+        
+        async def source():
+            yield b"data: first\n\n"
+            for i in range(3):
+                yield f"data: {i}\n\n".encode()
+            yield b"data: [DONE]\n\n"
+        
+        out = [chunk async for chunk in _coalesce_sse(source())]
+        
+        # 验证：首块不被合并（保证 TTFT）
+        assert out[0] == b"data: first\n\n"
+        # 验证：内容完整且顺序不变
+        assert b"".join(out) == b"data: first\n\ndata: 0\n\ndata: 1\n\ndata: 2\n\ndata: [DONE]\n\n"
+        # 验证：突发帧被合并
+        assert len(out) < 5
+    
+    @pytest.mark.asyncio
+    async def test_frame_after_pause_sent_immediately(self):
+        """测试上游暂停后到达的帧与缓冲区内容一起立即发送"""
+        import asyncio
+        from src.services.assembly_stream_handler import _coalesce_sse
+        
+        release = asyncio.Event()
+        
+        async def source():
+            yield b"a"
+            yield b"b"
+            await release.wait()
+            yield b"c"
+            await asyncio.sleep(1)
+            yield b"d"
+        
+        gen = _coalesce_sse(source())
+        assert await gen.__anext__() == b"a"
+        pending = asyncio.ensure_future(gen.__anext__())
+        await asyncio.sleep(0.02)
+        release.set()
+        # "b" 在突发中被缓冲，"c" 在暂停后到达，二者一起发出而不等待 "d"
+        assert await asyncio.wait_for(pending, timeout=0.5) == b"bc"
+        await gen.aclose()
+    
+    @pytest.mark.asyncio
+    async def test_source_driven_in_iterating_task(self):
+        """测试上游生成器在迭代方任务内运行，不额外创建任务"""
+        import asyncio
+        from src.services.assembly_stream_handler import _coalesce_sse
+        
+        tasks = []
+        
+        async def source():
+            for i in range(3):
+                tasks.append(asyncio.current_task())
+                yield f"data: {i}\n\n".encode()
+        
+        out = [chunk async for chunk in _coalesce_sse(source())]
+        assert b"".join(out) == b"data: 0\n\ndata: 1\n\ndata: 2\n\n"
+        assert tasks == [asyncio.current_task()] * 3
+
 if __name__ == "__main__":
     pytest.main([__file__, "-v"])
@@ -0,0 +1,68 @@
+"""
+Tests for Gemini -> OpenAI stream chunk conversion
+测试 Gemini 流式块到 OpenAI 流式格式的转换
+"""
+import pytest
+
+from src.transform.openai_transfer import (
+    _extract_content_and_reasoning,
+    _map_finish_reason,
+    gemini_stream_chunk_to_openai,
+)
+
+
+class TestStreamChunkConversion:
+    """测试流式块转换"""
+    
+    def test_content_chunk(self):
+        """测试普通内容块：delta 只含内容，不带 usage"""
+        chunk = {
+            "candidates": [{"content": {"role": "model", "parts": [{"text": "Hello"}]}}],
+            "usageMetadata": {"promptTokenCount": 3},
+        }
+        
+        result = gemini_stream_chunk_to_openai(chunk, "gpt-5", "resp-1", 1700000000)
+        
+        assert result == {
+            "id": "resp-1",
+            "object": "chat.completion.chunk",
+            "created": 1700000000,
+            "model": "gpt-5",
+            "choices": [{"index": 0, "delta": {"content": "Hello"}, "finish_reason": None}],
+        }
+    
+    def test_final_chunk_carries_usage(self):
+        """测试带结束原因的最后一块附带 usage"""
+        chunk = {
+            "candidates": [{"content": {"parts": [{"text": "想", "thought": True}]}, "finishReason": "MAX_TOKENS"}],
+            "usageMetadata": {"promptTokenCount": 3, "candidatesTokenCount": 5, "totalTokenCount": 8},
+        }
+        
+        result = gemini_stream_chunk_to_openai(chunk, "gpt-5", "resp-1")
+        
+        assert isinstance(result["created"], int)
+        assert result["choices"][0]["delta"] == {"reasoning_content": "想"}
+        assert result["choices"][0]["finish_reason"] == "length"
+        assert result["usage"] == {"prompt_tokens": 3, "completion_tokens": 5, "total_tokens": 8}
+    
+    def test_extract_multiple_parts(self):
+        """测试多个部件按类型分别拼接"""
+        parts = [{"text": "a"}, {"text": "思", "thought": True}, {"text": ""}, {"text": "b"}]
+        assert _extract_content_and_reasoning(parts) == ("ab", "思")
+        assert _extract_content_and_reasoning([{"text": ""}]) == ("", "")
+        assert _extract_content_and_reasoning([]) == ("", "")
+    
+    @pytest.mark.parametrize("reason,expected", [
+        ("STOP", "stop"),
+        ("MAX_TOKENS", "length"),
+        ("SAFETY", "content_filter"),
+        ("RECITATION", "content_filter"),
+        ("OTHER", None),
+        (None, None),
+    ])
+    def test_map_finish_reason(self, reason, expected):
+        assert _map_finish_reason(reason) == expected
+
+
+if __name__ == "__main__":
+    pytest.main([__file__, "-v"])
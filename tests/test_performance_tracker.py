@@ -0,0 +1,262 @@
+"""
+Tests for performance tracker
+测试性能追踪器的批量写入、分页查询与统计聚合
+"""
+import asyncio
+import pytest
+from typing import Any, Dict
+
+import src.storage.storage_adapter as storage_adapter
+from src.stats.performance_tracker import (
+    PerformanceTracker,
+    RequestTrace,
+    _durations_from_ts,
+    _metrics_from_ts,
+)
+
+
+class FakePerfAdapter:
+    """仅实现 perf 接口的内存存储"""
+
+    def __init__(self):
+        self.data: Dict[str, Any] = {}
+        self.set_calls = 0
+
+    async def get_perf(self, key: str, default: Any = None) -> Any:
+        return self.data.get(key, default)
+
+    async def set_perf(self, key: str, value: Any) -> bool:
+        self.set_calls += 1
+        self.data[key] = list(value) if isinstance(value, list) else value
+        return True
+
+    async def delete_perf(self, key: str) -> bool:
+        return self.data.pop(key, None) is not None
+
+
+@pytest.fixture
+def fake_adapter(monkeypatch):
+    adapter = FakePerfAdapter()
+
+    async def _get_adapter():
+        return adapter
+
+    monkeypatch.setattr(storage_adapter, "get_storage_adapter", _get_adapter)
+    return adapter
+
+
+def _make_trace(trace_id: str, model: str, ttfb: float, total: float) -> RequestTrace:
+    trace = RequestTrace(trace_id=trace_id, model=model, start_time=1000.0)
+    trace.timestamps = {
+        "request_received": 0.0,
+        "upstream_first_byte": ttfb,
+        "first_chunk_sent": ttfb + 1,
+        "response_complete": total,
+    }
+    return trace
+
+
+async def _drain(tracker: PerformanceTracker):
+    """等待后台写入协程处理完队列"""
+    for _ in range(100):
+        if tracker._save_queue.empty() and not tracker._save_lock.locked():
+            break
+        await asyncio.sleep(tracker.SAVE_BATCH_TIMEOUT)
+    await asyncio.sleep(tracker.SAVE_BATCH_TIMEOUT * 2)
+
+
+class TestTraceMetrics:
+    """测试指标计算函数"""
+
+    def test_metrics_from_ts(self):
+        ts = {"request_received": 0.0, "upstream_first_byte": 100.0, "first_chunk_sent": 150.0, "response_complete": 2000.0}
+        metrics = _metrics_from_ts(ts, 100)
+        assert metrics["ttfb"] == 100.0
+        assert metrics["ttft"] == 150.0
+        assert metrics["total_latency"] == 2000.0
+        assert metrics["tps"] == 50.0
+
+    def test_durations_skip_missing_stages(self):
+        ts = {"request_received": 0.0, "upstream_first_byte": 40.0, "response_complete": 100.0}
+        assert _durations_from_ts(ts) == {
+            "request_received": 0.0,
+            "upstream_first_byte": 40.0,
+            "response_complete": 60.0,
+        }
+
+
+class TestPerformanceTracker:
+    """测试追踪器的写入与查询"""
+
+    @pytest.mark.asyncio
+    async def test_end_trace_batches_writes(self, fake_adapter):
+        tracker = PerformanceTracker()
+        await tracker.initialize()
+
+        for i in range(10):
+            trace = _make_trace(f"trace-{i}", "gpt-5", ttfb=10.0 * (i + 1), total=1000.0)
+            tracker.active_traces[trace.trace_id] = trace
+            await tracker.end_trace(trace.trace_id, completion_tokens=10)
+        await _drain(tracker)
+
+        # 验证：10 条记录写入同一分片，且远少于每条两次写入
+        assert len(fake_adapter.data["perf_traces_0"]) == 10
+        assert fake_adapter.set_calls < 20
+        tracker._writer_task.cancel()
+
+    @pytest.mark.asyncio
+    async def test_paginated_and_stats(self, fake_adapter):
+        tracker = PerformanceTracker()
+        await tracker.initialize()
+
+        for i in range(6):
+            model = "model-a" if i % 2 == 0 else "model-b"
+            trace = _make_trace(f"trace-{i}", model, ttfb=100.0, total=1000.0)
+            tracker.active_traces[trace.trace_id] = trace
+            await tracker.end_trace(trace.trace_id, completion_tokens=100)
+        await _drain(tracker)
+
+        page = await tracker.get_traces_paginated(page=1, page_size=2, model="model-a")
+        assert page["total"] == 3
+        assert len(page["traces"]) == 2
+        assert page["traces"][0]["metrics"]["ttfb"] == 100.0
+
+        stats = await tracker.get_stats(use_cache=False)
+        assert stats["count"] == 6
+        assert stats["ttfb"]["p50"] == 100.0
+        assert stats["tps"]["avg"] == 100.0
+        assert sorted(stats["models"]) == ["model-a", "model-b"]
+
+        stats_a = await tracker.get_stats(model="model-a", use_cache=False)
+        assert stats_a["count"] == 3
+        assert stats_a["models"] == ["model-a"]
+        assert sorted(await tracker.get_models()) == ["model-a", "model-b"]
+
+        detail = await tracker.get_trace_by_id("trace-3")
+        assert detail["model"] == "model-b"
+        assert detail["durations"]["response_complete"] == 899.0
+
+        # 验证：指标作为记录顶层字段保存，不写入调用方的 metadata
+        record = fake_adapter.data["perf_traces_0"][0]
+        assert record["metrics"]["ttfb"] == 100.0
+        assert record["metadata"] == {}
+        assert page["traces"][0]["metadata"] == {}
+        tracker._writer_task.cancel()
+
+    @pytest.mark.asyncio
+    async def test_paginated_newest_first(self, fake_adapter):
+        tracker = PerformanceTracker()
+        await tracker.initialize()
+
+        for i in range(5):
+            trace = _make_trace(f"trace-{i}", "model-a", ttfb=100.0, total=1000.0)
+            trace.start_time = 1000.0 + i
+            tracker.active_traces[trace.trace_id] = trace
+            await tracker.end_trace(trace.trace_id, completion_tokens=10)
+        await _drain(tracker)
+
+        page1 = await tracker.get_traces_paginated(page=1, page_size=2)
+        page3 = await tracker.get_traces_paginated(page=9, page_size=2)
+        assert [t["trace_id"] for t in page1["traces"]] == ["trace-4", "trace-3"]
+        # 超出范围的页码回退到最后一页
+        assert page3["page"] == 3
+        assert [t["trace_id"] for t in page3["traces"]] == ["trace-0"]
+        tracker._writer_task.cancel()
+
+    @pytest.mark.asyncio
+    async def test_dashboard_endpoint(self, fake_adapter):
+        from src.api.playground_api import get_performance_dashboard
+
+        tracker = PerformanceTracker()
+        await tracker.initialize()
+
+        for i in range(3):
+            trace = _make_trace(f"trace-{i}", "model-a", ttfb=100.0, total=1000.0)
+            tracker.active_traces[trace.trace_id] = trace
+            await tracker.end_trace(trace.trace_id, completion_tokens=100)
+        await _drain(tracker)
+
+        result = await get_performance_dashboard(page=1, page_size=2, tracker=tracker)
+        assert result["stats"]["count"] == 3
+        assert result["models"] == ["model-a"]
+        assert result["traces"]["total"] == 3
+        assert len(result["traces"]["traces"]) == 2
+        tracker._writer_task.cancel()
+
+    @pytest.mark.asyncio
+    async def test_clear_all_resets_state(self, fake_adapter):
+        tracker = PerformanceTracker()
+        await tracker.initialize()
+
+        for i in range(3):
+            trace = _make_trace(f"trace-{i}", "model-a", ttfb=100.0, total=1000.0)
+            tracker.active_traces[trace.trace_id] = trace
+            await tracker.end_trace(trace.trace_id, completion_tokens=10)
+        await _drain(tracker)
+        assert (await tracker.get_stats(use_cache=False))["count"] == 3
+
+        await tracker.clear_all()
+        assert "perf_traces_0" not in fake_adapter.data
+        assert (await tracker.get_stats(use_cache=False))["count"] == 0
+        assert await tracker.get_models() == []
+        tracker._writer_task.cancel()
+
+    @pytest.mark.asyncio
+    async def test_clear_endpoint_finishes_before_returning(self, fake_adapter):
+        from src.api.playground_api import clear_performance_data
+
+        tracker = PerformanceTracker()
+        await tracker.initialize()
+        trace = _make_trace("trace-0", "model-a", ttfb=100.0, total=1000.0)
+        tracker.active_traces[trace.trace_id] = trace
+        await tracker.end_trace(trace.trace_id, completion_tokens=10)
+        await _drain(tracker)
+        assert "perf_traces_0" in fake_adapter.data
+
+        # 返回时数据已清空，前端随后刷新不会读到旧数据
+        result = await clear_performance_data(tracker=tracker)
+        assert result["success"] is True
+        assert "perf_traces_0" not in fake_adapter.data
+        assert (await tracker.get_stats(use_cache=False))["count"] == 0
+        tracker._writer_task.cancel()
+
+    @pytest.mark.asyncio
+    async def test_cached_stats_refreshed_after_flush(self, fake_adapter):
+        tracker = PerformanceTracker()
+        await tracker.initialize()
+
+        trace = _make_trace("trace-0", "model-a", ttfb=100.0, total=1000.0)
+        tracker.active_traces[trace.trace_id] = trace
+        await tracker.end_trace(trace.trace_id, completion_tokens=10)
+        await _drain(tracker)
+        assert (await tracker.get_stats())["count"] == 1
+
+        # 写入窗口内读取统计：此时新记录尚未落盘，缓存的结果不含该记录
+        trace = _make_trace("trace-1", "model-a", ttfb=100.0, total=1000.0)
+        tracker.active_traces[trace.trace_id] = trace
+        await tracker.end_trace(trace.trace_id, completion_tokens=10)
+        before = tracker.etag("stats", None)
+        assert (await tracker.get_stats())["count"] == 1
+        await _drain(tracker)
+
+        # 验证：写入后 ETag 变化，且同一 ETag 下返回的统计包含新记录
+        assert tracker.etag("stats", None) != before
+        assert (await tracker.get_stats())["count"] == 2
+        tracker._writer_task.cancel()
+
+    @pytest.mark.asyncio
+    async def test_etag_changes_after_write(self, fake_adapter):
+        tracker = PerformanceTracker()
+        await tracker.initialize()
+
+        before = tracker.etag("stats", "模型\"a")
+        assert before == tracker.etag("stats", "模型\"a")
+        assert before != tracker.etag("stats", None)
+        before.encode("latin-1")
+
+        trace = _make_trace("trace-0", "model-a", ttfb=100.0, total=1000.0)
+        tracker.active_traces[trace.trace_id] = trace
+        await tracker.end_trace(trace.trace_id, completion_tokens=10)
+        await _drain(tracker)
+        assert tracker.etag("stats", "模型\"a") != before
+        tracker._writer_task.cancel()
@@ -135,6 +135,54 @@ class TestPlaygroundAPI:
             is_valid, error = generator.validate_custom_request(request_json)
             assert not is_valid, f"Should be invalid: {request_json}"
             assert expected_error in error, f"Error should contain '{expected_error}', got '{error}'"
+    
+    def test_parse_and_validate(self, generator):
+        """测试解析与验证合并为一次调用"""
+        data, error = generator.parse_and_validate('{"model": "gpt-4", "messages": [{"role": "user", "content": "hi"}]}')
+        assert error is None
+        assert data["model"] == "gpt-4"
+        
+        data, error = generator.parse_and_validate('{"model": "gpt-4", "messages": []}')
+        assert data is None
+        assert "Field 'messages' cannot be empty" in error
+        
+        data, error = generator.parse_and_validate("{not json")
+        assert data is None
+        assert error.startswith("Invalid JSON format")
+
+
+class TestSendCustomRequest:
+    """测试自定义报文发送端点的校验"""
+    
+    @pytest.mark.asyncio
+    @pytest.mark.parametrize("extra, message", [
+        ({"stream": "true"}, "Field 'stream' must be a boolean"),
+        ({"tools": {}}, "Field 'tools' must be an array"),
+    ])
+    async def test_send_rejects_same_as_validate(self, monkeypatch, extra, message):
+        """测试发送前执行与 /validate 相同的结构检查，不合法的请求不会发往上游"""
+        from fastapi import HTTPException
+        from src.api import playground_api
+        
+        sent = []
+        
+        async def fake_send(*args, **kwargs):
+            sent.append(args)
+        
+        monkeypatch.setattr(playground_api, "send_assembly_request", fake_send)
+        monkeypatch.setattr(playground_api, "get_request_generator_for", lambda: RequestGenerator())
+        request_json = json.dumps({
+            "model": "gpt-4",
+            "messages": [{"role": "user", "content": "hi"}],
+            **extra,
+        })
+        
+        with pytest.raises(HTTPException) as exc_info:
+            await playground_api.send_custom_request(playground_api.CustomRequest(request_json=request_json))
+        
+        assert exc_info.value.status_code == 400
+        assert exc_info.value.detail == f"Invalid request: {message}"
+        assert sent == []
 
 
 class TestPlaygroundAPIIntegration:
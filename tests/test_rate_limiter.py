@@ -0,0 +1,477 @@
+"""
+Tests for rate limiter
+测试速率限制管理器的状态更新与合并写入
+"""
+import asyncio
+import time
+import pytest
+from typing import Any, Dict
+
+import config
+import src.services.rate_limiter as rate_limiter_module
+from src.models.models_key import KeyStatus
+from src.services.rate_limiter import RateLimiter
+
+
+class FakeConfigAdapter:
+    """仅实现 config 接口的内存存储"""
+
+    def __init__(self):
+        self.data: Dict[str, Any] = {}
+        self.set_calls = 0
+        self.batch_calls = 0
+
+    async def get_config(self, key: str, default: Any = None) -> Any:
+        return self.data.get(key, default)
+
+    async def get_all_config(self) -> Dict[str, Any]:
+        return dict(self.data)
+
+    async def set_config(self, key: str, value: Any) -> bool:
+        self.set_calls += 1
+        self.data[key] = value
+        return True
+
+    async def set_config_many(self, values: Dict[str, Any]) -> bool:
+        self.batch_calls += 1
+        for key, value in values.items():
+            await self.set_config(key, value)
+        return True
+
+
+@pytest.fixture
+def fake_adapter(monkeypatch):
+    adapter = FakeConfigAdapter()
+
+    async def _get_adapter():
+        return adapter
+
+    monkeypatch.setattr(rate_limiter_module, "get_storage_adapter", _get_adapter)
+    monkeypatch.setattr(config, "get_storage_adapter", _get_adapter)
+    return adapter
+
+
+class TestRateLimiterPersistence:
+    """测试防抖合并写入"""
+
+    @pytest.mark.asyncio
+    async def test_burst_updates_coalesced(self, fake_adapter):
+        limiter = RateLimiter()
+        await limiter.initialize()
+
+        reset_time = int(time.time()) + 60
+        for i in range(50):
+            await limiter.update_rate_limit(i % 5, 100, 100 - i, reset_time)
+        assert fake_adapter.set_calls == 0
+
+        await asyncio.sleep(RateLimiter.FLUSH_DEBOUNCE * 2)
+        # 验证：每个变更的密钥只写入一次，且合并为一次批量写入
+        assert fake_adapter.set_calls == 5
+        assert fake_adapter.batch_calls == 1
+        assert sorted(fake_adapter.data) == [f"rate_limit_info:{i}" for i in range(5)]
+        await limiter.close()
+
+    @pytest.mark.asyncio
+    async def test_flush_persists_pending_updates(self, fake_adapter):
+        limiter = RateLimiter()
+        await limiter.initialize()
+
+        await limiter.update_rate_limit(3, 100, 0, int(time.time()) + 60)
+        await limiter.flush()
+        assert fake_adapter.data["rate_limit_info:3"]["status"] == KeyStatus.EXHAUSTED.value
+
+        # 重新加载后状态一致
+        reloaded = RateLimiter()
+        await reloaded.initialize()
+        assert await reloaded.is_key_exhausted(3) is True
+        await limiter.close()
+        await reloaded.close()
+
+    @pytest.mark.asyncio
+    async def test_only_dirty_keys_written(self, fake_adapter):
+        limiter = RateLimiter()
+        await limiter.initialize()
+
+        reset_time = int(time.time()) + 60
+        for i in range(4):
+            await limiter.update_rate_limit(i, 100, 50, reset_time)
+        await limiter.flush()
+        assert fake_adapter.set_calls == 4
+
+        await limiter.update_rate_limit(2, 100, 10, reset_time)
+        await limiter.flush()
+        assert fake_adapter.set_calls == 5
+        assert fake_adapter.data["rate_limit_info:2"]["remaining"] == 10
+        await limiter.close()
+
+    @pytest.mark.asyncio
+    async def test_load_legacy_blob_and_per_key_records(self, fake_adapter):
+        reset_time = int(time.time()) + 60
+        fake_adapter.data["rate_limit_info"] = {
+            "0": {"limit": 100, "remaining": 0, "used": 100, "reset_time": reset_time, "status": "exhausted"},
+            "1": {"limit": 100, "remaining": 0, "used": 100, "reset_time": reset_time, "status": "exhausted"},
+        }
+        # 新版单键记录覆盖旧版数据
+        fake_adapter.data["rate_limit_info:1"] = {
+            "limit": 100, "remaining": 80, "used": 20, "reset_time": reset_time, "status": "active"
+        }
+
+        limiter = RateLimiter()
+        await limiter.initialize()
+        assert await limiter.is_key_exhausted(0) is True
+        assert await limiter.is_key_exhausted(1) is False
+        await limiter.close()
+
+
+    @pytest.mark.asyncio
+    async def test_close_flushes_and_stops_flusher(self, fake_adapter):
+        limiter = RateLimiter()
+        await limiter.initialize()
+        task = limiter._flusher_task
+
+        await limiter.update_rate_limit(0, 100, 0, int(time.time()) + 60)
+        await limiter.close()
+        assert "rate_limit_info:0" in fake_adapter.data
+        assert task.cancelled()
+        assert limiter._flusher_task is None and limiter._sweeper_task is None
+
+    @pytest.mark.asyncio
+    async def test_updates_during_save_picked_up(self, fake_adapter):
+        limiter = RateLimiter()
+        await limiter.initialize()
+        reset_time = int(time.time()) + 60
+
+        # 模拟慢速存储：写入期间继续产生变更
+        original_set = fake_adapter.set_config_many
+
+        async def slow_set(values):
+            await asyncio.sleep(0.01)
+            return await original_set(values)
+
+        fake_adapter.set_config_many = slow_set
+        await limiter.update_rate_limit(0, 100, 50, reset_time)
+        save = asyncio.create_task(limiter._save_rate_limits())
+        await asyncio.sleep(0)
+        assert limiter._save_lock.locked()
+
+        await limiter.update_rate_limit(1, 100, 40, reset_time)
+        await save
+        assert "rate_limit_info:1" in fake_adapter.data
+        assert not limiter._dirty
+        await limiter.close()
+
+    @pytest.mark.asyncio
+    async def test_concurrent_first_use_loads_once(self, fake_adapter):
+        calls = 0
+        original = fake_adapter.get_all_config
+
+        async def counting_get_all():
+            nonlocal calls
+            calls += 1
+            await asyncio.sleep(0.01)
+            return await original()
+
+        fake_adapter.get_all_config = counting_get_all
+        limiter = RateLimiter()
+        await asyncio.gather(*(limiter.is_key_exhausted(i) for i in range(20)))
+        assert calls == 1
+        await limiter.close()
+
+    @pytest.mark.asyncio
+    async def test_update_relative_reset_and_in_place(self, fake_adapter):
+        limiter = RateLimiter()
+        await limiter.initialize()
+
+        await limiter.update_rate_limit(0, 100, 10, 30)
+        info = limiter._rate_limits[0]
+        assert abs(info.reset_time - (int(time.time()) + 30)) <= 1
+
+        await limiter.update_rate_limit(0, 100, 0, 60)
+        # 原地更新同一对象
+        assert limiter._rate_limits[0] is info
+        assert info.status == KeyStatus.EXHAUSTED
+        assert info.used == 100
+        await limiter.close()
+
+    @pytest.mark.asyncio
+    async def test_unchanged_state_not_rewritten(self, fake_adapter):
+        limiter = RateLimiter()
+        await limiter.initialize()
+        reset_time = int(time.time()) + 60
+
+        await limiter.update_rate_limit(0, 100, 50, reset_time)
+        await limiter.flush()
+        assert fake_adapter.set_calls == 1
+
+        # 相同状态再次上报不产生写入
+        for _ in range(3):
+            await limiter.update_rate_limit(0, 100, 50, reset_time)
+        await limiter.flush()
+        assert fake_adapter.set_calls == 1
+
+        # 从存储加载的状态同样视为已保存
+        reloaded = RateLimiter()
+        await reloaded.initialize()
+        await reloaded.update_rate_limit(0, 100, 50, reset_time)
+        await reloaded.flush()
+        assert fake_adapter.set_calls == 1
+        await limiter.close()
+        await reloaded.close()
+
+    @pytest.mark.asyncio
+    async def test_lru_evicts_least_recently_used(self, fake_adapter, monkeypatch):
+        monkeypatch.setenv("RATE_LIMIT_MAX_ENTRIES", "3")
+        limiter = RateLimiter()
+        await limiter.initialize()
+        assert limiter._max_entries == 3
+
+        reset_time = int(time.time()) + 60
+        for i in range(3):
+            await limiter.update_rate_limit(i, 100, 0, reset_time)
+        # 访问密钥 0 使其成为最近使用
+        assert await limiter.is_key_exhausted(0) is True
+
+        await limiter.update_rate_limit(3, 100, 10, reset_time)
+        assert list(limiter._rate_limits) == [2, 0, 3]
+        # 被淘汰的密钥视为无速率限制信息
+        assert await limiter.is_key_exhausted(1) is False
+        assert 1 not in limiter._exhausted
+        assert await limiter.get_earliest_reset_time([1]) is None
+        await limiter.close()
+
+    @pytest.mark.asyncio
+    async def test_failed_write_retried(self, fake_adapter):
+        limiter = RateLimiter()
+        await limiter.initialize()
+
+        original = fake_adapter.set_config_many
+        attempts = []
+
+        async def flaky_set(values):
+            attempts.append(sorted(values))
+            if len(attempts) == 1:
+                return False
+            return await original(values)
+
+        fake_adapter.set_config_many = flaky_set
+        await limiter.update_rate_limit(0, 100, 40, int(time.time()) + 60)
+
+        # 验证：首次写入失败后无需新的变更，后台任务会自动重试
+        await asyncio.sleep(RateLimiter.FLUSH_DEBOUNCE * 3)
+        assert attempts == [["rate_limit_info:0"], ["rate_limit_info:0"]]
+        assert fake_adapter.data["rate_limit_info:0"]["remaining"] == 40
+        assert limiter._dirty == set()
+        await limiter.close()
+
+    @pytest.mark.asyncio
+    async def test_eviction_keeps_pending_write(self, fake_adapter, monkeypatch):
+        monkeypatch.setenv("RATE_LIMIT_MAX_ENTRIES", "2")
+        limiter = RateLimiter()
+        await limiter.initialize()
+
+        reset_time = int(time.time()) + 60
+        await limiter.update_rate_limit(0, 100, 40, reset_time)
+        await limiter.update_rate_limit(1, 100, 30, reset_time)
+        await limiter.update_rate_limit(2, 100, 20, reset_time)
+        assert 0 not in limiter._rate_limits
+
+        # 验证：被淘汰密钥尚未保存的最新状态仍会写入存储
+        await limiter.flush()
+        assert fake_adapter.data["rate_limit_info:0"]["remaining"] == 40
+        assert limiter._evicted_pending == {}
+        await limiter.close()
+
+    @pytest.mark.asyncio
+    async def test_eviction_prefers_keys_not_exhausted(self, fake_adapter, monkeypatch):
+        monkeypatch.setenv("RATE_LIMIT_MAX_ENTRIES", "3")
+        limiter = RateLimiter()
+        await limiter.initialize()
+
+        reset_time = int(time.time()) + 60
+        await limiter.update_rate_limit(0, 100, 0, reset_time)
+        await limiter.update_rate_limit(1, 100, 50, reset_time)
+        await limiter.update_rate_limit(2, 100, 0, reset_time)
+        await limiter.update_rate_limit(3, 100, 10, reset_time)
+
+        # 验证：最久未使用的密钥 0 已用尽，淘汰未用尽的密钥 1，密钥 0 仍不可用
+        assert list(limiter._rate_limits) == [0, 2, 3]
+        assert await limiter.is_key_exhausted(0) is True
+        await limiter.close()
+
+    @pytest.mark.asyncio
+    async def test_sweeper_resets_expired_keys(self, fake_adapter, monkeypatch):
+        monkeypatch.setattr(RateLimiter, "SWEEP_INTERVAL", 0.05)
+        limiter = RateLimiter()
+        await limiter.initialize()
+
+        reset_time = int(time.time()) + 1
+        await limiter.update_rate_limit(0, 100, 0, reset_time)
+        await limiter.update_rate_limit(1, 100, 40, reset_time)
+        assert await limiter.is_key_exhausted(0) is True
+
+        # 已用尽的密钥由后台任务从重置时间堆中取出并恢复
+        await asyncio.sleep(reset_time - time.time() + 0.2)
+        assert limiter._rate_limits[0].remaining == 100
+        assert 0 not in limiter._exhausted
+        # 未用尽的密钥不进入堆，展示全表时补做重置
+        assert limiter._rate_limits[1].remaining == 40
+        assert (await limiter.get_all_rate_limits())[1].remaining == 100
+        await limiter.close()
+        assert fake_adapter.data["rate_limit_info:0"]["remaining"] == 100
+        assert fake_adapter.data["rate_limit_info:1"]["remaining"] == 100
+
+    @pytest.mark.asyncio
+    async def test_read_path_resets_due_key(self, fake_adapter, monkeypatch):
+        monkeypatch.setattr(RateLimiter, "SWEEP_INTERVAL", 60)
+        limiter = RateLimiter()
+        await limiter.initialize()
+
+        await limiter.update_rate_limit(0, 100, 0, int(time.time()) + 60)
+        limiter._rate_limits[0].reset_time = int(time.time()) - 1
+
+        # 后台任务尚未运行时，读取路径也不会把已到期的密钥报告为用尽
+        assert await limiter.is_key_exhausted(0) is False
+        assert limiter._rate_limits[0].remaining == 100
+        await limiter.close()
+
+    @pytest.mark.asyncio
+    async def test_zero_limit_key_stays_exhausted_after_reset(self, fake_adapter):
+        limiter = RateLimiter()
+        await limiter.initialize()
+
+        await limiter.update_rate_limit(0, 0, 0, int(time.time()) + 60)
+        limiter._rate_limits[0].reset_time = int(time.time()) - 1
+
+        # 配额为 0 的密钥重置后仍不可选
+        assert await limiter.is_key_exhausted(0) is True
+        assert await limiter.get_exhausted_keys([0]) == {0}
+        assert await limiter.get_next_available_key([0]) == 0
+        await limiter.close()
+
+class TestRateLimitInfo:
+    """测试速率限制模型的派生字段"""
+
+    def test_reset_in_seconds_is_derived(self):
+        from src.models.models_key import RateLimitInfo
+
+        now = int(time.time())
+        info = RateLimitInfo(key_index=0, limit=10, remaining=0, reset_time=now + 30)
+        assert info.reset_in_seconds_at(now) == 30
+        assert 0 <= info.reset_in_seconds <= 30
+        assert RateLimitInfo(key_index=1).reset_in_seconds == 0
+        assert RateLimitInfo(key_index=2, reset_time=now - 5).reset_in_seconds_at(now) == 0
+
+        # 存储格式中的 reset_in_seconds 被忽略，由 reset_time 推导
+        loaded = RateLimitInfo.from_dict({"key_index": 0, "reset_time": now + 30, "reset_in_seconds": 999})
+        assert loaded.reset_in_seconds_at(now) == 30
+
+    def test_from_stored_uses_given_index(self):
+        from src.models.models_key import RateLimitInfo
+
+        info = RateLimitInfo.from_stored(7, {"key_index": 0, "limit": 10, "remaining": 0, "status": "bogus"})
+        assert info.key_index == 7
+        assert info.status == KeyStatus.ACTIVE
+        assert not hasattr(info, "__dict__")
+
+    def test_to_stored_is_time_independent(self):
+        from src.models.models_key import RateLimitInfo
+
+        info = RateLimitInfo(key_index=3, limit=10, remaining=2, used=8, reset_time=int(time.time()) + 30)
+        stored = info.to_stored()
+        assert "reset_in_seconds" not in stored and "key_index" not in stored
+        assert RateLimitInfo.from_stored(3, stored) == info
+
+    @pytest.mark.asyncio
+    async def test_get_all_rate_limits_resets_expired(self, fake_adapter):
+        limiter = RateLimiter()
+        await limiter.initialize()
+
+        await limiter.update_rate_limit(0, 100, 0, int(time.time()) - 1)
+        await limiter.update_rate_limit(1, 100, 0, int(time.time()) + 60)
+        result = await limiter.get_all_rate_limits()
+        assert result[0].status == KeyStatus.ACTIVE
+        assert result[0].remaining == 100
+        assert result[1].status == KeyStatus.EXHAUSTED
+        assert result[1].reset_in_seconds > 0
+        await limiter.close()
+
+
+class TestRateLimiterSelection:
+    """测试基于已用尽集合与重置时间堆的密钥选择"""
+
+    @pytest.mark.asyncio
+    async def test_next_available_skips_exhausted(self, fake_adapter):
+        limiter = RateLimiter()
+        await limiter.initialize()
+
+        now = int(time.time())
+        await limiter.update_rate_limit(0, 100, 0, now + 60)
+        await limiter.update_rate_limit(1, 100, 0, now + 30)
+        await limiter.update_rate_limit(2, 100, 5, now + 60)
+        assert await limiter.get_next_available_key([0, 1, 2]) == 2
+
+        # 全部用尽时返回最早重置的密钥
+        assert await limiter.get_next_available_key([0, 1]) == 1
+        assert await limiter.get_earliest_reset_time([0, 1]) == now + 30
+        # 堆顶不在候选范围内时回退查找
+        assert await limiter.get_next_available_key([0]) == 0
+        assert await limiter.get_earliest_reset_time([2]) is None
+        await limiter.close()
+
+    @pytest.mark.asyncio
+    async def test_stale_heap_entries_ignored(self, fake_adapter):
+        limiter = RateLimiter()
+        await limiter.initialize()
+
+        now = int(time.time())
+        await limiter.update_rate_limit(0, 100, 0, now + 10)
+        await limiter.update_rate_limit(1, 100, 0, now + 20)
+        # 密钥 0 恢复后，其旧堆条目不再生效
+        await limiter.update_rate_limit(0, 100, 50, now + 10)
+        assert await limiter.get_earliest_reset_time([0, 1]) == now + 20
+
+        # 重复更新同一重置时间不会重复入堆
+        for _ in range(5):
+            await limiter.update_rate_limit(1, 100, 0, now + 20)
+        assert len(limiter._reset_heap) <= 2
+        await limiter.close()
+
+    @pytest.mark.asyncio
+    async def test_expired_keys_become_available(self, fake_adapter):
+        limiter = RateLimiter()
+        await limiter.initialize()
+
+        await limiter.update_rate_limit(0, 100, 0, int(time.time()) - 1)
+        await limiter.update_rate_limit(1, 100, 0, int(time.time()) + 60)
+        assert await limiter.get_next_available_key([1, 0]) == 0
+        assert 0 not in limiter._exhausted
+        assert (await limiter.get_rate_limit_info(0)).remaining == 100
+        # 已恢复满额的密钥不会重复重置和写入
+        assert await limiter.reset_key_if_time_reached(0) is False
+        await limiter.close()
+
+
+
+    @pytest.mark.asyncio
+    async def test_get_exhausted_keys_batch(self, fake_adapter):
+        limiter = RateLimiter()
+        await limiter.initialize()
+
+        now = int(time.time())
+        await limiter.update_rate_limit(0, 100, 0, now + 60)
+        await limiter.update_rate_limit(1, 100, 0, now - 1)
+        await limiter.update_rate_limit(2, 100, 5, now + 60)
+        # 到期的已用尽密钥在批量检查时恢复
+        assert await limiter.get_exhausted_keys(range(4)) == {0}
+        await limiter.close()
+
+class TestGlobalRateLimiter:
+    """测试全局实例的并发创建"""
+
+    @pytest.mark.asyncio
+    async def test_concurrent_get_rate_limiter_single_instance(self, fake_adapter, monkeypatch):
+        monkeypatch.setattr(rate_limiter_module, "_rate_limiter", None)
+        limiters = await asyncio.gather(*(rate_limiter_module.get_rate_limiter() for _ in range(10)))
+        assert all(limiter is limiters[0] for limiter in limiters)
+        assert limiters[0]._initialized
+        await limiters[0].close()
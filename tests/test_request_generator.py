@@ -14,7 +14,11 @@ import sys
 import os
 sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 
-from src.transform.request_generator import RequestGenerator, get_request_generator
+from src.transform.request_generator import (
+    RequestGenerator,
+    get_request_generator,
+    get_request_generator_for,
+)
 
 
 class TestRequestGenerator:
@@ -104,6 +108,41 @@ class TestRequestGenerator:
         assert parsed["model"] == model, "Model should match"
         assert parsed["messages"][0]["content"] == content, "Content should match"
     
+    def test_preview_drops_unsupported_and_none(self, generator):
+        """测试预览请求体只保留支持且非空的参数"""
+        preview = generator.generate_request_preview({
+            "model": "gpt-4",
+            "messages": [{"role": "user", "content": "hi"}],
+            "temperature": None,
+            "unknown": 1,
+            "stream": False,
+        })
+        assert preview["body"] == {
+            "model": "gpt-4",
+            "messages": [{"role": "user", "content": "hi"}],
+            "stream": False,
+        }
+    
+    def test_preview_body_uses_canonical_order(self, generator):
+        """测试预览请求体按规范顺序排列字段，与传入顺序无关"""
+        preview = generator.generate_request_preview({
+            "stream": True,
+            "max_tokens": 16,
+            "messages": [{"role": "user", "content": "hi"}],
+            "top_p": 0.5,
+            "model": "gpt-4",
+        })
+        assert list(preview["body"]) == ["model", "messages", "top_p", "max_tokens", "stream"]
+    
+    def test_initial_request_keeps_non_ascii(self, generator):
+        """测试初始报文保留非 ASCII 字符并使用两空格缩进"""
+        initial_request = generator.generate_initial_custom_request({
+            "model": "gpt-4",
+            "messages": [{"role": "user", "content": "你好"}],
+        })
+        assert '"content": "你好"' in initial_request
+        assert initial_request.startswith('{\n  "model": "gpt-4"')
+    
     # Feature: api-key-management-enhancement, Property 31: 自定义报文验证
     # **Validates: Requirements 10.3**
     @given(
@@ -161,6 +200,16 @@ class TestRequestGenerator:
              "Field 'max_tokens' must be a positive integer"),
             ('{"model": "gpt-4", "messages": [{"role": "user", "content": "hi"}], "max_tokens": 0}', 
              "Field 'max_tokens' must be a positive integer"),
+            ('{"model": "gpt-4", "messages": [{"role": "user", "content": "hi"}], "top_p": 1.5}', 
+             "Field 'top_p' must be a number between 0 and 1"),
+            ('{"model": "gpt-4", "messages": [{"role": "user", "content": "hi"}], "n": 0}', 
+             "Field 'n' must be a positive integer"),
+            ('{"model": "gpt-4", "messages": [{"role": "user", "content": "hi"}], "stream": "yes"}', 
+             "Field 'stream' must be a boolean"),
+            ('{"model": "gpt-4", "messages": [{"role": "user", "content": "hi"}], "tools": {}}', 
+             "Field 'tools' must be an array"),
+            ('{"model": "gpt-4", "messages": [{"role": "user", "content": "hi"}, {"role": "user"}]}', 
+             "Message at index 1 missing 'content'"),
         ]
         
         for request_json, expected_error_part in invalid_requests:
@@ -182,6 +231,26 @@ class TestRequestGenerator:
         parsed = generator.parse_custom_request(invalid_json)
         assert parsed is None, "Invalid request should return None"
     
+    def test_parse_custom_request_parses_once(self, generator, monkeypatch):
+        """测试解析自定义请求时 JSON 只解析一次"""
+        import src.transform.request_generator as module
+        
+        calls = []
+        original = module.orjson.loads
+        
+        class _CountingOrjson:
+            JSONDecodeError = module.orjson.JSONDecodeError
+            
+            @staticmethod
+            def loads(data):
+                calls.append(data)
+                return original(data)
+        
+        monkeypatch.setattr(module, "orjson", _CountingOrjson)
+        parsed = generator.parse_custom_request('{"model": "gpt-4", "messages": [{"role": "user", "content": "hi"}]}')
+        assert parsed["model"] == "gpt-4"
+        assert len(calls) == 1
+    
     def test_merge_with_defaults(self, generator):
         """测试与默认值合并"""
         defaults = {
@@ -232,6 +301,17 @@ class TestRequestGeneratorIntegration:
         # 应该返回同一个实例
         assert generator1 is generator2
     
+    def test_generator_shared_per_endpoint_and_key(self):
+        """测试按 (endpoint, api_key) 共享生成器实例，不同配置互不影响"""
+        a1 = get_request_generator_for("https://a.example/v1", "sk-aaaaaaaaaaaa")
+        a2 = get_request_generator_for("https://a.example/v1", "sk-aaaaaaaaaaaa")
+        b = get_request_generator_for("https://b.example/v1", "sk-bbbbbbbbbbbb")
+        
+        assert a1 is a2
+        assert a1 is not b
+        assert a1.generate_request_preview({})["url"] == "https://a.example/v1"
+        assert b.generate_request_preview({})["headers"]["Authorization"] == "Bearer sk-b...bbbb"
+    
     @given(
         params_list=st.lists(
             st.fixed_dictionaries({
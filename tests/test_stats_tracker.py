@@ -0,0 +1,275 @@
+"""
+Tests for stats tracker
+测试密钥调用统计的记录与合并写入
+"""
+import asyncio
+import pytest
+from typing import Any, Dict
+
+import src.stats.stats_tracker as stats_tracker_module
+from src.models.models_key import KeyInfo, RateLimitInfo
+from src.stats.stats_tracker import StatsTracker
+
+# fixture 会替换自动清理方法，这里保留原实现供清理测试直接调用
+_ORIGINAL_AUTO_CLEANUP = StatsTracker._auto_cleanup_invalid_keys
+
+
+class FakeConfigAdapter:
+    """仅实现 config 接口的内存存储"""
+
+    def __init__(self):
+        self.data: Dict[str, Any] = {}
+        self.batch_calls = 0
+
+    async def get_config(self, key: str, default: Any = None) -> Any:
+        return self.data.get(key, default)
+
+    async def get_all_config(self) -> Dict[str, Any]:
+        return dict(self.data)
+
+    async def set_config(self, key: str, value: Any) -> bool:
+        self.data[key] = value
+        return True
+
+    async def set_config_many(self, values: Dict[str, Any]) -> bool:
+        self.batch_calls += 1
+        for key, value in values.items():
+            await self.set_config(key, value)
+        return True
+
+    async def delete_config(self, key: str) -> bool:
+        return self.data.pop(key, None) is not None
+
+
+@pytest.fixture
+def fake_adapter(monkeypatch):
+    adapter = FakeConfigAdapter()
+
+    async def _get_adapter():
+        return adapter
+
+    async def _no_cleanup(self):
+        return None
+
+    monkeypatch.setattr(stats_tracker_module, "get_storage_adapter", _get_adapter)
+    monkeypatch.setattr(StatsTracker, "_auto_cleanup_invalid_keys", _no_cleanup)
+    return adapter
+
+
+class TestStatsTrackerPersistence:
+    """测试后台合并写入"""
+
+    @pytest.mark.asyncio
+    async def test_burst_calls_written_once(self, fake_adapter):
+        tracker = StatsTracker()
+        tracker._save_interval = 0.05
+        await tracker.initialize()
+
+        for i in range(50):
+            await tracker.record_call(i % 3, success=i % 5 != 0, model="gpt-5")
+        assert fake_adapter.batch_calls == 0
+
+        await asyncio.sleep(0.15)
+
+        # 验证：一批调用只写入一次，且每个密钥单独一条记录
+        assert fake_adapter.batch_calls == 1
+        saved = {k: v for k, v in fake_adapter.data.items() if k.startswith("key_stats:")}
+        assert sorted(saved) == ["key_stats:0", "key_stats:1", "key_stats:2"]
+        assert sum(v["success_count"] + v["failure_count"] for v in saved.values()) == 50
+        assert saved["key_stats:0"]["model_counts"] == {"gpt-5": 17}
+        await tracker.close()
+
+    @pytest.mark.asyncio
+    async def test_close_flushes_pending_changes(self, fake_adapter):
+        tracker = StatsTracker()
+        await tracker.initialize()
+
+        await tracker.record_call(1, success=True, model="gpt-5", masked_key="sk-...abcd")
+        await tracker.close()
+
+        # 验证：关闭时立即保存，且后台任务已停止
+        assert fake_adapter.data["key_stats:1"]["success_count"] == 1
+        assert tracker._flusher_task is None
+
+        reloaded = StatsTracker()
+        await reloaded.initialize()
+        stats = await reloaded.get_key_stats(1)
+        assert stats.success_count == 1
+        assert stats.masked_key == "sk-...abcd"
+        await reloaded.close()
+
+    @pytest.mark.asyncio
+    async def test_calls_during_write_are_not_lost(self, fake_adapter):
+        tracker = StatsTracker()
+        await tracker.initialize()
+        await tracker.record_call(0, success=True, model="gpt-5")
+
+        release = asyncio.Event()
+        original_set = fake_adapter.set_config
+
+        async def slow_set(key, value):
+            await release.wait()
+            return await original_set(key, value)
+
+        fake_adapter.set_config = slow_set
+        save = asyncio.create_task(tracker._save_stats(force=True))
+        await asyncio.sleep(0)
+        # 写入进行中记录的新调用不应进入本次快照，但会重新置脏
+        await tracker.record_call(0, success=True, model="gpt-4")
+        release.set()
+        await save
+
+        assert fake_adapter.data["key_stats:0"]["success_count"] == 1
+        assert fake_adapter.data["key_stats:0"]["model_counts"] == {"gpt-5": 1}
+        assert tracker._dirty == {0}
+        await tracker.close()
+        assert fake_adapter.data["key_stats:0"]["success_count"] == 2
+
+    @pytest.mark.asyncio
+    async def test_failed_write_keeps_dirty(self, fake_adapter):
+        tracker = StatsTracker()
+        await tracker.initialize()
+        await tracker.record_call(0, success=False, model="gpt-5")
+
+        async def failing_set(values):
+            return False
+
+        fake_adapter.set_config_many = failing_set
+        await tracker._save_stats(force=True)
+        assert tracker._dirty == {0}
+        await tracker.close()
+
+    @pytest.mark.asyncio
+    async def test_only_changed_keys_written(self, fake_adapter):
+        tracker = StatsTracker()
+        await tracker.initialize()
+        for idx in range(5):
+            await tracker.record_call(idx, success=True, model="gpt-5")
+        await tracker._save_stats(force=True)
+
+        written = []
+        original = fake_adapter.set_config_many
+
+        async def recording_set(values):
+            written.append(sorted(values))
+            return await original(values)
+
+        fake_adapter.set_config_many = recording_set
+        await tracker.record_call(3, success=True, model="gpt-5")
+        await tracker.cleanup_inactive_keys([0, 1, 2, 3])
+
+        # 验证：只写入变更的密钥，被清理的密钥记录被删除
+        assert written == [["key_stats:3"]]
+        assert "key_stats:4" not in fake_adapter.data
+        assert fake_adapter.data["key_stats:3"]["success_count"] == 2
+        await tracker.close()
+
+    @pytest.mark.asyncio
+    async def test_legacy_blob_migrated(self, fake_adapter):
+        fake_adapter.data["key_stats"] = {
+            "0": {"success_count": 3, "failure_count": 1, "model_counts": {"gpt-5": 4}},
+            "1": {"success_count": 9, "failure_count": 0, "model_counts": {}},
+        }
+        fake_adapter.data["key_stats:1"] = {"success_count": 10, "failure_count": 0, "model_counts": {}}
+
+        tracker = StatsTracker()
+        await tracker.initialize()
+        assert (await tracker.get_key_stats(0)).success_count == 3
+        # 新版记录优先于旧版数据
+        assert (await tracker.get_key_stats(1)).success_count == 10
+
+        await tracker.close()
+        assert "key_stats" not in fake_adapter.data
+        assert fake_adapter.data["key_stats:0"]["failure_count"] == 1
+        assert fake_adapter.data["key_stats:1"]["success_count"] == 10
+
+    @pytest.mark.asyncio
+    async def test_partial_entry_filled_on_load(self, fake_adapter):
+        fake_adapter.data["key_stats:2"] = {"success_count": 4}
+
+        tracker = StatsTracker()
+        await tracker.initialize()
+        await tracker.record_call(2, success=False, model="gpt-5")
+
+        # 验证：加载时补齐缺失字段，计数可直接累加
+        stats = await tracker.get_key_stats(2)
+        assert (stats.success_count, stats.failure_count) == (4, 1)
+        assert stats.model_counts == {"gpt-5": 1}
+        await tracker.close()
+        # 验证：写回的记录带格式版本且字段完整
+        assert fake_adapter.data["key_stats:2"] == {
+            "schema": 1,
+            "success_count": 4,
+            "failure_count": 1,
+            "model_counts": {"gpt-5": 1},
+            "masked_key": "",
+            "last_call_time": tracker._stats[2].last_call_time,
+        }
+
+
+class TestStatsTrackerQueries:
+    """测试统计查询"""
+
+    @pytest.mark.asyncio
+    async def test_stats_dict_cached_until_changed(self, fake_adapter):
+        tracker = StatsTracker()
+        await tracker.initialize()
+        keys = [KeyInfo(index=0, key="sk-aaaa1111"), KeyInfo(index=1, key="sk-bbbb2222", enabled=False)]
+        await tracker.record_call(0, success=True, model="gpt-5")
+        await tracker.record_call(1, success=False, model="gpt-5")
+
+        first = await tracker.get_all_stats(keys, {0: RateLimitInfo(key_index=0, limit=10, remaining=4)})
+        assert first["total_success"] == 1 and first["total_failure"] == 1
+        assert first["enabled"][0]["rate_limit_info"]["remaining"] == 4
+        assert first["disabled"][0]["rate_limit_info"] is None
+        # 返回缓存字典的拷贝：调用方修改返回值不会影响缓存
+        assert first["disabled"][0] == tracker._dict_cache[1][1]
+        first["disabled"][0]["extra"] = True
+        assert "extra" not in tracker._dict_cache[1][1]
+        cached = {idx: entry for idx, entry in tracker._dict_cache.items()}
+
+        await tracker.record_call(0, success=True, model="gpt-4")
+        second = await tracker.get_all_stats(keys, group_by_status=False)
+
+        # 验证：未变化的密钥复用缓存，变化的密钥重新生成，且旧结果不受影响
+        assert tracker._dict_cache[1] is cached[1]
+        assert tracker._dict_cache[0] is not cached[0]
+        assert second["keys"][0]["model_counts"] == {"gpt-5": 1, "gpt-4": 1}
+        assert first["enabled"][0]["model_counts"] == {"gpt-5": 1}
+
+        active = await tracker.get_active_keys_stats(keys)
+        assert active["total_calls"] == 2
+        assert [k["key_index"] for k in active["keys"]] == [0]
+
+        await tracker.reset_stats(0)
+        assert (await tracker.get_active_keys_stats(keys))["keys"][0]["success_count"] == 0
+        await tracker.close()
+
+
+    @pytest.mark.asyncio
+    async def test_auto_cleanup_uses_key_indices(self, fake_adapter, monkeypatch):
+        from src.models.models_key import KeyConfig
+        from src.services import key_manager as key_manager_module
+
+        manager = key_manager_module.KeyManager()
+        manager._cache = KeyConfig(keys=["sk-a", "sk-b"], enabled_indices=[0, 1])
+        manager._initialized = True
+        assert await manager.get_all_key_indices() == {0, 1}
+
+        async def _get_manager():
+            return manager
+
+        monkeypatch.setattr(key_manager_module, "get_key_manager", _get_manager)
+        tracker = StatsTracker()
+        await tracker.initialize()
+        for idx in (0, 1, 5):
+            await tracker.record_call(idx, success=True, model="gpt-5")
+
+        # 验证：索引不在密钥列表中的统计被清理并从存储删除
+        await _ORIGINAL_AUTO_CLEANUP(tracker)
+        assert sorted(tracker._stats) == [0, 1]
+        assert "key_stats:5" not in fake_adapter.data
+        await tracker.close()
+
+if __name__ == "__main__":
+    pytest.main([__file__, "-v"])
@@ -0,0 +1,174 @@
+"""
+Tests for unified stats
+测试统一统计的记录、查询与清理
+"""
+import asyncio
+import hashlib
+import pytest
+from typing import Any, Dict
+
+import src.stats.unified_stats as unified_stats_module
+from src.stats.unified_stats import (
+    UnifiedStats,
+    _derive,
+    get_key_hash,
+    mask_key,
+)
+
+
+class FakeConfigAdapter:
+    """仅实现 config 接口的内存存储"""
+
+    def __init__(self):
+        self.data: Dict[str, Any] = {}
+        self.set_calls = 0
+
+    async def get_config(self, key: str, default: Any = None) -> Any:
+        return self.data.get(key, default)
+
+    async def set_config(self, key: str, value: Any) -> bool:
+        self.set_calls += 1
+        self.data[key] = value
+        return True
+
+
+@pytest.fixture
+def fake_adapter(monkeypatch):
+    adapter = FakeConfigAdapter()
+
+    async def _get_adapter():
+        return adapter
+
+    monkeypatch.setattr(unified_stats_module, "get_storage_adapter", _get_adapter)
+    return adapter
+
+
+class TestKeyDerivation:
+    """测试密钥脱敏与哈希"""
+
+    def test_derive_matches_helpers(self):
+        key = "sk-1234567890abcdef"
+        assert _derive(key) == (mask_key(key), get_key_hash(key))
+        assert _derive(key)[0] == "sk-1...cdef"
+
+    def test_key_hash_format(self):
+        key = "sk-1234567890abcdef"
+        # 与已存储记录保持一致：SHA-256 的前 16 位十六进制
+        assert get_key_hash(key) == hashlib.sha256(key.encode("utf-8")).hexdigest()[:16]
+
+
+class TestUnifiedStats:
+    """测试统计记录与查询"""
+
+    @pytest.mark.asyncio
+    async def test_record_and_query(self, fake_adapter):
+        stats = UnifiedStats()
+        await stats.initialize()
+        key_a, key_b = "sk-aaaa00000000aaaa", "sk-bbbb00000000bbbb"
+
+        await stats.record_call(key_a, "gpt-5", success=True)
+        await stats.record_call(key_a, "gpt-5", success=False)
+        await stats.record_call(key_b, "gpt-4", success=True)
+
+        result = await stats.get_all_stats(valid_keys=[key_a])
+        assert list(result["keys"]) == [mask_key(key_a)]
+        assert result["total"] == {"success": 1, "failure": 1, "total_calls": 2}
+        assert result["models"] == {"gpt-5": {"ok": 1, "fail": 1}}
+        record = stats._stats[mask_key(key_a)]
+        assert record["full_key_hash"] == get_key_hash(key_a)
+        assert "hash_ver" not in record
+        await stats.close()
+
+    @pytest.mark.asyncio
+    async def test_burst_calls_written_once(self, fake_adapter):
+        stats = UnifiedStats()
+        stats._save_interval = 0.05
+        await stats.initialize()
+
+        for i in range(20):
+            await stats.record_call("sk-aaaa00000000aaaa", "gpt-5", success=i % 4 != 0)
+        assert fake_adapter.set_calls == 0
+
+        await asyncio.sleep(0.15)
+
+        # 验证：一批调用由后台任务合并为一次写入
+        assert fake_adapter.set_calls == 1
+        saved = fake_adapter.data["unified_stats"][mask_key("sk-aaaa00000000aaaa")]
+        assert saved["success_count"] + saved["failure_count"] == 20
+        await stats.close()
+        assert stats._flusher_task is None
+        assert fake_adapter.set_calls == 1
+
+    @pytest.mark.asyncio
+    async def test_close_flushes_pending_changes(self, fake_adapter):
+        stats = UnifiedStats()
+        await stats.initialize()
+        await stats.record_call("sk-aaaa00000000aaaa", "gpt-5", success=True)
+        assert "unified_stats" not in fake_adapter.data
+
+        await stats.close()
+        assert fake_adapter.data["unified_stats"][mask_key("sk-aaaa00000000aaaa")]["success_count"] == 1
+
+    @pytest.mark.asyncio
+    async def test_cleanup_and_ensure(self, fake_adapter):
+        stats = UnifiedStats()
+        await stats.initialize()
+        keys = ["sk-aaaa00000000aaaa", "sk-bbbb00000000bbbb"]
+
+        await stats.ensure_keys_exist(keys)
+        assert set(stats._stats) == {mask_key(k) for k in keys}
+
+        removed = await stats.cleanup_invalid_keys(keys[:1])
+        assert removed == 1
+        assert await stats.delete_stats_for_key(keys[0])
+        assert stats._stats == {}
+        assert fake_adapter.set_calls == 0
+
+        # 验证：去抖窗口内的清理与删除合并为一次写入
+        await asyncio.sleep(stats._flush_debounce * 3)
+        assert fake_adapter.set_calls == 1
+        assert fake_adapter.data["unified_stats"] == {}
+        await stats.close()
+
+    @pytest.mark.asyncio
+    async def test_flush_writes_immediately(self, fake_adapter):
+        stats = UnifiedStats()
+        await stats.initialize()
+        await stats.ensure_keys_exist(["sk-aaaa00000000aaaa"])
+        await stats.reset_stats()
+
+        await stats.flush()
+        assert fake_adapter.set_calls == 1
+        assert mask_key("sk-aaaa00000000aaaa") in fake_adapter.data["unified_stats"]
+        # 已写入后 flush 与关闭都不再重复写入
+        await stats.flush()
+        await stats.close()
+        assert fake_adapter.set_calls == 1
+
+    @pytest.mark.asyncio
+    async def test_rejected_write_keeps_dirty(self, fake_adapter):
+        stats = UnifiedStats()
+        await stats.initialize()
+        await stats.record_call("sk-aaaa00000000aaaa", "gpt-5", success=True)
+
+        original = fake_adapter.set_config
+
+        async def rejecting_set(key, value):
+            fake_adapter.set_calls += 1
+            return False
+
+        fake_adapter.set_config = rejecting_set
+        await stats.flush()
+        # 验证：存储拒绝写入时保留待写入状态
+        assert stats._dirty is True
+        assert "unified_stats" not in fake_adapter.data
+
+        fake_adapter.set_config = original
+        await stats.flush()
+        assert stats._dirty is False
+        assert fake_adapter.data["unified_stats"][mask_key("sk-aaaa00000000aaaa")]["success_count"] == 1
+        await stats.close()
+
+
+if __name__ == "__main__":
+    pytest.main([__file__, "-v"])
@@ -0,0 +1,99 @@
+"""
+Tests for XML tool call parser
+测试 content 中 XML 格式工具调用的解析
+"""
+import json
+import re
+import pytest
+
+from src.transform.xml_parser import has_xml_tool_calls, parse_xml_tool_calls
+
+
+class TestXmlToolCalls:
+    """测试 XML 工具调用解析"""
+    
+    def test_plain_content_untouched(self):
+        """测试不含工具调用的内容原样返回"""
+        content = "普通回复，没有工具调用"
+        assert not has_xml_tool_calls(content)
+        assert parse_xml_tool_calls(content) == (content, [])
+    
+    @pytest.mark.parametrize("prefix", ["", "antml:"])
+    def test_parse_with_optional_namespace(self, prefix):
+        """测试带或不带命名空间前缀的标签都能被识别与解析"""
+        content = (
+            f"先读取文件。<{prefix}function_calls>"
+            f'<{prefix}invoke name="read_file">'
+            f'<{prefix}parameter name="file_path"> src/main.py </{prefix}parameter>'
+            f"</{prefix}invoke></{prefix}function_calls>"
+        )
+        assert has_xml_tool_calls(content)
+        
+        cleaned, tool_calls = parse_xml_tool_calls(content)
+        
+        assert cleaned == "先读取文件。"
+        assert len(tool_calls) == 1
+        assert tool_calls[0]["function"]["name"] == "read_file"
+        # 验证：read_file 的 file_path 参数被映射为 path，值去除首尾空白
+        assert json.loads(tool_calls[0]["function"]["arguments"]) == {"path": "src/main.py"}
+
+    
+    def test_empty_block_removed_without_tool_calls(self):
+        """测试不含 invoke 的 function_calls 块被移除且不产生工具调用"""
+        cleaned, tool_calls = parse_xml_tool_calls("回复<function_calls>\n</function_calls>")
+        assert cleaned == "回复"
+        assert tool_calls == []
+    
+    def test_marker_without_block_untouched(self):
+        """测试仅出现标签片段而无完整块时内容原样返回"""
+        content = "说明文字中提到了 function_calls> 这个片段"
+        assert parse_xml_tool_calls(content) == (content, [])
+    
+    def test_arguments_keep_non_ascii(self):
+        """测试参数值中的非 ASCII 字符原样写入 arguments"""
+        content = '<function_calls><invoke name="say"><parameter name="text">你好 "世界"</parameter></invoke></function_calls>'
+        _, tool_calls = parse_xml_tool_calls(content)
+        arguments = tool_calls[0]["function"]["arguments"]
+        assert "你好" in arguments
+        assert json.loads(arguments) == {"text": '你好 "世界"'}
+    
+    def test_angle_brackets_inside_values(self):
+        """测试参数值中出现 < 及其他标签时仍停在第一个对应结束标签"""
+        content = (
+            '<function_calls><invoke name="run">'
+            '<parameter name="cmd">a < b && echo <b>x</b></parameter>'
+            '<parameter name="note"></invoke-ish></parameter>'
+            '</invoke></function_calls>'
+        )
+        _, tool_calls = parse_xml_tool_calls(content)
+        assert json.loads(tool_calls[0]["function"]["arguments"]) == {
+            "cmd": "a < b && echo <b>x</b>",
+            "note": "</invoke-ish>",
+        }
+    
+    def test_unterminated_invoke_ignored(self):
+        """测试未闭合的 invoke 不产生工具调用，且长输入也能快速返回"""
+        content = "<function_calls><invoke name=\"a\">" + "<x" * 20000 + "</function_calls>"
+        cleaned, tool_calls = parse_xml_tool_calls(content)
+        assert cleaned == ""
+        assert tool_calls == []
+    
+    def test_multiple_blocks_parsed_in_order(self):
+        """测试多个 function_calls 块中的工具调用按顺序全部解析，块间文本保留"""
+        content = (
+            '开始 <function_calls><invoke name="a"><parameter name="x">1</parameter></invoke></function_calls>'
+            ' 中间 <function_calls><invoke name="b"></invoke></function_calls> 结束'
+        )
+        cleaned, tool_calls = parse_xml_tool_calls(content)
+        
+        assert cleaned == "开始  中间  结束"
+        assert [tc["function"]["name"] for tc in tool_calls] == ["a", "b"]
+        assert json.loads(tool_calls[0]["function"]["arguments"]) == {"x": "1"}
+        assert json.loads(tool_calls[1]["function"]["arguments"]) == {}
+        # 验证：工具调用 ID 为 call_ 加 24 位十六进制，且互不相同
+        ids = [tc["id"] for tc in tool_calls]
+        assert all(re.fullmatch(r"call_[0-9a-f]{24}", i) for i in ids)
+        assert len(set(ids)) == 2
+
+if __name__ == "__main__":
+    pytest.main([__file__, "-v"])
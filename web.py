@@ -43,7 +43,27 @@ async def lifespan(app: FastAPI):
     # 清理资源
     log.info("开始关闭 AMB2API 主服务")
     
-    # 首先关闭所有异步任务
+    # 保存尚未写入的速率限制状态
+    try:
+        from src.services.rate_limiter import close_rate_limiter
+        await close_rate_limiter()
+    except Exception as e:
+        log.error(f"保存速率限制状态时出错: {e}")
+    
+    # 保存尚未写入的密钥调用统计
+    try:
+        from src.stats.stats_tracker import close_stats_tracker
+        await close_stats_tracker()
+    except Exception as e:
+        log.error(f"保存密钥统计时出错: {e}")
+    
+    try:
+        from src.stats.unified_stats import close_unified_stats
+        await close_unified_stats()
+    except Exception as e:
+        log.error(f"保存统一统计时出错: {e}")
+    
+    # 关闭所有异步任务
     try:
         await shutdown_all_tasks(timeout=10.0)
         log.info("所有异步任务已关闭")